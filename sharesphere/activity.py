@@ -0,0 +1,189 @@
+# sharesphere/activity.py
+
+from .background import BatchWriter, PeriodicJob
+from .database import SessionLocal
+from .models import AccessEvent, AccessStat, RollupState, File, User
+from .tiering import touch_file
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import Counter
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("upload", "download", "preview", "delete")
+READ_EVENTS = ("download", "preview")  # Keep a file out of the archive tier
+FLUSH_INTERVAL_SECONDS = 2.0
+MAX_BATCH = 1000
+ROLLUP_INTERVAL_SECONDS = 300
+ROLLUP_BATCH_SIZE = 10000
+
+def _write_events(events):
+    db = SessionLocal()
+    try:
+        db.execute(insert(AccessEvent), events)
+        db.commit()
+    finally:
+        db.close()
+
+_writer = BatchWriter("access-event-writer", _write_events, FLUSH_INTERVAL_SECONDS, MAX_BATCH)
+
+def record_event(event_type: str, file_id: int = None, user_id: int = None):
+    """Buffer an access event; it is written to the database in the next batch."""
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown access event type '{event_type}'.")
+    _writer.put({
+        "event_type": event_type,
+        "file_id": file_id,
+        "user_id": user_id,
+        "occurred_at": datetime.utcnow(),
+    })
+    if event_type in READ_EVENTS:
+        touch_file(file_id)
+
+def flush_events():
+    _writer.flush()
+
+def _bucket(moment: datetime, period: str) -> datetime:
+    if period == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def rollup_access_events(batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """
+    Fold access events recorded since the last run into hourly and daily
+    AccessStat rows.
+
+    Each batch of events and the high-water mark are committed together, so
+    an interrupted run never counts an event twice.
+
+    Returns:
+        int: Number of events rolled up.
+    """
+    flush_events()
+    processed = 0
+    while True:
+        db = SessionLocal()
+        try:
+            last_id = db.query(RollupState.last_id).filter(RollupState.name == "access_events").scalar()
+            if last_id is None:
+                db.execute(sqlite_insert(RollupState.__table__).on_conflict_do_nothing(), {"name": "access_events", "last_id": 0})
+                db.commit()
+                continue
+            events = (
+                db.query(AccessEvent.id, AccessEvent.event_type, AccessEvent.file_id, AccessEvent.user_id, AccessEvent.occurred_at)
+                .filter(AccessEvent.id > last_id)
+                .order_by(AccessEvent.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                db.commit()
+                return processed
+
+            counts = Counter()
+            for event in events:
+                for period in ("hour", "day"):
+                    bucket = _bucket(event.occurred_at, period)
+                    counts[(period, "all", 0, bucket, event.event_type)] += 1
+                    if event.file_id is not None:
+                        counts[(period, "file", event.file_id, bucket, event.event_type)] += 1
+                    if event.user_id is not None:
+                        counts[(period, "user", event.user_id, bucket, event.event_type)] += 1
+
+            # Claim the batch first: app processes and the worker may run rollups
+            # concurrently, and only the one that moves the mark from `last_id` wins.
+            claimed = db.execute(
+                update(RollupState)
+                .where(RollupState.name == "access_events", RollupState.last_id == last_id)
+                .values(last_id=events[-1].id, updated_at=datetime.utcnow())
+            )
+            if claimed.rowcount != 1:
+                db.rollback()
+                continue
+
+            rows = [
+                {"period": period, "scope": scope, "subject_id": subject_id, "bucket": bucket, "event_type": event_type, "count": count}
+                for (period, scope, subject_id, bucket, event_type), count in counts.items()
+            ]
+            stmt = sqlite_insert(AccessStat.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["period", "scope", "subject_id", "bucket", "event_type"],
+                set_={"count": AccessStat.__table__.c.count + stmt.excluded.count},
+            )
+            db.execute(stmt, rows)
+            db.commit()
+            processed += len(events)
+            logger.debug(f"Rolled up {len(events)} access event(s) into {len(rows)} stat row(s).")
+        finally:
+            db.close()
+
+_rollup_job = PeriodicJob("access-rollup", rollup_access_events, ROLLUP_INTERVAL_SECONDS)
+
+def start_rollup_job():
+    """Start the periodic rollup thread for this process (idempotent)."""
+    _rollup_job.start()
+
+def _since(days: int) -> datetime:
+    return _bucket(datetime.utcnow(), "day") - timedelta(days=days - 1)
+
+def top_files(days: int = 7, event_type: str = "download", limit: int = 10):
+    """Return (file_id, filename, count) rows for the most accessed files over the last `days` days."""
+    db = SessionLocal()
+    total = func.sum(AccessStat.count).label("count")
+    rows = (
+        db.query(AccessStat.subject_id, File.filename, total)
+        .outerjoin(File, File.id == AccessStat.subject_id)
+        .filter(
+            AccessStat.period == "day",
+            AccessStat.scope == "file",
+            AccessStat.bucket >= _since(days),
+            AccessStat.event_type == event_type,
+        )
+        .group_by(AccessStat.subject_id, File.filename)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return rows
+
+def active_users(days: int = 7, limit: int = 10):
+    """Return (user_id, username, count) rows for the users with the most events over the last `days` days."""
+    db = SessionLocal()
+    total = func.sum(AccessStat.count).label("count")
+    rows = (
+        db.query(AccessStat.subject_id, User.username, total)
+        .outerjoin(User, User.id == AccessStat.subject_id)
+        .filter(
+            AccessStat.period == "day",
+            AccessStat.scope == "user",
+            AccessStat.bucket >= _since(days),
+        )
+        .group_by(AccessStat.subject_id, User.username)
+        .order_by(total.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return rows
+
+def traffic(period: str = "hour", since: datetime = None):
+    """Return instance-wide (bucket, event_type, count) rows for `period` buckets starting at `since`."""
+    if since is None:
+        since = datetime.utcnow() - (timedelta(hours=24) if period == "hour" else timedelta(days=30))
+    db = SessionLocal()
+    rows = (
+        db.query(AccessStat.bucket, AccessStat.event_type, AccessStat.count)
+        .filter(
+            AccessStat.period == period,
+            AccessStat.scope == "all",
+            AccessStat.subject_id == 0,
+            AccessStat.bucket >= _bucket(since, period),
+        )
+        .order_by(AccessStat.bucket)
+        .all()
+    )
+    db.close()
+    return rows
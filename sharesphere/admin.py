@@ -1,30 +1,151 @@
 # sharesphere/admin.py
 
 from .database import SessionLocal
-from .models import User, File, FileSharing, Group, GroupRequest
+from .models import User, File, FileSharing, Group, GroupClosure, GroupRequest, ArchivedGroupRequest, user_group_association
+from .groups import add_group, member_ids, move_group
+from .jobs import forget_file_jobs
 from .auth import create_user, get_user_by_username, update_user_password
-from .config import load_config
+from .config import get_config, get_config_service
+from .tiering import release_archived, remove_dead_packs
+from .versioning import release_versions, remove_chunk_blobs, remove_version_files
+from . import stats
 from omegaconf import OmegaConf
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.orm import aliased
+from datetime import datetime, timedelta
+from pathlib import Path
 import logging
 import os
 
 logger = logging.getLogger(__name__)
 
+ARCHIVED = "archived"  # Status filter for the archive of resolved group requests
+ARCHIVE_BATCH_SIZE = 1000
+
 def list_users():
     db = SessionLocal()
     users = db.query(User).all()
     db.close()
     return users
 
+# Columns the admin listings may be sorted by, keyed by the name used in the UI.
+USER_SORT_COLUMNS = {
+    "id": User.id,
+    "username": User.username,
+    "created_at": User.created_at,
+}
+FILE_SORT_COLUMNS = {
+    "id": File.id,
+    "filename": File.filename,
+    "owner": User.username,
+    "uploaded_at": File.uploaded_at,
+}
+GROUP_SORT_COLUMNS = {
+    "id": Group.id,
+    "name": Group.name,
+    "created_at": Group.created_at,
+}
+GROUP_REQUEST_SORT_COLUMNS = {
+    "id": GroupRequest.id,
+    "user": User.username,
+    "group": Group.name,
+    "created_at": GroupRequest.created_at,
+}
+
+def _order_by(columns: dict, sort_by: str, descending: bool):
+    column = columns.get(sort_by, next(iter(columns.values())))
+    return column.desc() if descending else column.asc()
+
+def _page(query, page: int, page_size: int):
+    page = max(int(page), 1)
+    return query.offset((page - 1) * page_size).limit(page_size).all()
+
+def count_users(search: str = None):
+    db = SessionLocal()
+    query = db.query(func.count(User.id))
+    if search:
+        query = query.filter(User.username.contains(search))
+    total = query.scalar()
+    db.close()
+    return total
+
+def list_users_page(page: int = 1, page_size: int = 25, sort_by: str = "id", descending: bool = False, search: str = None):
+    """
+    Return one page of users as (id, username, is_admin, created_at) rows.
+    """
+    db = SessionLocal()
+    query = db.query(User.id, User.username, User.is_admin, User.created_at)
+    if search:
+        query = query.filter(User.username.contains(search))
+    query = query.order_by(_order_by(USER_SORT_COLUMNS, sort_by, descending), User.id)
+    rows = _page(query, page, page_size)
+    db.close()
+    return rows
+
+def _file_filters(owner: str = None, uploaded_after=None, uploaded_before=None):
+    filters = [File.deleted_at.is_(None)]
+    if owner:
+        filters.append(User.username == owner)
+    if uploaded_after:
+        filters.append(File.uploaded_at >= uploaded_after)
+    if uploaded_before:
+        filters.append(File.uploaded_at < uploaded_before)
+    return filters
+
+def count_files(owner: str = None, uploaded_after=None, uploaded_before=None):
+    db = SessionLocal()
+    query = db.query(func.count(File.id))
+    if owner:
+        query = query.join(User, File.owner_id == User.id)
+    total = query.filter(*_file_filters(owner, uploaded_after, uploaded_before)).scalar()
+    db.close()
+    return total
+
+def list_files_page(page: int = 1, page_size: int = 25, sort_by: str = "uploaded_at", descending: bool = True,
+                    owner: str = None, uploaded_after=None, uploaded_before=None):
+    """
+    Return one page of files as (id, filename, owner, uploaded_at) rows.
+
+    Args:
+        owner (str, optional): Only include files owned by this username.
+        uploaded_after (datetime, optional): Inclusive lower bound on the upload time.
+        uploaded_before (datetime, optional): Exclusive upper bound on the upload time.
+    """
+    db = SessionLocal()
+    query = (
+        db.query(File.id, File.filename, User.username.label("owner"), File.uploaded_at)
+        .outerjoin(User, File.owner_id == User.id)
+        .filter(*_file_filters(owner, uploaded_after, uploaded_before))
+        .order_by(_order_by(FILE_SORT_COLUMNS, sort_by, descending), File.id)
+    )
+    rows = _page(query, page, page_size)
+    db.close()
+    return rows
+
+def search_files(term: str, limit: int = 20):
+    """Return up to `limit` (id, filename, owner) rows whose filename contains `term`."""
+    db = SessionLocal()
+    rows = (
+        db.query(File.id, File.filename, User.username.label("owner"))
+        .outerjoin(User, File.owner_id == User.id)
+        .filter(File.filename.contains(term), File.deleted_at.is_(None))
+        .order_by(File.uploaded_at.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return rows
+
 def create_new_user(username: str, password: str, is_admin: bool = False, group_names: list = []):
     user = create_user(username, password, is_admin)
     if user:
         db = SessionLocal()
-        for group_name in group_names:
-            group = db.query(Group).filter(Group.name == group_name).first()
-            if group:
-                group.members.append(user)
-        db.commit()
+        group_ids = [row.id for row in db.query(Group.id).filter(Group.name.in_(group_names))] if group_names else []
+        if group_ids:
+            # Insert the memberships directly; appending to group.members would load every member first
+            db.execute(insert(user_group_association), [{"user_id": user.id, "group_id": group_id} for group_id in group_ids])
+            stats.add_memberships(db, [(user.id, group_id) for group_id in group_ids])
+            db.commit()
         db.close()
         logger.info(f"Admin created user '{username}' and assigned to groups: {group_names}.")
     return user
@@ -37,20 +158,45 @@ def delete_user(user_id: int):
         logger.warning(f"Admin attempted to delete nonexistent user ID '{user_id}'.")
         return False, "User not found."
     try:
-        # Delete user files
-        user_folder = os.path.join("uploads", user.username)
-        if os.path.exists(user_folder):
-            for file in os.listdir(user_folder):
-                file_path = os.path.join(user_folder, file)
-                os.remove(file_path)
-            os.rmdir(user_folder)
-        
+        username = user.username
+        # Delete the user's file rows now and their bytes once the deletion commits
+        files = db.query(File.id, File.filepath, File.preview_path).filter(File.owner_id == user_id).all()
+        file_ids = [file.id for file in files]
+        unreferenced, pending = [], []
+        packs = set()
+        stats.forget_files(db, file_ids)
+        stats.forget_shares(db, [
+            file_id for (file_id,) in db.query(FileSharing.file_id).filter(
+                FileSharing.user_id == user_id, FileSharing.file_id.notin_(file_ids)
+            )
+        ])
+        stats.forget_user(db, user_id)
+        if file_ids:
+            db.query(FileSharing).filter(FileSharing.file_id.in_(file_ids)).delete(synchronize_session=False)
+            unreferenced, pending = release_versions(db, file_ids)
+            packs = release_archived(db, file_ids)
+            forget_file_jobs(db, file_ids)
+            db.query(File).filter(File.id.in_(file_ids)).delete(synchronize_session=False)
         # Delete user from database
         db.delete(user)
         # Also delete shared files
         db.query(FileSharing).filter(FileSharing.user_id == user_id).delete()
         db.commit()
-        logger.info(f"Admin deleted user '{user.username}' and their data.")
+        for file in files:
+            for path in filter(None, (file.filepath, file.preview_path)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Could not remove '{path}' (file ID {file.id}) after deleting its record: {e}")
+        user_folder = os.path.join(get_config().upload.folder, username)
+        if os.path.isdir(user_folder) and not os.listdir(user_folder):
+            os.rmdir(user_folder)
+        remove_chunk_blobs(unreferenced)
+        remove_version_files(pending)
+        remove_dead_packs(packs)
+        logger.info(f"Admin deleted user '{username}' and their data.")
         db.close()
         return True, "User deleted successfully."
     except Exception as e:
@@ -68,7 +214,7 @@ def reset_user_password(user_id: int, new_password: str):
         return False, "Failed to reset password."
 
 def get_system_logs():
-    log_file = os.path.join("logs", "app.log")
+    log_file = os.path.join(get_config().logging.folder, "app.log")
     if os.path.exists(log_file):
         with open(log_file, "r") as f:
             logs = f.readlines()
@@ -82,53 +228,281 @@ def list_groups():
     db.close()
     return groups
 
-def create_new_group(name: str):
+def list_user_groups(user_id: int):
+    """
+    Return (id, name, created_at, depth) rows of the groups `user_id` belongs
+    to, directly (depth 0) or through a subgroup that many levels down, ordered by name.
+    """
+    db = SessionLocal()
+    rows = (
+        db.query(Group.id, Group.name, Group.created_at, func.min(GroupClosure.depth).label("depth"))
+        .join(GroupClosure, GroupClosure.ancestor_id == Group.id)
+        .join(user_group_association, user_group_association.c.group_id == GroupClosure.descendant_id)
+        .filter(user_group_association.c.user_id == user_id)
+        .group_by(Group.id)
+        .order_by(Group.name)
+        .all()
+    )
+    db.close()
+    return rows
+
+def list_group_members(group_id: int):
+    """Return (id, username) rows of the users in `group_id` or any of its subgroups, ordered by username."""
+    db = SessionLocal()
+    rows = db.query(User.id, User.username).filter(User.id.in_(member_ids([group_id]))).order_by(User.username).all()
+    db.close()
+    return rows
+
+def count_groups():
+    db = SessionLocal()
+    total = db.query(func.count(Group.id)).scalar()
+    db.close()
+    return total
+
+def list_groups_page(page: int = 1, page_size: int = 25, sort_by: str = "id", descending: bool = False):
+    """
+    Return one page of groups as (id, name, parent, created_at) rows; parent is the parent group's name or None.
+    """
+    db = SessionLocal()
+    parent = aliased(Group)
+    query = db.query(Group.id, Group.name, parent.name.label("parent"), Group.created_at).outerjoin(
+        parent, parent.id == Group.parent_id
+    ).order_by(_order_by(GROUP_SORT_COLUMNS, sort_by, descending), Group.id)
+    rows = _page(query, page, page_size)
+    db.close()
+    return rows
+
+def create_new_group(name: str, parent_id: int = None):
+    """Create a group, as a subgroup of `parent_id` if given; returns None if the name is taken or the parent is gone."""
     db = SessionLocal()
     group = db.query(Group).filter(Group.name == name).first()
-    if group:
+    if group or (parent_id is not None and db.get(Group, parent_id) is None):
         db.close()
         return None
-    new_group = Group(name=name)
+    new_group = Group(name=name, parent_id=parent_id)
     db.add(new_group)
+    db.flush()
+    add_group(db, new_group.id, parent_id)
+    stats.add_group(db, new_group.id)
     db.commit()
     db.refresh(new_group)
     db.close()
     return new_group
 
-def list_group_requests():
+def set_group_parent(group_id: int, parent_id: int = None):
+    """
+    Move a group, with its subgroups, under `parent_id`, or to the top level if None.
+
+    Its members stop counting as members of its former ancestors and start
+    counting in the new ones, which changes who sharing with those groups reaches.
+
+    Returns:
+        tuple: (success, message)
+    """
+    db = SessionLocal()
+    try:
+        group = db.query(Group.id, Group.name, Group.parent_id).filter(Group.id == group_id).first()
+        if group is None:
+            return False, "Group not found."
+        if group.parent_id == parent_id:
+            return True, "The group is already there."
+        if parent_id is not None and db.get(Group, parent_id) is None:
+            return False, "Parent group not found."
+        try:
+            affected = move_group(db, group_id, parent_id)
+        except ValueError as e:
+            return False, str(e)
+        stats.refresh_groups(db, affected)
+        db.commit()
+    finally:
+        db.close()
+    logger.info(f"Admin moved group '{group.name}' (ID {group_id}) under group ID {parent_id}.")
+    return True, f"Group '{group.name}' moved."
+
+def list_group_requests(status: str = "pending"):
     db = SessionLocal()
-    requests = db.query(GroupRequest).all()
+    query = db.query(GroupRequest)
+    if status:
+        query = query.filter(GroupRequest.status == status)
+    requests = query.order_by(GroupRequest.created_at, GroupRequest.id).all()
     db.close()
     return requests
 
-def approve_group_request(request_id: int):
+def _group_request_table(status: str):
+    """Resolved requests past the retention are only in the archive table."""
+    return ArchivedGroupRequest if status == ARCHIVED else GroupRequest
+
+def count_group_requests(status: str = None):
+    db = SessionLocal()
+    table = _group_request_table(status)
+    query = db.query(func.count(table.id))
+    if status and status != ARCHIVED:
+        query = query.filter(table.status == status)
+    total = query.scalar()
+    db.close()
+    return total
+
+def list_group_requests_page(page: int = 1, page_size: int = 25, status: str = None, sort_by: str = "created_at", descending: bool = True):
+    """
+    Return one page of group requests as (id, user, group, status, created_at) rows.
+
+    `status` "archived" pages through the archive of old resolved requests.
+    """
+    db = SessionLocal()
+    table = _group_request_table(status)
+    query = (
+        db.query(
+            table.id,
+            User.username.label("user"),
+            Group.name.label("group"),
+            table.status,
+            table.created_at,
+        )
+        .outerjoin(User, table.user_id == User.id)
+        .outerjoin(Group, table.group_id == Group.id)
+    )
+    if status and status != ARCHIVED:
+        query = query.filter(table.status == status)
+    sort_columns = dict(GROUP_REQUEST_SORT_COLUMNS, id=table.id, created_at=table.created_at)
+    query = query.order_by(_order_by(sort_columns, sort_by, descending), table.id)
+    rows = _page(query, page, page_size)
+    db.close()
+    return rows
+
+def _resolve_group_requests(db, request_ids: list, status: str) -> int:
+    """Mark the still-pending requests among `request_ids` as `status`; return how many changed."""
+    result = db.execute(
+        update(GroupRequest)
+        .where(GroupRequest.id.in_(request_ids), GroupRequest.status == "pending")
+        .values(status=status, resolved_at=datetime.utcnow())
+    )
+    return result.rowcount
+
+def approve_group_requests(request_ids: list):
+    """
+    Approve pending group requests and add their memberships in one transaction.
+
+    Memberships are added with a single INSERT ... SELECT that skips pairs
+    already in the group and requests repeated in the selection.
+
+    Returns:
+        tuple: (True, message) if any request was approved, else (False, message).
+    """
+    request_ids = list(request_ids)
+    if not request_ids:
+        return False, "No group requests selected."
     db = SessionLocal()
-    request = db.query(GroupRequest).filter(GroupRequest.id == request_id).first()
-    if request:
-        request.status = "approved"
-        group = db.query(Group).filter(Group.id == request.group_id).first()
-        user = db.query(User).filter(User.id == request.user_id).first()
-        group.members.append(user)
+    try:
+        approved = _resolve_group_requests(db, request_ids, "approved")
+        if approved:
+            already_member = select(user_group_association.c.user_id).where(
+                user_group_association.c.user_id == GroupRequest.user_id,
+                user_group_association.c.group_id == GroupRequest.group_id,
+            ).exists()
+            new_members = (
+                select(GroupRequest.user_id, GroupRequest.group_id)
+                .where(GroupRequest.id.in_(request_ids), GroupRequest.status == "approved", ~already_member)
+                .distinct()
+            )
+            added = db.execute(
+                insert(user_group_association)
+                .from_select(["user_id", "group_id"], new_members)
+                .returning(user_group_association.c.user_id, user_group_association.c.group_id)
+            ).all()
+            stats.add_memberships(db, added)
         db.commit()
+    finally:
         db.close()
-        return True, "Group request approved."
-    db.close()
-    return False, "Group request not found."
+    if not approved:
+        return False, "Group request not found or already resolved." if len(request_ids) == 1 else "None of the selected requests are pending."
+    logger.info(f"Admin approved {approved} group request(s).")
+    skipped = len(set(request_ids)) - approved
+    return True, "Group request approved." if len(request_ids) == 1 else (
+        f"Approved {approved} group request(s)." + (f" {skipped} were no longer pending." if skipped else "")
+    )
 
-def reject_group_request(request_id: int):
+def reject_group_requests(request_ids: list):
+    """
+    Reject pending group requests in one statement.
+
+    Returns:
+        tuple: (True, message) if any request was rejected, else (False, message).
+    """
+    request_ids = list(request_ids)
+    if not request_ids:
+        return False, "No group requests selected."
     db = SessionLocal()
-    request = db.query(GroupRequest).filter(GroupRequest.id == request_id).first()
-    if request:
-        request.status = "rejected"
+    try:
+        rejected = _resolve_group_requests(db, request_ids, "rejected")
         db.commit()
+    finally:
         db.close()
-        return True, "Group request rejected."
-    db.close()
-    return False, "Group request not found."
+    if not rejected:
+        return False, "Group request not found or already resolved." if len(request_ids) == 1 else "None of the selected requests are pending."
+    logger.info(f"Admin rejected {rejected} group request(s).")
+    skipped = len(set(request_ids)) - rejected
+    return True, "Group request rejected." if len(request_ids) == 1 else (
+        f"Rejected {rejected} group request(s)." + (f" {skipped} were no longer pending." if skipped else "")
+    )
+
+def approve_group_request(request_id: int):
+    return approve_group_requests([request_id])
+
+def reject_group_request(request_id: int):
+    return reject_group_requests([request_id])
+
+def group_request_retention_days() -> int:
+    return get_config_service().get().get("group_requests", {}).get("archive_after_days", 90)
+
+def archive_group_requests(retention_days: int = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move requests resolved more than `retention_days` ago (default
+    group_requests.archive_after_days) to the archive table, a batch per
+    transaction, so the live table only holds the pending queue and recent history.
+
+    Returns:
+        int: Number of requests archived.
+    """
+    if retention_days is None:
+        retention_days = group_request_retention_days()
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    resolved_at = func.coalesce(GroupRequest.resolved_at, GroupRequest.created_at)
+    columns = ["user_id", "group_id", "status", "created_at", "resolved_at"]
+    archived = 0
+    while True:
+        db = SessionLocal()
+        try:
+            ids = db.execute(
+                select(GroupRequest.id)
+                .where(GroupRequest.status != "pending", resolved_at < cutoff)
+                .order_by(GroupRequest.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            db.execute(
+                insert(ArchivedGroupRequest).from_select(
+                    columns + ["archived_at"],
+                    select(*[getattr(GroupRequest, column) for column in columns], literal(datetime.utcnow()))
+                    .where(GroupRequest.id.in_(ids)),
+                )
+            )
+            db.execute(delete(GroupRequest).where(GroupRequest.id.in_(ids)))
+            db.commit()
+            archived += len(ids)
+        finally:
+            db.close()
+    if archived:
+        logger.info(f"Archived {archived} resolved group request(s).")
+    return archived
 
 def update_config(new_config):
     """
     Update the configuration file with new settings.
+
+    The new settings are merged over the current configuration, so sections
+    not edited in the admin panel are preserved. Running processes pick the
+    change up through the config service.
     
     Args:
         new_config (dict): New configuration settings.
@@ -141,7 +515,9 @@ def update_config(new_config):
         config_path = Path(os.getcwd()) / "config.yaml"
     
     try:
-        OmegaConf.save(config=OmegaConf.create(new_config), f=config_path)
+        merged_config = OmegaConf.merge(get_config(), OmegaConf.create(new_config))
+        OmegaConf.save(config=merged_config, f=config_path)
+        get_config_service().reload()
         logger.info("Configuration updated successfully.")
         return True
     except Exception as e:
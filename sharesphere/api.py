@@ -0,0 +1,362 @@
+# sharesphere/api.py
+
+"""
+Headless HTTP API for scripted uploads, listings, downloads and sharing.
+
+A plain ASGI application served by `sharesphere api` (or `sharesphere start
+--api`). Requests authenticate with `Authorization: Bearer <token>`; tokens
+are created with `sharesphere token create` or from the User Settings page.
+
+    GET  /api/health
+    GET  /api/files?page=1&page_size=50
+    POST /api/files?filename=report.xlsx&comment=...&share_users=a,b&share_groups=g
+    GET  /api/files/<id>                      (supports single Range requests)
+    POST /api/files/<id>/share                {"users": [...], "groups": [...]}
+"""
+
+from . import file_manager, limits
+from .activity import record_event, flush_events
+from .auth import get_user_by_api_token
+from .database import SessionLocal, init_db
+from .models import User, Group
+from .notifications import notify_download, flush_notifications
+from .tiering import ensure_hot
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote
+import asyncio
+import json
+import logging
+import mimetypes
+import re
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MAX_JSON_BODY = 1024 * 1024
+MAX_PAGE_SIZE = 500
+SLOT_WAITER_THREADS = 64
+
+# Requests waiting for a transfer slot block one of these threads (see sharesphere/limits.py)
+_slot_waiters = ThreadPoolExecutor(max_workers=SLOT_WAITER_THREADS, thread_name_prefix="slot-wait")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query = {key: values[-1] for key, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+        self.headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        self.user_id = None
+        self.username = None
+
+    async def stream(self):
+        """Yield the request body chunk by chunk as the client sends it."""
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "Client disconnected.")
+            body = message.get("body", b"")
+            if body:
+                yield body
+            if not message.get("more_body", False):
+                return
+
+    async def json(self):
+        body = b""
+        async for chunk in self.stream():
+            body += chunk
+            if len(body) > MAX_JSON_BODY:
+                raise HTTPError(413, "Request body too large.")
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Request body must be JSON.")
+
+    def int_param(self, name: str, default: int, maximum: int = None) -> int:
+        try:
+            value = int(self.query.get(name, default))
+        except ValueError:
+            raise HTTPError(400, f"Query parameter '{name}' must be an integer.")
+        if value < 1:
+            raise HTTPError(400, f"Query parameter '{name}' must be positive.")
+        return min(value, maximum) if maximum else value
+
+    def list_param(self, name: str) -> list:
+        return [item.strip() for item in self.query.get(name, "").split(",") if item.strip()]
+
+
+async def send_json(send, status: int, payload, headers=()):
+    body = json.dumps(payload, default=str).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def authenticate(request: Request):
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPError(401, "Missing bearer token.", [(b"www-authenticate", b"Bearer")])
+    # Looked up on every request (one indexed query) so a revoked token stops working at once
+    user = await asyncio.to_thread(get_user_by_api_token, token)
+    if not user:
+        raise HTTPError(401, "Invalid API token.", [(b"www-authenticate", b"Bearer")])
+    request.user_id, request.username = user.id, user.username
+
+
+def _resolve_names(usernames: list, group_names: list):
+    """Map usernames and group names to IDs; raise HTTPError for unknown names."""
+    db = SessionLocal()
+    try:
+        users = dict(db.query(User.username, User.id).filter(User.username.in_(usernames)).all()) if usernames else {}
+        groups = dict(db.query(Group.name, Group.id).filter(Group.name.in_(group_names)).all()) if group_names else {}
+    finally:
+        db.close()
+    unknown = [name for name in usernames if name not in users] + [name for name in group_names if name not in groups]
+    if unknown:
+        raise HTTPError(400, f"Unknown users or groups: {', '.join(unknown)}.")
+    return list(users.values()), list(groups.values())
+
+
+def parse_range(header: str, size: int):
+    """
+    Parse a single-range `Range` header.
+
+    Returns:
+        tuple or None: (start, end) with `end` exclusive, or None to serve the whole file.
+
+    Raises:
+        HTTPError: 416 if the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None  # Multiple ranges are not supported; ignoring the header is allowed
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            start, end = max(size - int(last), 0), size
+            if int(last) == 0:
+                start = size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise HTTPError(416, "Requested range not satisfiable.", [(b"content-range", f"bytes */{size}".encode())])
+    return start, end
+
+
+async def health(request, send):
+    await send_json(send, 200, {"status": "ok"})
+
+
+async def list_files(request, send):
+    page = request.int_param("page", 1)
+    page_size = request.int_param("page_size", 50, MAX_PAGE_SIZE)
+    total = await asyncio.to_thread(file_manager.count_accessible_files, request.user_id)
+    rows = await asyncio.to_thread(file_manager.list_accessible_files, request.user_id, page, page_size)
+    await send_json(send, 200, {
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "files": [
+            {
+                "id": row.id,
+                "filename": row.filename,
+                "owner": row.owner,
+                "uploaded_at": row.uploaded_at.isoformat() if row.uploaded_at else None,
+                "comment": row.comment,
+                "shared_with_me": row.owner_id != request.user_id,
+            }
+            for row in rows
+        ],
+    })
+
+
+async def acquire_transfer_slot(request) -> bool:
+    """Wait for a transfer slot on threads of our own, so queued requests never tie up asyncio's default pool."""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            _slot_waiters, limits.acquire_slot, request.user_id, request.username
+        )
+    except limits.TransferQueueTimeout as e:
+        raise HTTPError(503, f"Server busy: {e}", [(b"retry-after", b"5")])
+
+
+async def upload(request, send):
+    try:
+        filename = file_manager.safe_filename(request.query.get("filename", ""))
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    declared_size = request.headers.get("content-length", "")
+    allowed, reason = file_manager.check_upload_allowed(filename, int(declared_size) if declared_size.isdigit() else 0)
+    if not allowed:
+        raise HTTPError(400, reason)
+    user_ids, group_ids = await asyncio.to_thread(
+        _resolve_names, request.list_param("share_users"), request.list_param("share_groups")
+    )
+
+    file_path = await asyncio.to_thread(file_manager.upload_path, request.username, filename)
+    held = await acquire_transfer_slot(request)
+    try:
+        writer = await asyncio.to_thread(file_manager.UploadWriter, file_path)
+        max_size = file_manager.upload_settings["max_file_size"]
+        try:
+            # The body goes straight to disk chunk by chunk; it is never held in memory
+            async for chunk in request.stream():
+                if max_size and writer.size + len(chunk) > max_size:
+                    raise HTTPError(413, f"File exceeds the maximum size of {max_size} bytes.")
+                await asyncio.sleep(limits.reserve(request.user_id, len(chunk), "upload"))
+                await asyncio.to_thread(writer.write, chunk)
+            await asyncio.to_thread(writer.commit)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+    finally:
+        limits.release_slot(request.user_id, held)
+    logger.info(f"File '{filename}' ({writer.size} bytes) uploaded through the API by user ID {request.user_id}.")
+
+    try:
+        file_id = await asyncio.to_thread(
+            file_manager.register_file,
+            request.user_id,
+            filename,
+            writer.file_path,
+            request.query.get("comment"),
+            False,
+            user_ids,
+            group_ids,
+        )
+    except Exception:
+        await asyncio.to_thread(file_manager.discard_uploads, [writer.file_path])
+        raise
+    await send_json(send, 201, {"id": file_id, "filename": filename, "size": writer.size})
+
+
+async def download(request, send, file_id):
+    file = await asyncio.to_thread(file_manager.get_accessible_file, int(file_id), request.user_id)
+    if not file:
+        raise HTTPError(404, "File not found.")
+    try:
+        # Archived files are restored first, so the response starts once their bytes are back
+        if not await asyncio.to_thread(ensure_hot, file.id):
+            raise HTTPError(404, "File content is missing.")
+        size = await asyncio.to_thread(file_manager.file_size, file.filepath)
+    except OSError:
+        raise HTTPError(404, "File content is missing.")
+
+    status, start, end = 200, 0, size
+    headers = [
+        (b"content-type", (mimetypes.guess_type(file.filename)[0] or "application/octet-stream").encode()),
+        (b"accept-ranges", b"bytes"),
+        (b"content-disposition", f"attachment; filename*=UTF-8''{quote(file.filename)}".encode()),
+    ]
+    byte_range = parse_range(request.headers["range"], size) if "range" in request.headers else None
+    if byte_range:
+        status, (start, end) = 206, byte_range
+        headers.append((b"content-range", f"bytes {start}-{end - 1}/{size}".encode()))
+    headers.append((b"content-length", str(end - start).encode()))
+
+    held = await acquire_transfer_slot(request)
+    try:
+        chunks = file_manager.iter_file(file.filepath, start, end, CHUNK_SIZE)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            await asyncio.sleep(limits.reserve(request.user_id, len(chunk), "download"))
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        limits.release_slot(request.user_id, held)
+
+    record_event("download", file.id, request.user_id)
+    notify_download(file.owner_id, request.user_id, request.username, file.id, file.filename)
+
+
+async def share(request, send, file_id):
+    body = await request.json()
+    usernames, group_names = body.get("users", []), body.get("groups", [])
+    if not isinstance(usernames, list) or not isinstance(group_names, list):
+        raise HTTPError(400, "'users' and 'groups' must be lists of names.")
+    user_ids, group_ids = await asyncio.to_thread(_resolve_names, usernames, group_names)
+    success, message = await asyncio.to_thread(file_manager.share_file, int(file_id), request.user_id, user_ids, group_ids)
+    if not success:
+        raise HTTPError(404 if message == "File not found." else 403, message)
+    await send_json(send, 200, {"message": message})
+
+
+# (method, path pattern, handler, requires authentication)
+ROUTES = [
+    ("GET", re.compile(r"^/api/health$"), health, False),
+    ("GET", re.compile(r"^/api/files$"), list_files, True),
+    ("POST", re.compile(r"^/api/files$"), upload, True),
+    ("GET", re.compile(r"^/api/files/(?P<file_id>\d+)$"), download, True),
+    ("POST", re.compile(r"^/api/files/(?P<file_id>\d+)/share$"), share, True),
+]
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.to_thread(init_db)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(flush_events)
+            await asyncio.to_thread(flush_notifications)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    request = Request(scope, receive)
+    response_started = False
+
+    async def tracking_send(message):
+        nonlocal response_started
+        response_started = True
+        await send(message)
+
+    try:
+        path_matched = False
+        for method, pattern, handler, needs_auth in ROUTES:
+            match = pattern.match(request.path)
+            if not match:
+                continue
+            path_matched = True
+            if method != request.method:
+                continue
+            if needs_auth:
+                await authenticate(request)
+            await handler(request, tracking_send, **match.groupdict())
+            return
+        raise HTTPError(405 if path_matched else 404, "Method not allowed." if path_matched else "Not found.")
+    except HTTPError as e:
+        if not response_started:
+            await send_json(send, e.status, {"error": e.message}, e.headers)
+    except Exception as e:
+        logger.error(f"API error on {request.method} {request.path}: {e}")
+        if not response_started:
+            await send_json(send, 500, {"error": "Internal server error."})
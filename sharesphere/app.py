@@ -2,26 +2,47 @@ import streamlit as st
 import logging
 import os
 import base64
-import pandas as pd
+import math
+import time
+from datetime import datetime, timedelta
 from omegaconf import DictConfig, OmegaConf
-from sqlalchemy.orm import joinedload
-from sharesphere.auth import authenticate_user, get_user_by_username
-from sharesphere.file_manager import upload_file, get_shared_files, delete_file
+from sharesphere.auth import authenticate_user, get_user_by_username, create_api_token, list_api_tokens, revoke_api_token
+from sharesphere.file_manager import upload_files, get_shared_files, iter_file, delete_file, restore_file, restore_version, list_trash, trash_retention_days, upload_settings
+from sharesphere.versioning import list_versions, iter_version
+from sharesphere.tiering import ensure_hot, is_archived
+from sharesphere.limits import TransferQueueTimeout, read_file, throttled, transfer_slot, transfer_stats, limit_settings
 from sharesphere.admin import (
-    list_users,
+    count_users,
+    list_users_page,
+    count_files,
+    list_files_page,
+    search_files,
+    count_groups,
+    list_groups_page,
+    count_group_requests,
+    list_group_requests_page,
     create_new_user,
     delete_user,
     reset_user_password,
     get_system_logs,
     list_groups,
+    list_user_groups,
+    list_group_members,
     create_new_group,
-    list_group_requests,
-    approve_group_request,
-    reject_group_request,
+    set_group_parent,
+    approve_group_requests,
+    reject_group_requests,
+    group_request_retention_days,
     update_config
 )
-from sharesphere.config import load_config
-from sharesphere.database import SessionLocal
+from sharesphere.activity import record_event, start_rollup_job, top_files, active_users, traffic
+from sharesphere.stats import dashboard_totals, rebuild_stats, top_groups_by_storage, top_users_by_storage, upload_history
+from sharesphere.profiling import (clear_profiles, forced as profiling_forced, list_profiles, profile_path, profile_rerun,
+                                   profiler_settings, profiling_enabled)
+from sharesphere.jobs import queue_depth, list_jobs, retry_failed_jobs
+from sharesphere.notifications import notify_download, unread_count, list_notifications, mark_all_read, format_notification
+from sharesphere.config import get_config, get_config_service
+from sharesphere.database import SessionLocal, init_db
 from sharesphere.models import User, Group, GroupRequest, File  # Ensure File is imported
 
 # === Streamlit Configuration ===
@@ -33,9 +54,9 @@ st.set_page_config(
 )
 
 # === Load Configuration ===
-config_path = os.getenv("SHARESPHERE_CONFIG_PATH", None)
+# Parsed once per process by the config service and reloaded when config.yaml changes
 try:
-    config: DictConfig = load_config(config_path)
+    config: DictConfig = get_config()
 except FileNotFoundError as e:
     st.error(f"Configuration file not found: {e}")
     st.stop()
@@ -59,10 +80,19 @@ def setup_logging(config: DictConfig):
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
         file_handler.setFormatter(formatter)
         logger.addHandler(file_handler)
-        logger.setLevel(getattr(logging, config.logging.level.upper(), logging.INFO))
+
+
+def apply_logging_level(config: DictConfig):
+    """Apply the configured logging level; called again whenever the configuration changes."""
+    level = getattr(logging, config.logging.level.upper(), logging.INFO)
+    logger.setLevel(level)
+    logging.getLogger("sharesphere").setLevel(level)
 
 
 setup_logging(config)
+get_config_service().subscribe("app.logging_level", apply_logging_level)
+init_db()
+start_rollup_job()
 
 # === Session State Initialization ===
 if 'authentication_status' not in st.session_state:
@@ -218,39 +248,27 @@ def logout():
     st.rerun()
 
 
-# === Function to Generate Download Links ===
-def get_download_link(file_path, filename):
-    """
-    Generate a download link for a given file with appropriate MIME type.
+def read_limited(user_id, file_path):
+    """Read a file for the signed-in user, queued and throttled by the transfer limits."""
+    return read_file(user_id, file_path, st.session_state.get("username"))
 
-    Args:
-        file_path (str): Path to the file.
-        filename (str): Name of the file.
 
-    Returns:
-        str: HTML anchor tag for downloading the file.
-    """
-    try:
-        with open(file_path, "rb") as f:
-            bytes_data = f.read()
-        encoded = base64.b64encode(bytes_data).decode()
-
-        # Determine MIME type based on file extension
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-            mime = 'image/jpeg'
-        elif filename.lower().endswith('.pdf'):
-            mime = 'application/pdf'
-        else:
-            mime = 'application/octet-stream'
-
-        href = f'<a href="data:{mime};base64,{encoded}" download="{filename}">📥 Download {filename}</a>'
-        return href
-    except Exception as e:
-        logger.error(f"Error generating download link for {filename}: {e}")
-        return "Error generating link."
+def read_preview(file_path):
+    """Read a file to show it on the page; previews are not transfers, so no slot or throttling applies."""
+    return b"".join(iter_file(file_path))
 
 
 # === Upload Interface with Interactive Elements ===
+# Expiry choices offered at upload time; None means never
+EXPIRY_OPTIONS = {
+    "Never": None,
+    "1 day": timedelta(days=1),
+    "7 days": timedelta(days=7),
+    "30 days": timedelta(days=30),
+    "90 days": timedelta(days=90),
+}
+
+
 def upload_interface(user_id, username):
     """Provide the interface for users to upload files."""
     st.header("📤 Upload Files")
@@ -266,13 +284,9 @@ def upload_interface(user_id, username):
 
     # Fetch users and groups for sharing
     db = SessionLocal()
-    user = db.query(User).filter(User.id == user_id).first()
-    user_groups = user.groups
-    group_ids = [group.id for group in user_groups]
-
-    users = db.query(User).filter(User.id != user_id).all()
-    groups = db.query(Group).filter(Group.id.in_(group_ids)).all()
+    users = db.query(User.id, User.username).filter(User.id != user_id).order_by(User.username).all()
     db.close()
+    groups = list_user_groups(user_id)
 
     with st.expander("🤔 Need Help?", expanded=True):
         st.write("""
@@ -296,9 +310,10 @@ def upload_interface(user_id, username):
         selected_users = []
 
     with st.form("upload_form"):
+        allowed_extensions = upload_settings["allowed_extensions"]
         uploaded_files = st.file_uploader(
             "Select files to upload",
-            type=None,
+            type=sorted(allowed_extensions) if allowed_extensions else None,
             accept_multiple_files=True,
             help="Upload multiple files by holding down the Ctrl or Command key.",
             key="upload_files"
@@ -308,36 +323,84 @@ def upload_interface(user_id, username):
             max_chars=200,
             help="Provide a brief description or note about the uploaded files."
         )
+        col1, col2 = st.columns(2)
+        with col1:
+            file_expiry = st.selectbox(
+                "Delete files after",
+                list(EXPIRY_OPTIONS),
+                help="The files are removed for everyone once this period has passed."
+            )
+        with col2:
+            share_expiry = st.selectbox(
+                "End sharing after",
+                list(EXPIRY_OPTIONS),
+                help="Recipients lose access once this period has passed; you keep the files."
+            )
         submit = st.form_submit_button("Upload Files")
 
     if submit and uploaded_files:
-        db = SessionLocal()
+        # Names are unique, so the lists fetched above already map them to IDs
         if share_option == "Share with Specific Users":
-            selected_user_objs = db.query(User).filter(User.username.in_(selected_users)).all()
-            selected_user_ids = [user.id for user in selected_user_objs]
+            selected_user_ids = [user.id for user in users if user.username in selected_users]
             selected_group_ids = []
         else:
-            selected_group_objs = db.query(Group).filter(Group.name.in_(selected_groups)).all()
-            selected_group_ids = [group.id for group in selected_group_objs]
+            selected_group_ids = [group.id for group in groups if group.name in selected_groups]
             selected_user_ids = []
-        db.close()
-
-        for uploaded_file in uploaded_files:
-            success, message = upload_file(
-                uploader_id=user_id,
-                uploader_name=username,
-                file_storage=uploaded_file,
-                file_comment=file_comment,
-                shared_with_group=(share_option == "Share with Group"),
-                shared_users=selected_user_ids,
-                shared_groups=selected_group_ids
-            )
+
+        # Write files in parallel, showing each file's status as it finishes
+        progress_bar = st.progress(0.0, text=f"Uploading {len(uploaded_files)} file(s)...")
+        status_lines = {uploaded_file.name: st.empty() for uploaded_file in uploaded_files}
+        for name, line in status_lines.items():
+            line.markdown(f"⏳ {name}")
+        finished = []
+
+        def on_progress(filename, success, message):
+            finished.append(filename)
+            line = status_lines.get(filename)
+            if line:
+                line.markdown(f"{'💾' if success else '❌'} {filename} — {message}")
+            progress_bar.progress(min(len(finished) / len(uploaded_files), 1.0), text=f"{len(finished)} of {len(uploaded_files)} file(s) processed")
+
+        now = datetime.utcnow()
+        expires_at = now + EXPIRY_OPTIONS[file_expiry] if EXPIRY_OPTIONS[file_expiry] else None
+        share_expires_at = now + EXPIRY_OPTIONS[share_expiry] if EXPIRY_OPTIONS[share_expiry] else None
+
+        started = time.perf_counter()
+        results = upload_files(
+            uploader_id=user_id,
+            uploader_name=username,
+            file_storages=uploaded_files,
+            file_comment=file_comment,
+            shared_with_group=(share_option == "Share with Group"),
+            shared_users=selected_user_ids,
+            shared_groups=selected_group_ids,
+            progress=on_progress,
+            expires_at=expires_at,
+            share_expires_at=share_expires_at,
+        )
+        elapsed = time.perf_counter() - started
+        progress_bar.empty()
+
+        uploaded_bytes = 0
+        sizes = {uploaded_file.name: uploaded_file.size for uploaded_file in uploaded_files}
+        for filename, success, message in results:
+            line = status_lines.get(filename) or st.empty()
             if success:
-                st.success(f"✅ {uploaded_file.name} uploaded successfully.")
-                logger.info(f"User '{username}' uploaded file '{uploaded_file.name}'.")
+                uploaded_bytes += sizes.get(filename, 0)
+                line.markdown(f"✅ {filename} uploaded successfully.")
+                logger.info(f"User '{username}' uploaded file '{filename}'.")
             else:
-                st.error(f"❌ Failed to upload {uploaded_file.name}.")
-                logger.error(f"User '{username}' failed to upload file '{uploaded_file.name}': {message}")
+                line.markdown(f"❌ Failed to upload {filename}: {message}")
+                logger.error(f"User '{username}' failed to upload file '{filename}': {message}")
+
+        succeeded = sum(1 for _, success, _ in results if success)
+        summary = f"Uploaded {succeeded} of {len(results)} file(s), {uploaded_bytes / (1024 * 1024):.1f} MB in {elapsed:.1f} s."
+        if succeeded == len(results):
+            st.success(f"✅ {summary}")
+        elif succeeded:
+            st.warning(f"⚠️ {summary}")
+        else:
+            st.error(f"❌ {summary}")
 
 
 # === Download Interface with Interactive Features ===
@@ -353,29 +416,24 @@ def download_interface(user_id):
     st.subheader("🔄 Your Files")
     if own_files:
         for file in own_files:
-            file_path = file.filepath
             filename = file.filename
             comment = file.comment if hasattr(file, 'comment') else ""  # Safely get comment
             st.markdown(f"### {filename}")
-            download_link = get_download_link(file_path, filename)
-            st.markdown(download_link, unsafe_allow_html=True)
-
-            # Preview based on file type
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                try:
-                    st.image(file_path, width=300, caption=comment)
-                except Exception as e:
-                    st.error(f"❌ Failed to load image `{filename}`.")
-                    logger.error(f"Error loading image '{filename}': {e}")
-            elif filename.lower().endswith('.pdf'):
-                try:
-                    with open(file_path, "rb") as f:
-                        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-                    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="600" type="application/pdf"></iframe>'
-                    st.markdown(pdf_display, unsafe_allow_html=True)
-                except Exception as e:
-                    st.error(f"❌ Failed to load PDF `{filename}`.")
-                    logger.error(f"Error loading PDF '{filename}': {e}")
+            if file.expires_at:
+                st.caption(f"⏳ Expires {file.expires_at.strftime(TIMESTAMP_FORMAT)} UTC")
+            archived = archived_notice(file)
+            download_file(file, user_id, archived)
+
+            # Preview based on file type; nothing to show for an archived file until it is retrieved
+            if not archived:
+                preview_file(file, user_id, comment)
+            if (file.version or 1) > 1:
+                version_history(file, user_id)
+            if st.button("🗑️ Move to Trash", key=f"trash_{file.id}"):
+                success, message = delete_file(file.id, user_id)
+                if success:
+                    st.rerun()
+                st.error(message)
             st.markdown("---")
     else:
         st.info("📁 You have not uploaded any files yet.")
@@ -384,57 +442,232 @@ def download_interface(user_id):
     st.subheader("🔗 Shared Files")
     if shared_files:
         for file in shared_files:
-            file_path = file.filepath
             filename = file.filename
             owner = file.owner.username
             comment = file.comment if hasattr(file, 'comment') else ""
             st.markdown(f"### {filename} (Shared by {owner})")
-            download_link = get_download_link(file_path, filename)
-            st.markdown(download_link, unsafe_allow_html=True)
+            archived = archived_notice(file)
 
             # Notify sender upon download
-            download_button = st.button(f"Download {filename}", key=f"download_{file.id}")
-            if download_button:
-                notify_sender(file.owner_id, user_id, filename)
-                with open(file_path, "rb") as f:
-                    st.download_button(
-                        label="Confirm Download",
-                        data=f,
-                        file_name=filename,
-                        key=f"confirm_download_{file.id}"
-                    )
-
-            # Preview based on file type
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-                try:
-                    st.image(file_path, width=300, caption=comment)
-                except Exception as e:
-                    st.error(f"❌ Failed to load image `{filename}`.")
-                    logger.error(f"Error loading image '{filename}': {e}")
-            elif filename.lower().endswith('.pdf'):
-                try:
-                    with open(file_path, "rb") as f:
-                        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-                    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="600" type="application/pdf"></iframe>'
-                    st.markdown(pdf_display, unsafe_allow_html=True)
-                except Exception as e:
-                    st.error(f"❌ Failed to load PDF `{filename}`.")
-                    logger.error(f"Error loading PDF '{filename}': {e}")
+            download_file(file, user_id, archived, notify=True)
+
+            # Preview based on file type; nothing to show for an archived file until it is retrieved
+            if not archived:
+                preview_file(file, user_id, comment)
             st.markdown("---")
     else:
         st.info("📁 No files have been shared with you yet.")
 
 
-def notify_sender(sender_id, downloader_id, filename):
-    """Notify the sender that their file has been downloaded."""
-    db = SessionLocal()
-    sender = db.query(User).filter(User.id == sender_id).first()
-    downloader = db.query(User).filter(User.id == downloader_id).first()
-    if sender and downloader:
-        message = f"📣 Your file '{filename}' was downloaded by {downloader.username}."
-        logger.info(message)
-        # TODO: Integrate email notifications or in-app notifications to the sender
-    db.close()
+def download_file(file, user_id, archived, notify=False):
+    """Download button for a file, bringing it back from the archive first if needed."""
+    if not st.button(f"Download {file.filename}", key=f"download_{file.id}"):
+        return
+    if archived and not ensure_hot(file.id):
+        st.error(f"❌ Could not retrieve `{file.filename}` from the archive.")
+        return
+    record_event("download", file.id, user_id)
+    if notify:
+        notify_sender(file.owner_id, user_id, st.session_state['username'], file.id, file.filename)
+    try:
+        st.download_button(
+            label="Confirm Download",
+            data=read_limited(user_id, file.filepath),
+            file_name=file.filename,
+            key=f"confirm_download_{file.id}"
+        )
+    except TransferQueueTimeout:
+        st.warning("⏳ The server is busy with other transfers; please try again shortly.")
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif')
+
+
+def _record_preview(file_id, user_id):
+    # Only turning the preview on counts as viewing the file, not the reruns that keep it shown
+    if st.session_state.get(f"preview_{file_id}"):
+        record_event("preview", file_id, user_id)
+
+
+def preview_file(file, user_id, comment):
+    """Show an image or PDF preview of a file once the user turns it on."""
+    filename = file.filename
+    if not filename.lower().endswith(IMAGE_EXTENSIONS + ('.pdf',)):
+        return
+    if not st.toggle("👁️ Preview", key=f"preview_{file.id}", on_change=_record_preview, args=(file.id, user_id)):
+        return
+    if filename.lower().endswith(IMAGE_EXTENSIONS):
+        try:
+            st.image(read_preview(file.filepath), width=300, caption=comment)
+        except Exception as e:
+            st.error(f"❌ Failed to load image `{filename}`.")
+            logger.error(f"Error loading image '{filename}': {e}")
+    else:
+        try:
+            base64_pdf = base64.b64encode(read_preview(file.filepath)).decode('utf-8')
+            pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="700" height="600" type="application/pdf"></iframe>'
+            st.markdown(pdf_display, unsafe_allow_html=True)
+        except Exception as e:
+            st.error(f"❌ Failed to load PDF `{filename}`.")
+            logger.error(f"Error loading PDF '{filename}': {e}")
+
+
+def archived_notice(file):
+    """Mark a file whose content is in the archive tier, with a button to bring it back."""
+    if not is_archived(file):
+        return False
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.caption(f"🧊 Archived {file.archived_at.strftime(TIMESTAMP_FORMAT)} UTC — downloading it brings it back; retrieve it to preview.")
+    with col2:
+        if st.button("📦 Retrieve", key=f"retrieve_{file.id}"):
+            try:
+                restored = ensure_hot(file.id)
+            except Exception as e:
+                logger.error(f"Error retrieving file ID {file.id} from the archive: {e}")
+                restored = False
+            if restored:
+                st.rerun()
+            st.error(f"❌ Could not retrieve `{file.filename}` from the archive.")
+    return True
+
+def version_history(file, user_id):
+    """List the earlier versions of one of the user's files, with download and restore buttons."""
+    with st.expander(f"🕘 Version history ({file.version} versions)"):
+        for version in list_versions(file.id):
+            col1, col2, col3 = st.columns([3, 1, 1])
+            with col1:
+                size = f" · {version.size / 1024:.1f} KB" if version.size is not None else ""
+                st.markdown(f"**Version {version.version}**{' (current)' if version.version == file.version else ''}")
+                st.caption(f"{version.created_at.strftime(TIMESTAMP_FORMAT)}{size}" + (f" · {version.comment}" if version.comment else ""))
+            if version.version == file.version:
+                continue
+            if version.chunked_at is None:
+                with col2:
+                    st.caption("Being stored…")
+                continue
+            with col2:
+                if st.button("Download", key=f"version_download_{version.id}"):
+                    try:
+                        with transfer_slot(user_id, st.session_state.get("username")):
+                            data = b"".join(throttled(user_id, iter_version(version.id), "download"))
+                    except TransferQueueTimeout:
+                        st.warning("⏳ The server is busy with other transfers; please try again shortly.")
+                    else:
+                        st.download_button(
+                            label="Confirm Download",
+                            data=data,
+                            file_name=file.filename,
+                            key=f"version_confirm_{version.id}"
+                        )
+            with col3:
+                if st.button("♻️ Restore", key=f"version_restore_{version.id}"):
+                    success, message = restore_version(file.id, version.version, user_id)
+                    if success:
+                        st.rerun()
+                    st.error(message)
+
+
+# === Trash Interface ===
+def trash_interface(user_id, is_admin):
+    """List files in the trash and let their owners (or admins) restore them."""
+    st.header("🗑️ Trash")
+    retention_days = trash_retention_days()
+    st.markdown(f"Deleted files can be restored for {retention_days} day(s); after that they are removed permanently.")
+
+    show_all = is_admin and st.toggle("Show files of all users", key="trash_show_all")
+    trashed = list_trash(None if show_all else user_id)
+    if not trashed:
+        st.info("🗑️ The trash is empty.")
+        return
+
+    for file in trashed:
+        purge_on = file.deleted_at + timedelta(days=retention_days)
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            owner = f" · owner: {file.owner}" if show_all else ""
+            st.markdown(f"**{file.filename}**{owner}")
+            st.caption(f"Deleted {file.deleted_at.strftime(TIMESTAMP_FORMAT)} · purged after {purge_on.strftime(TIMESTAMP_FORMAT)}")
+        with col2:
+            if st.button("♻️ Restore", key=f"restore_{file.id}"):
+                success, message = restore_file(file.id, user_id, admin=is_admin)
+                if success:
+                    st.rerun()
+                st.error(message)
+
+
+def notify_sender(sender_id, downloader_id, downloader_name, file_id, filename):
+    """Queue an in-app notification telling the sender that their file has been downloaded."""
+    notify_download(sender_id, downloader_id, downloader_name, file_id, filename)
+    logger.info(f"📣 File '{filename}' (owner ID {sender_id}) was downloaded by {downloader_name}.")
+
+
+# === Notifications Interface ===
+def notifications_interface(user_id):
+    """List the user's recent notifications, newest first."""
+    st.header("🔔 Notifications")
+
+    notifications = list_notifications(user_id)
+    if not notifications:
+        st.info("📭 You have no notifications yet.")
+        return
+
+    if st.button("Mark all as read"):
+        mark_all_read(user_id)
+        st.rerun()
+
+    for notification in notifications:
+        message = format_notification(notification)
+        st.markdown(message if notification.is_read else f"**{message}**")
+        st.caption(notification.updated_at.strftime(TIMESTAMP_FORMAT))
+
+
+# === Paginated Admin Tables ===
+PAGE_SIZES = [10, 25, 50, 100]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def pagination_controls(key, total):
+    """
+    Render page-size and page-number inputs for a table of `total` rows.
+
+    Returns:
+        tuple: The selected (page, page_size).
+    """
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+    pages = max(1, math.ceil(total / page_size))
+    # Filters may shrink the result set below the page the user was on
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col2:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    with col3:
+        st.caption(f"{total} record(s) · page {page} of {pages}")
+    return page, page_size
+
+
+def sort_controls(key, options, default=0, descending=False):
+    """Render sort column and direction inputs and return (sort_by, descending)."""
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        label = st.selectbox("Sort by", list(options), index=default, key=f"{key}_sort_by")
+    with col2:
+        descending = st.toggle("Descending", value=descending, key=f"{key}_descending")
+    return options[label], descending
+
+
+def show_table(rows, columns):
+    """Display query rows as a dataframe, formatting datetimes consistently."""
+    import pandas as pd
+
+    data = [
+        [value.strftime(TIMESTAMP_FORMAT) if isinstance(value, datetime) else value for value in row]
+        for row in rows
+    ]
+    df = pd.DataFrame(data, columns=columns)
+    st.dataframe(df, use_container_width=True, hide_index=True)
 
 
 # === Admin Panel Interface with Enhanced Features ===
@@ -445,24 +678,32 @@ def admin_interface():
     st.markdown('<p class="big-font">Manage users, files, groups, monitor system logs, and update configuration.</p>', unsafe_allow_html=True)
 
     # Tabs for different admin functionalities with Icons
-    admin_tabs = st.tabs(["👥 Manage Users", "📂 Manage Files", "👥 Manage Groups", "📈 View Logs", "⚙️ Configuration"])
+    admin_tabs = st.tabs(["📋 Dashboard", "👥 Manage Users", "📂 Manage Files", "👥 Manage Groups", "📊 Activity", "🧵 Background Jobs", "🚦 Transfers", "🔬 Profiling", "📈 View Logs", "⚙️ Configuration"])
 
-    # === Manage Users Tab ===
+    # === Dashboard Tab ===
     with admin_tabs[0]:
+        st.subheader("📋 Dashboard")
+        st.markdown("Storage, sharing and upload figures, kept current as files, users and groups change.")
+        admin_dashboard_interface()
+
+    # === Manage Users Tab ===
+    with admin_tabs[1]:
         st.subheader("👥 Manage Users")
         st.markdown("Manage all user accounts, including creating, deleting, and resetting passwords.")
 
-        # List all users
-        users = list_users()
+        # List users one page at a time
+        user_search = st.text_input("Search users", placeholder="Part of a username", key="users_search")
+        user_sort_by, user_descending = sort_controls(
+            "users", {"ID": "id", "Username": "username", "Created At": "created_at"}
+        )
+        total_users = count_users(user_search)
+        page, page_size = pagination_controls("users", total_users)
+        users = list_users_page(page, page_size, user_sort_by, user_descending, user_search)
         if users:
-            user_data = {
-                "ID": [user.id for user in users],
-                "Username": [user.username for user in users],
-                "Role": ["Admin" if user.is_admin else "User" for user in users],
-                "Created At": [user.created_at.strftime("%Y-%m-%d %H:%M:%S") for user in users]
-            }
-            df_users = pd.DataFrame(user_data)
-            st.dataframe(df_users, use_container_width=True)
+            show_table(
+                [(user.id, user.username, "Admin" if user.is_admin else "User", user.created_at) for user in users],
+                ["ID", "Username", "Role", "Created At"],
+            )
         else:
             st.info("📁 No users found.")
 
@@ -497,10 +738,10 @@ def admin_interface():
         # Delete Existing User
         st.subheader("🗑️ Delete User")
         with st.form("delete_user_form"):
-            user_to_delete = st.selectbox(
-                "Select User to Delete",
-                [user.username for user in users],
-                help="Select a user to remove from the system."
+            user_to_delete = st.text_input(
+                "Username to Delete",
+                placeholder="Enter username",
+                help="Enter the username of the user to remove from the system."
             )
             delete_submit = st.form_submit_button("Delete User", type="primary")
 
@@ -520,10 +761,10 @@ def admin_interface():
         # Reset User Password
         st.subheader("🔄 Reset User Password")
         with st.form("reset_password_form"):
-            user_for_reset = st.selectbox(
-                "Select User",
-                [user.username for user in users],
-                help="Select a user whose password you want to reset."
+            user_for_reset = st.text_input(
+                "Username",
+                placeholder="Enter username",
+                help="Enter the username of the user whose password you want to reset."
             )
             new_pwd = st.text_input("New Password", type="password", placeholder="Enter new password")
             confirm_new_pwd = st.text_input("Confirm New Password", type="password", placeholder="Confirm new password")
@@ -536,47 +777,73 @@ def admin_interface():
                 st.error("❌ Passwords do not match.")
             else:
                 user = get_user_by_username(user_for_reset)
-                success, message = reset_user_password(user.id, new_pwd)
-                if success:
-                    st.success(message)
+                if not user:
+                    st.error("❌ Selected user does not exist.")
                 else:
-                    st.error(message)
+                    success, message = reset_user_password(user.id, new_pwd)
+                    if success:
+                        st.success(message)
+                    else:
+                        st.error(message)
 
     # === Manage Files Tab ===
-    with admin_tabs[1]:
+    with admin_tabs[2]:
         st.subheader("📂 Manage Files")
         st.markdown("Oversee all uploaded files, including deleting unauthorized or unnecessary files.")
 
-        # Display all files
-        db = SessionLocal()
-        all_files = db.query(File).options(joinedload(File.owner)).all()
-        db.close()
-
-        if all_files:
-            file_data = {
-                "ID": [file.id for file in all_files],
-                "Filename": [file.filename for file in all_files],
-                "Owner": [file.owner.username for file in all_files],
-                "Uploaded At": [file.uploaded_at.strftime("%Y-%m-%d %H:%M:%S") for file in all_files]
-            }
-            df_files = pd.DataFrame(file_data)
-            st.dataframe(df_files, use_container_width=True)
-
-            st.write("---")
-
-            # Delete File
-            st.subheader("🗑️ Delete File")
-            with st.form("delete_file_form"):
-                file_options = [f"{file.filename} (Owner: {file.owner.username})" for file in all_files]
-                file_to_delete = st.selectbox(
-                    "Select File to Delete",
-                    file_options,
-                    help="Choose a file to remove from the system."
-                )
-                delete_file_submit = st.form_submit_button("Delete File", type="primary")
+        # Filter, sort and page through files
+        col1, col2 = st.columns(2)
+        with col1:
+            owner_filter = st.text_input("Owner", placeholder="Filter by username", key="files_owner")
+        with col2:
+            date_range = st.date_input("Uploaded between", value=(), key="files_date_range")
+        uploaded_after = uploaded_before = None
+        if len(date_range) >= 1:
+            uploaded_after = datetime.combine(date_range[0], datetime.min.time())
+        if len(date_range) == 2:
+            uploaded_before = datetime.combine(date_range[1], datetime.min.time()) + timedelta(days=1)
+        file_sort_by, file_descending = sort_controls(
+            "files",
+            {"Uploaded At": "uploaded_at", "Filename": "filename", "Owner": "owner", "ID": "id"},
+            descending=True,
+        )
+        total_files = count_files(owner_filter, uploaded_after, uploaded_before)
+        page, page_size = pagination_controls("files", total_files)
+        files = list_files_page(
+            page, page_size, file_sort_by, file_descending, owner_filter, uploaded_after, uploaded_before
+        )
+        if files:
+            show_table(files, ["ID", "Filename", "Owner", "Uploaded At"])
+        else:
+            st.info("📁 No files match the current filters.")
 
-            if delete_file_submit:
-                file_id = all_files[file_options.index(file_to_delete)].id
+        st.write("---")
+
+        # Delete File by ID or by searching for it
+        st.subheader("🗑️ Delete File")
+        search_term = st.text_input("Search files by name", placeholder="Part of a filename", key="delete_file_search")
+        matches = search_files(search_term) if search_term else []
+        with st.form("delete_file_form"):
+            selected_match = st.selectbox(
+                "Select a search result",
+                matches,
+                index=None,
+                format_func=lambda row: f"#{row.id} {row.filename} (Owner: {row.owner})",
+                help="Search by filename above, then pick the file to delete."
+            )
+            file_id_input = st.number_input(
+                "...or enter a File ID",
+                min_value=0,
+                step=1,
+                help="Used when no search result is selected."
+            )
+            delete_file_submit = st.form_submit_button("Delete File", type="primary")
+
+        if delete_file_submit:
+            file_id = selected_match.id if selected_match else int(file_id_input)
+            if not file_id:
+                st.error("❌ Select a search result or enter a File ID.")
+            else:
                 success, message = delete_file(
                     file_id,
                     user_id=st.session_state["user_id"],
@@ -586,40 +853,41 @@ def admin_interface():
                     st.success(message)
                 else:
                     st.error(message)
-        else:
-            st.info("📁 No files uploaded yet.")
 
     # === Manage Groups Tab ===
-    with admin_tabs[2]:
+    with admin_tabs[3]:
         st.subheader("👥 Manage Groups")
         st.markdown("Create, view, and manage user groups to streamline collaboration.")
 
-        # List all groups
-        groups = list_groups()
+        # List groups one page at a time
+        group_sort_by, group_descending = sort_controls(
+            "groups", {"ID": "id", "Name": "name", "Created At": "created_at"}
+        )
+        page, page_size = pagination_controls("groups", count_groups())
+        groups = list_groups_page(page, page_size, group_sort_by, group_descending)
         if groups:
-            group_data = {
-                "ID": [group.id for group in groups],
-                "Name": [group.name for group in groups],
-                "Created At": [group.created_at.strftime("%Y-%m-%d %H:%M:%S") for group in groups]
-            }
-            df_groups = pd.DataFrame(group_data)
-            st.dataframe(df_groups, use_container_width=True)
+            show_table(groups, ["ID", "Name", "Parent Group", "Created At"])
         else:
             st.info("📁 No groups found.")
 
         st.write("---")
 
+        all_groups = {group.name: group.id for group in list_groups()}
+        no_parent = "(none)"
+
         # Create New Group
         st.subheader("➕ Create New Group")
         with st.form("create_group_form"):
             new_group_name = st.text_input("Group Name", placeholder="Enter group name")
+            new_group_parent = st.selectbox("Parent Group", [no_parent] + sorted(all_groups),
+                                            help="Members of the new group also count as members of its parent groups.")
             create_group_submit = st.form_submit_button("Create Group", type="primary")
 
         if create_group_submit:
             if not new_group_name:
                 st.error("❌ Group name cannot be empty.")
             else:
-                group = create_new_group(new_group_name)
+                group = create_new_group(new_group_name, all_groups.get(new_group_parent))
                 if group:
                     st.success(f"✅ Group '{new_group_name}' created successfully.")
                 else:
@@ -627,12 +895,142 @@ def admin_interface():
 
         st.write("---")
 
+        # Group Hierarchy
+        st.subheader("🌳 Group Hierarchy")
+        if all_groups:
+            with st.form("move_group_form"):
+                col1, col2 = st.columns(2)
+                moved_group = col1.selectbox("Group", sorted(all_groups))
+                new_parent = col2.selectbox("New Parent Group", [no_parent] + sorted(all_groups))
+                move_group_submit = st.form_submit_button("Move Group")
+            if move_group_submit:
+                success, message = set_group_parent(all_groups[moved_group], all_groups.get(new_parent))
+                if success:
+                    st.success(f"✅ {message}")
+                else:
+                    st.error(f"❌ {message}")
+
+            members_group = st.selectbox("Show Members Of", sorted(all_groups), key="members_group",
+                                         help="Members of the group and of all its subgroups.")
+            members = list_group_members(all_groups[members_group])
+            st.caption(f"{len(members)} member(s), including subgroups.")
+            if members:
+                show_table(members, ["ID", "Username"])
+        else:
+            st.info("📁 No groups found.")
+
+        st.write("---")
+
         # Handle Group Requests
         st.subheader("📩 Group Join Requests")
         admin_group_requests_interface()
 
+    # === Activity Tab ===
+    with admin_tabs[4]:
+        st.subheader("📊 Activity")
+        st.markdown("Uploads, downloads, previews and deletes, from hourly and daily rollups.")
+
+        window_options = {"Last 24 hours": ("hour", 1), "Last 7 days": ("day", 7), "Last 30 days": ("day", 30)}
+        window = st.selectbox("Time window", list(window_options), key="activity_window")
+        period, days = window_options[window]
+
+        traffic_rows = traffic(period, datetime.utcnow() - timedelta(days=days))
+        if traffic_rows:
+            import pandas as pd
+
+            df_traffic = pd.DataFrame(traffic_rows, columns=["Time", "Event", "Count"])
+            st.line_chart(df_traffic.pivot_table(index="Time", columns="Event", values="Count", fill_value=0))
+        else:
+            st.info("📭 No activity recorded in this window yet.")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("#### Top Downloaded Files")
+            show_table(
+                [(row.subject_id, row.filename or "(deleted)", row.count) for row in top_files(days)],
+                ["File ID", "Filename", "Downloads"],
+            )
+        with col2:
+            st.write("#### Most Active Users")
+            show_table(
+                [(row.subject_id, row.username or "(deleted)", row.count) for row in active_users(days)],
+                ["User ID", "Username", "Events"],
+            )
+
+    # === Background Jobs Tab ===
+    with admin_tabs[5]:
+        st.subheader("🧵 Background Jobs")
+        st.markdown("Post-upload processing queued for `sharesphere worker`.")
+
+        depth = queue_depth()
+        if depth:
+            import pandas as pd
+
+            df_depth = pd.DataFrame(depth, columns=["Job", "Status", "Count"])
+            st.dataframe(df_depth.pivot_table(index="Job", columns="Status", values="Count", fill_value=0))
+        else:
+            st.info("📭 The job queue is empty.")
+
+        st.write("#### Failed Jobs")
+        failed_jobs = list_jobs("failed")
+        if failed_jobs:
+            show_table(
+                [(job.id, job.kind, job.payload, job.attempts, job.last_error, job.updated_at) for job in failed_jobs],
+                ["ID", "Job", "Payload", "Attempts", "Last Error", "Failed At"],
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                retry_ids = st.multiselect("Jobs to retry", [job.id for job in failed_jobs], key="retry_job_ids")
+                if st.button("🔁 Retry Selected", key="retry_selected_jobs") and retry_ids:
+                    st.success(f"✅ Requeued {retry_failed_jobs(retry_ids)} job(s).")
+                    logger.info(f"Admin requeued failed jobs {retry_ids}.")
+            with col2:
+                if st.button("🔁 Retry All Failed", key="retry_all_jobs"):
+                    st.success(f"✅ Requeued {retry_failed_jobs()} job(s).")
+                    logger.info("Admin requeued all failed jobs.")
+        else:
+            st.info("✅ No failed jobs.")
+
+    # === Transfers Tab ===
+    with admin_tabs[6]:
+        st.subheader("🚦 Transfers")
+        st.markdown("Upload and download admission control for this app process; limits are set under `limits` in the configuration.")
+
+        stats = transfer_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Active Transfers", stats["active"], help=f"Limit: {limit_settings['global_max_transfers'] or 'none'}")
+        col2.metric("Queued Now", stats["waiting"])
+        col3.metric("Timed Out", stats["timeouts"])
+        col4.metric("Rate per User", f"{stats['user_rate'] / 1048576:.1f} MB/s" if stats["user_rate"] else "Unlimited")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Transfers", stats["transfers"])
+        col2.metric("Had to Queue", stats["queued"])
+        col3.metric("Average Wait", f"{stats['wait_seconds'] / stats['queued']:.2f} s" if stats["queued"] else "—",
+                    help=f"Longest: {stats['max_wait_seconds']:.2f} s")
+        col4.metric("Time Throttled", f"{stats['throttled_seconds']:.1f} s")
+        st.caption(f"Uploaded {stats['bytes']['upload'] / 1048576:.1f} MB, downloaded {stats['bytes']['download'] / 1048576:.1f} MB since the app started.")
+        if not limit_settings["enabled"]:
+            st.info("Transfer limits are disabled (`limits.enabled: false`).")
+
+        st.write("#### Per User")
+        if stats["users"]:
+            show_table(
+                [(user["username"] or user["user_id"], user["active"], user["waiting"], user["transfers"], user["queued"],
+                  user["timeouts"], round(user["wait_seconds"], 2), round(user["throttled_seconds"], 2),
+                  round(user["bytes"] / 1048576, 1)) for user in stats["users"]],
+                ["User", "Active", "Queued", "Transfers", "Had to Queue", "Timed Out", "Wait (s)", "Throttled (s)", "MB"],
+            )
+        else:
+            st.info("📭 No transfers yet.")
+
+    # === Profiling Tab ===
+    with admin_tabs[7]:
+        st.subheader("🔬 Profiling")
+        st.markdown("Sample where page reruns spend their time and memory. Stack sampling costs little; allocation tracing (`profiling.tracemalloc`) slows every rerun while profiling is on.")
+        admin_profiling_interface()
+
     # === View Logs Tab ===
-    with admin_tabs[3]:
+    with admin_tabs[8]:
         st.subheader("📈 View Logs")
         st.markdown("Monitor system activities and troubleshoot issues effectively.")
 
@@ -651,14 +1049,13 @@ def admin_interface():
             st.info("📜 No logs available.")
 
     # === Configuration Tab ===
-    with admin_tabs[4]:
+    with admin_tabs[9]:
         st.subheader("⚙️ Configuration")
         st.markdown("Update the system configuration settings.")
 
-        # Load current configuration with a new variable name to avoid shadowing
-        config_path = os.getenv("SHARESPHERE_CONFIG_PATH", None)
+        # Read the cached configuration with a new variable name to avoid shadowing
         try:
-            new_config: DictConfig = load_config(config_path)
+            new_config: DictConfig = get_config()
         except FileNotFoundError as e:
             st.error(f"Configuration file not found: {e}")
             return
@@ -758,15 +1155,12 @@ def admin_interface():
                 }
             }
 
-            # Attempt to merge with existing config to preserve any additional configurations
+            # update_config merges these settings over the existing config to preserve any additional configurations
             try:
-                # Load existing config to preserve additional settings
-                merged_config = OmegaConf.create(updated_config)
-                # Save the merged configuration
-                success = update_config(merged_config)
+                success = update_config(updated_config)
                 if success:
                     st.success("✅ Configuration updated successfully.")
-                    # Reload the config
+                    # Running sessions pick the change up through the config service
                     st.rerun()
                 else:
                     st.error("❌ Failed to update configuration.")
@@ -776,6 +1170,115 @@ def admin_interface():
 
 
 # === User Settings Interface ===
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(size) < 1024 or unit == "TB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def admin_dashboard_interface():
+    """Render the admin dashboard from the summary tables; a few indexed reads whatever the instance size."""
+    totals = dashboard_totals()
+    if totals["rebuilt_at"] is None:
+        st.info("Dashboard statistics have not been built yet. They are built when `sharesphere worker` starts, "
+                "or with the button below.")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Users", totals["users"])
+    col2.metric("Groups", totals["groups"])
+    col3.metric("Files", totals["files"])
+    col4.metric("Storage", format_bytes(totals["bytes"]))
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Shares", totals["shares"])
+    col2.metric("Files in Trash", totals["trashed_files"])
+    col3.metric("Trash Size", format_bytes(totals["trashed_bytes"]))
+    col4.metric("Average File", format_bytes(totals["bytes"] / totals["files"]) if totals["files"] else "—")
+
+    st.write("#### Uploads per Day")
+    history = upload_history(30)
+    if history:
+        import pandas as pd
+
+        df_uploads = pd.DataFrame(
+            [(row.day, row.uploads, row.bytes / 1048576) for row in history], columns=["Day", "Uploads", "MB"]
+        ).set_index("Day")
+        col1, col2 = st.columns(2)
+        col1.bar_chart(df_uploads["Uploads"])
+        col2.bar_chart(df_uploads["MB"])
+    else:
+        st.info("📭 No uploads in the last 30 days.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.write("#### Top Users by Storage")
+        show_table(
+            [(row.username or f"(deleted {row.user_id})", row.files, format_bytes(row.bytes), format_bytes(row.trashed_bytes), row.shares)
+             for row in top_users_by_storage()],
+            ["User", "Files", "Storage", "Trash", "Shares"],
+        )
+    with col2:
+        st.write("#### Top Groups by Storage")
+        show_table(
+            [(row.name or f"(deleted {row.group_id})", row.members, row.files, format_bytes(row.bytes)) for row in top_groups_by_storage()],
+            ["Group", "Members", "Files", "Members' Storage"],
+        )
+
+    if totals["rebuilt_at"]:
+        st.caption(f"Last rebuilt from scratch at {totals['rebuilt_at']:%Y-%m-%d %H:%M} UTC.")
+    if st.button("🔄 Rebuild Statistics", key="rebuild_stats"):
+        before, after = rebuild_stats()
+        drift = [f"{field} {after[field] - before[field]:+d}" for field in after if after[field] != before[field]]
+        st.success("✅ Statistics rebuilt." + (f" Corrected: {', '.join(drift)}." if drift else " No drift found."))
+        logger.info("Admin rebuilt the dashboard statistics.")
+
+def admin_profiling_interface():
+    """Toggle the rerun profiler and browse the slowest profiled reruns."""
+    if profiling_forced():
+        st.info("Profiling is on for this process because the app was started with `sharesphere start --profile`.")
+    else:
+        enabled = st.toggle("Profile page reruns", value=bool(profiler_settings["enabled"]), key="profiling_enabled",
+                            help="Saved as profiling.enabled; every app process picks it up.")
+        if enabled != bool(profiler_settings["enabled"]):
+            if update_config({"profiling": {"enabled": enabled}}):
+                logger.info(f"Admin turned rerun profiling {'on' if enabled else 'off'}.")
+                st.rerun()
+            else:
+                st.error("❌ Failed to update the configuration.")
+    st.caption(f"Every {profiler_settings['interval_ms']} ms a sample of each running rerun's stack is taken; "
+               f"the {profiler_settings['keep']} slowest reruns per page are kept in `{profiler_settings['folder']}`"
+               + (", with allocation snapshots." if profiler_settings["tracemalloc"] else "."))
+
+    profiles = list_profiles(limit=50)
+    if not profiles:
+        st.info("📭 No profiled reruns yet." if profiling_enabled() else "📭 No profiled reruns. Turn profiling on and use the app.")
+        return
+    st.write("#### Slowest Reruns")
+    show_table(
+        [(profile["page"], profile["duration_ms"], profile["samples"], profile.get("peak_kib"), profile["started_at"], profile["pid"])
+         for profile in profiles],
+        ["Page", "Duration (ms)", "Samples", "Peak Traced (KiB)", "Started (UTC)", "Process"],
+    )
+    labels = {f"{profile['page']} — {profile['duration_ms']:.0f} ms at {profile['started_at']}": profile for profile in profiles}
+    profile = labels[st.selectbox("Rerun", list(labels), key="profile_choice")]
+    collapsed = profile_path(profile["id"], ".collapsed")
+    col1, col2, col3 = st.columns(3)
+    if collapsed.exists():
+        stacks = collapsed.read_text()
+        col1.download_button("⬇️ Collapsed stacks", stacks, file_name=f"{profile['id'].replace('/', '-')}.collapsed",
+                             help="Open in speedscope, or render with flamegraph.pl or inferno-flamegraph.", key="download_stacks")
+        top = sorted((line.rsplit(" ", 1) for line in stacks.splitlines() if line), key=lambda item: -int(item[1]))[:10]
+        st.write("#### Hottest Stacks")
+        show_table([(int(count), " ← ".join(reversed(stack.split(";")[-3:])))
+                    for stack, count in top], ["Samples", "Innermost Frames"])
+    snapshot = profile_path(profile["id"], ".tracemalloc")
+    if snapshot.exists():
+        col2.download_button("⬇️ tracemalloc snapshot", snapshot.read_bytes(), file_name=snapshot.name,
+                             help="Load with tracemalloc.Snapshot.load().", key="download_snapshot")
+    if profile.get("allocations"):
+        st.write("#### Memory Left Allocated by the Rerun")
+        show_table(profile["allocations"], ["Location", "KiB", "Blocks"])
+    if col3.button("🗑️ Clear Profiles", key="clear_profiles"):
+        st.success(f"✅ Removed {clear_profiles()} saved rerun(s).")
+
 def user_settings_interface(user_id: int):
     """
     Provide a user-specific settings page where individual users
@@ -818,53 +1321,87 @@ def user_settings_interface(user_id: int):
 
     db.close()
 
+    st.write("---")
+
+    # -------------- API Tokens -------------- #
+    st.subheader("API Tokens")
+    st.markdown("Tokens let scripts use the ShareSphere HTTP API on your behalf.")
+
+    tokens = list_api_tokens(user_id)
+    if tokens:
+        show_table(tokens, ["ID", "Name", "Created At"])
+
+    with st.form("create_api_token_form"):
+        token_name = st.text_input("Token Name", placeholder="e.g. nightly-etl")
+        create_token = st.form_submit_button("Create Token")
+    if create_token:
+        token = create_api_token(user_id, token_name or None)
+        st.success("✅ Token created. Copy it now; it will not be shown again.")
+        st.code(token)
+
+    if tokens:
+        token_names = {api_token.id: api_token.name or "" for api_token in tokens}
+        with st.form("revoke_api_token_form"):
+            token_id = st.selectbox(
+                "Token to Revoke",
+                list(token_names),
+                format_func=lambda token_id: f"#{token_id} {token_names[token_id]}",
+            )
+            revoke_token = st.form_submit_button("Revoke Token")
+        if revoke_token:
+            if revoke_api_token(token_id, user_id):
+                st.success("✅ Token revoked.")
+                st.rerun()
+            else:
+                st.error("❌ Token not found.")
+
 
 # === Admin Group Requests Interface ===
 def admin_group_requests_interface():
     """Allow admins to manage user requests to join groups."""
     st.subheader("📩 Group Join Requests")
-    st.markdown("Review and manage user requests to join groups.")
+    st.markdown(f"Review and manage user requests to join groups. Resolved requests move to the archive after {group_request_retention_days()} days.")
 
-    db = SessionLocal()
-    requests = db.query(GroupRequest).options(
-        joinedload(GroupRequest.user), joinedload(GroupRequest.group)
-    ).all()
-    db.close()
+    status_options = {"Pending": "pending", "Approved": "approved", "Rejected": "rejected", "Archived": "archived", "All": None}
+    status_label = st.selectbox("Status", list(status_options), key="group_requests_status")
+    status = status_options[status_label]
+    total_requests = count_group_requests(status)
+    page, page_size = pagination_controls("group_requests", total_requests)
+    # Oldest first for the pending queue, newest first for history
+    requests = list_group_requests_page(page, page_size, status, descending=status != "pending")
 
     if requests:
-        request_data = {
-            "ID": [request.id for request in requests],
-            "User": [request.user.username for request in requests],
-            "Group": [request.group.name for request in requests],
-            "Status": [request.status for request in requests],
-            "Requested At": [request.created_at.strftime("%Y-%m-%d %H:%M:%S") for request in requests],
-        }
-        df_requests = pd.DataFrame(request_data)
-        st.dataframe(df_requests, use_container_width=True)
+        show_table(requests, ["ID", "User", "Group", "Status", "Requested At"])
 
+        if status != "pending":
+            return
         st.write("---")
 
         # Approve or Reject Requests
         st.subheader("Approve or Reject Requests")
         with st.form("approve_reject_form"):
-            request_id = st.selectbox(
-                "Select Request ID",
-                request_data["ID"],
-                help="Choose the request ID you want to process."
+            select_all = st.checkbox("All requests on this page", help="Ignore the selection below and act on every request listed.")
+            request_ids = st.multiselect(
+                "Select Request IDs",
+                [request.id for request in requests],
+                format_func=lambda request_id: next(
+                    f"#{request.id}: {request.user} → {request.group}" for request in requests if request.id == request_id
+                ),
+                help="Choose the requests you want to process."
             )
-            action = st.radio(
-                "Action",
-                ["Approve", "Reject"],
-                horizontal=True,
-                help="Approve to grant group access or Reject to deny the request."
-            )
-            action_submit = st.form_submit_button("Submit Action", type="primary")
+            col1, col2 = st.columns(2)
+            with col1:
+                approve_submit = st.form_submit_button("✅ Approve Selected", type="primary")
+            with col2:
+                reject_submit = st.form_submit_button("❌ Reject Selected")
 
-        if action_submit:
-            if action == "Approve":
-                success, message = approve_group_request(request_id)
+        if approve_submit or reject_submit:
+            if select_all:
+                request_ids = [request.id for request in requests]
+            if approve_submit:
+                success, message = approve_group_requests(request_ids)
             else:
-                success, message = reject_group_request(request_id)
+                success, message = reject_group_requests(request_ids)
             if success:
                 st.success(message)
             else:
@@ -880,21 +1417,13 @@ def user_groups_interface(user_id):
     st.markdown("<style> .big-font {font-size:20px !important;}</style>", unsafe_allow_html=True)
     st.markdown('<p class="big-font">Manage your group memberships and collaborate with your peers.</p>', unsafe_allow_html=True)
 
-    db = SessionLocal()
-    user = db.query(User).filter(User.id == user_id).first()
-    groups = user.groups
-    db.close()
+    groups = list_user_groups(user_id)
 
     if groups:
-        group_data = {
-            "ID": [group.id for group in groups],
-            "Name": [group.name for group in groups],
-            "Joined At": [
-                group.created_at.strftime("%Y-%m-%d %H:%M:%S") for group in groups
-            ],
-        }
-        df_groups = pd.DataFrame(group_data)
-        st.dataframe(df_groups, use_container_width=True)
+        show_table(
+            [(group.id, group.name, "Direct" if group.depth == 0 else "Through a subgroup", group.created_at) for group in groups],
+            ["ID", "Name", "Membership", "Created At"],
+        )
     else:
         st.info("📁 You have not joined any groups yet.")
 
@@ -904,8 +1433,9 @@ def user_groups_interface(user_id):
     st.subheader("➕ Request to Join Group")
     available_groups = list_groups()
     # Exclude groups the user is already a part of
+    member_of = {group.id for group in groups}
     available_group_names = [
-        group.name for group in available_groups if group not in groups
+        group.name for group in available_groups if group.id not in member_of
     ]
     if available_group_names:
         selected_group = st.selectbox(
@@ -949,22 +1479,30 @@ def main():
         inject_css()
 
         # Navigation Sidebar with Icons and Tooltips
-        nav_options = ["📤 Upload Files", "📥 Download Files", "👥 Your Groups", "⚙️ User Settings"]
+        nav_options = ["📤 Upload Files", "📥 Download Files", "🗑️ Trash", "👥 Your Groups", "🔔 Notifications", "⚙️ User Settings"]
         if is_admin:
             nav_options += ["🛠️ Admin Panel"]
         nav = st.sidebar.radio(
             "Navigation",
             nav_options,
-            help="Navigate through the application."
+            help="Navigate through the application.",
+            key="nav",
         )
+        unread = unread_count(user_id)
+        if unread:
+            st.sidebar.markdown(f"🔔 **{unread}** unread notification{'s' if unread != 1 else ''}")
 
         # Render content based on navigation selection
         if nav == "📤 Upload Files":
             upload_interface(user_id, username)
         elif nav == "📥 Download Files":
             download_interface(user_id)
+        elif nav == "🗑️ Trash":
+            trash_interface(user_id, is_admin)
         elif nav == "👥 Your Groups":
             user_groups_interface(user_id)
+        elif nav == "🔔 Notifications":
+            notifications_interface(user_id)
         elif nav == "⚙️ User Settings":
             user_settings_interface(user_id)
         elif nav == "🛠️ Admin Panel" and is_admin:
@@ -976,6 +1514,14 @@ def main():
             logout()
 
 
+def current_page() -> str:
+    """Name of the page this rerun showed, for the profiler."""
+    if not st.session_state.get("authentication_status"):
+        return "Login"
+    return st.session_state.get("nav") or "Upload Files"
+
+
 # Execute the main function when the script is run
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profile_rerun(current_page):
+        main()
\ No newline at end of file
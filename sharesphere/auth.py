@@ -1,13 +1,39 @@
 # sharesphere/auth.py
 
+from .config import get_config
 from .database import SessionLocal
-from .models import User
-import bcrypt
+from .models import User, ApiToken
+from . import stats
+from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError
+import hashlib
 import logging
+import secrets
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BCRYPT_ROUNDS = 12
+MIN_BCRYPT_ROUNDS = 4
+MAX_BCRYPT_ROUNDS = 31
+
+def bcrypt_rounds() -> int:
+    """Return the configured bcrypt cost factor (security.bcrypt_rounds)."""
+    rounds = get_config().get("security", {}).get("bcrypt_rounds", DEFAULT_BCRYPT_ROUNDS)
+    return min(max(int(rounds), MIN_BCRYPT_ROUNDS), MAX_BCRYPT_ROUNDS)
+
+def hash_password(password: str, rounds: int = None) -> str:
+    import bcrypt
+
+    salt = bcrypt.gensalt(rounds or bcrypt_rounds())
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+def hash_cost(hashed_password: str) -> int:
+    """Return the cost factor of a bcrypt hash such as "$2b$12$...", or None if it cannot be read."""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
 def get_user_by_username(username: str):
     db = SessionLocal()
     user = db.query(User).filter(User.username == username).first()
@@ -16,10 +42,12 @@ def get_user_by_username(username: str):
 
 def create_user(username: str, password: str, is_admin: bool = False):
     db = SessionLocal()
-    hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_pw = hash_password(password)
     user = User(username=username, hashed_password=hashed_pw, is_admin=is_admin)
     try:
         db.add(user)
+        db.flush()
+        stats.adjust_totals(db, users=1)
         db.commit()
         db.refresh(user)
         logger.info(f"User '{username}' created successfully.")
@@ -32,6 +60,8 @@ def create_user(username: str, password: str, is_admin: bool = False):
         db.close()
 
 def authenticate_user(username: str, password: str):
+    import bcrypt
+
     user = get_user_by_username(username)
     if not user:
         logger.warning(f"Authentication failed for nonexistent user '{username}'.")
@@ -39,22 +69,90 @@ def authenticate_user(username: str, password: str):
     is_correct = bcrypt.checkpw(password.encode('utf-8'), user.hashed_password.encode('utf-8'))
     if is_correct:
         logger.info(f"User '{username}' authenticated successfully.")
+        _rehash_if_needed(user, password)
         return True, user.is_admin
     else:
         logger.warning(f"Authentication failed for user '{username}'. Incorrect password.")
         return False, False
 
+def _rehash_if_needed(user, password: str):
+    """Re-hash a just-verified password whose stored cost differs from security.bcrypt_rounds."""
+    rounds = bcrypt_rounds()
+    cost = hash_cost(user.hashed_password)
+    if cost == rounds:
+        return
+    db = SessionLocal()
+    try:
+        # Only replace the hash that was verified, never a password changed in the meantime
+        result = db.execute(
+            update(User)
+            .where(User.id == user.id, User.hashed_password == user.hashed_password)
+            .values(hashed_password=hash_password(password, rounds))
+        )
+        db.commit()
+        if result.rowcount:
+            logger.info(f"Re-hashed the password of user '{user.username}' from cost {cost} to {rounds}.")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to re-hash the password of user '{user.username}': {e}")
+    finally:
+        db.close()
+
 def update_user_password(user_id: int, new_password: str):
     db = SessionLocal()
     user = db.query(User).filter(User.id == user_id).first()
     if user:
-        hashed_pw = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        user.hashed_password = hashed_pw
+        username = user.username  # read before the commit expires the instance
+        user.hashed_password = hash_password(new_password)
         db.commit()
-        logger.info(f"Password for user '{user.username}' updated successfully.")
+        logger.info(f"Password for user '{username}' updated successfully.")
         db.close()
         return True
     else:
         db.close()
         logger.error(f"Attempted to update password for nonexistent user ID '{user_id}'.")
-        return False
\ No newline at end of file
+        return False
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def create_api_token(user_id: int, name: str = None) -> str:
+    """Create an API token for the user and return it. The plain token cannot be retrieved later."""
+    token = secrets.token_urlsafe(32)
+    db = SessionLocal()
+    db.add(ApiToken(user_id=user_id, name=name, token_hash=_hash_token(token)))
+    db.commit()
+    db.close()
+    logger.info(f"API token '{name}' created for user ID '{user_id}'.")
+    return token
+
+def get_user_by_api_token(token: str):
+    if not token:
+        return None
+    db = SessionLocal()
+    user = db.query(User).join(ApiToken, ApiToken.user_id == User.id).filter(
+        ApiToken.token_hash == _hash_token(token)
+    ).first()
+    db.close()
+    return user
+
+def list_api_tokens(user_id: int):
+    db = SessionLocal()
+    tokens = db.query(ApiToken.id, ApiToken.name, ApiToken.created_at).filter(
+        ApiToken.user_id == user_id
+    ).order_by(ApiToken.id).all()
+    db.close()
+    return tokens
+
+def revoke_api_token(token_id: int, user_id: int = None):
+    """Delete an API token. When `user_id` is given, only that user's token is revoked."""
+    db = SessionLocal()
+    query = db.query(ApiToken).filter(ApiToken.id == token_id)
+    if user_id is not None:
+        query = query.filter(ApiToken.user_id == user_id)
+    deleted = query.delete()
+    db.commit()
+    db.close()
+    if deleted:
+        logger.info(f"API token ID '{token_id}' revoked.")
+    return bool(deleted)
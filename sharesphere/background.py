@@ -0,0 +1,113 @@
+# sharesphere/background.py
+
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    """
+    Buffer items in memory and hand them to a flush function in batches.
+
+    A daemon thread flushes every `interval` seconds, or sooner once
+    `max_batch` items are waiting, so callers never block on the database.
+    A batch whose flush fails (say, SQLITE_BUSY) is put back in front of the
+    items that arrived meanwhile and retried on the next flush, up to
+    `max_attempts` times. Pending items are flushed at interpreter exit.
+    """
+
+    def __init__(self, name: str, flush, interval: float = 2.0, max_batch: int = 500, max_attempts: int = 5):
+        self.name = name
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self._flush = flush
+        self._items = []
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def put(self, item):
+        with self._lock:
+            self._items.append(item)
+            full = len(self._items) >= self.max_batch
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if full:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def flush(self) -> bool:
+        """
+        Write everything buffered so far. Safe to call from any thread.
+
+        Returns:
+            bool: False if the write failed, True otherwise.
+        """
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+            if not items:
+                return True
+            try:
+                self._flush(items)
+            except Exception as e:
+                self._failures += 1
+                if self._failures >= self.max_attempts:
+                    logger.error(f"{self.name}: dropping {len(items)} buffered item(s) after "
+                                 f"{self._failures} failed writes: {e}")
+                    self._failures = 0
+                else:
+                    logger.warning(f"{self.name}: failed to write {len(items)} buffered item(s), "
+                                   f"retrying on the next flush: {e}")
+                    with self._lock:
+                        self._items[:0] = items
+                return False
+            self._failures = 0
+            return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if not self.flush():
+                # Back off for a full interval even if the buffer is full
+                time.sleep(self.interval)
+
+
+class PeriodicJob:
+    """Run `func` every `interval` seconds on a daemon thread once started."""
+
+    def __init__(self, name: str, func, interval: float):
+        self.name = name
+        self.interval = interval
+        self._func = func
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def run_once(self):
+        try:
+            self._func()
+        except Exception as e:
+            logger.error(f"{self.name}: periodic run failed: {e}")
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            self.run_once()
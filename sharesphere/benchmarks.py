@@ -0,0 +1,164 @@
+# sharesphere/benchmarks.py
+
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules a command must not pull in just to start. `sharesphere start` only
+# spawns Streamlit and `--help` only prints usage.
+STARTUP_FORBIDDEN_IMPORTS = {
+    "sharesphere.cli": ["sqlalchemy", "bcrypt", "omegaconf", "streamlit", "pandas", "sharesphere.database"],
+}
+STARTUP_BUDGET_MS = 100.0
+
+def import_profile(module: str):
+    """
+    Import `module` in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        tuple: (cumulative import time of `module` in ms, set of every module imported)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_us = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue  # header line
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, imported
+
+def check_startup(runs: int = 5, budget_ms: float = None, echo=print):
+    """
+    Measure startup imports against STARTUP_FORBIDDEN_IMPORTS and the time budget.
+
+    Returns:
+        list: Human-readable failures; empty when everything is within budget.
+    """
+    budget_ms = budget_ms or STARTUP_BUDGET_MS
+    failures = []
+    for module, forbidden in STARTUP_FORBIDDEN_IMPORTS.items():
+        timings = []
+        imported = set()
+        for _ in range(runs):
+            elapsed_ms, imported = import_profile(module)
+            timings.append(elapsed_ms)
+        median_ms = statistics.median(timings)
+        echo(f"{module}: median cumulative import time {median_ms:.1f} ms over {runs} run(s) (budget {budget_ms:.0f} ms)")
+        if median_ms > budget_ms:
+            failures.append(f"{module} takes {median_ms:.1f} ms to import (budget {budget_ms:.0f} ms).")
+        for name in forbidden:
+            if name in imported:
+                failures.append(f"{module} imports '{name}' at startup.")
+    return failures
+
+BCRYPT_TARGET_MS = 250.0
+# Never recommend less than this, whatever the hardware
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+
+def time_bcrypt(rounds: int, samples: int = 3) -> float:
+    """Return the median time in ms to verify a password hashed with `rounds`."""
+    import bcrypt
+
+    hashed = bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(rounds))
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.checkpw(b"calibration-password", hashed)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def calibrate_bcrypt(target_ms: float = None, samples: int = 3, echo=print) -> int:
+    """
+    Find the highest bcrypt cost whose verify time stays within `target_ms` on this host.
+
+    Each extra round doubles the work, so costs are timed from BCRYPT_MIN_ROUNDS
+    upwards until one exceeds the target.
+
+    Returns:
+        int: Recommended cost, never below BCRYPT_MIN_ROUNDS.
+    """
+    target_ms = target_ms or BCRYPT_TARGET_MS
+    best = BCRYPT_MIN_ROUNDS
+    for rounds in range(BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS + 1):
+        elapsed_ms = time_bcrypt(rounds, samples)
+        echo(f"cost {rounds}: {elapsed_ms:.1f} ms per verify")
+        if elapsed_ms > target_ms:
+            break
+        best = rounds
+    return best
+
+ENCRYPTION_BENCH_RANGES = 64
+ENCRYPTION_BENCH_RANGE_SIZE = 64 * 1024
+
+def bench_encryption(size_mb: int = 256, folder=None, ranges: int = ENCRYPTION_BENCH_RANGES,
+                     range_size: int = ENCRYPTION_BENCH_RANGE_SIZE) -> dict:
+    """
+    Time writing and reading a `size_mb` file in plaintext and encrypted, plus
+    `ranges` random ranged reads of each, with a throwaway master key.
+
+    Returns:
+        dict: {"plaintext"|"encrypted": {"write", "read", "ranged"}} in MB/s,
+        plus "overhead" as the fractional slowdown of each.
+    """
+    import os
+    import random
+    import tempfile
+    from .encryption import DecryptingReader, EncryptingWriter, KEY_SIZE, chunk_size
+
+    key = os.urandom(KEY_SIZE)
+    block = os.urandom(8 * 1024 * 1024)
+    total = size_mb * 1024 * 1024
+    rng = random.Random(0)
+    offsets = [rng.randrange(max(total - range_size, 1)) for _ in range(ranges)]
+    results = {}
+    with tempfile.TemporaryDirectory(dir=folder) as tmp:
+        for mode in ("plaintext", "encrypted"):
+            path = os.path.join(tmp, mode)
+            started = time.perf_counter()
+            raw = open(path, "wb")
+            out = EncryptingWriter(raw, key) if mode == "encrypted" else raw
+            for written in range(0, total, len(block)):
+                out.write(block[:total - written])
+            out.close()
+            write_seconds = time.perf_counter() - started
+
+            with open(path, "rb") as raw:
+                reader = DecryptingReader(raw, key) if mode == "encrypted" else None
+                started = time.perf_counter()
+                if reader is not None:
+                    for _ in reader.iter_range():
+                        pass
+                else:
+                    for _ in iter(lambda: raw.read(chunk_size()), b""):
+                        pass
+                read_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                for offset in offsets:
+                    if reader is not None:
+                        b"".join(reader.iter_range(offset, offset + range_size))
+                    else:
+                        raw.seek(offset)
+                        raw.read(range_size)
+                ranged_seconds = time.perf_counter() - started
+            results[mode] = {
+                "write": size_mb / write_seconds,
+                "read": size_mb / read_seconds,
+                "ranged": ranges * range_size / 1048576 / ranged_seconds,
+            }
+    results["overhead"] = {
+        name: results["plaintext"][name] / results["encrypted"][name] - 1 for name in ("write", "read", "ranged")
+    }
+    return results
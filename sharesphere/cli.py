@@ -1,12 +1,11 @@
 import click
 import subprocess
-from sharesphere.database import engine, Base
-from sharesphere.models import User, Group
-from sharesphere.auth import create_user
-from sharesphere.config import load_config, save_config
-from omegaconf import OmegaConf
 from pathlib import Path
 import os
+import sys
+
+# Commands import the rest of ShareSphere (config, SQLAlchemy, bcrypt) inside
+# their bodies so `--help` and `start` stay fast; see `sharesphere bench-startup`.
 
 @click.group()
 def main():
@@ -16,6 +15,8 @@ def main():
 @main.command()
 def init():
     """Initialize the database and create an admin account."""
+    from sharesphere.config import load_config, save_config
+
     # Load configuration
     config = load_config()
 
@@ -59,6 +60,11 @@ def init():
             open(db_file_path, 'a').close()
             click.echo(f"Created database file: {db_file_path}")
 
+    from sharesphere.database import Base, get_engine
+    from sharesphere.auth import create_user
+    from sharesphere import models  # noqa: F401  (registers the tables on Base.metadata)
+
+    engine = get_engine()
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
     click.echo("Database initialized successfully.")
@@ -78,7 +84,14 @@ def init():
 
 @main.command()
 @click.option('--config', default=None, help='Path to the configuration file.')
-def start(config):
+@click.option('--api', 'with_api', is_flag=True, help='Also run the headless HTTP API alongside the web app.')
+@click.option('--workers', default=1, show_default=True, type=click.IntRange(min=1), help='Number of app processes to run behind the built-in proxy.')
+@click.option('--port', default=8501, show_default=True, type=int, help='Public port of the web app.')
+@click.option('--host', default="0.0.0.0", show_default=True, help='Interface the web app listens on.')
+@click.option('--drain-timeout', default=30, show_default=True, type=float, help='Seconds to wait for in-flight uploads when stopping workers.')
+@click.option('--no-worker', is_flag=True, help='Do not start the background job worker (run `sharesphere worker` separately).')
+@click.option('--profile', is_flag=True, help='Profile every page rerun; see the Profiling tab of the admin panel.')
+def start(config, with_api, workers, port, host, drain_timeout, no_worker, profile):
     """Start the ShareSphere application."""
     # Determine the config path
     if config:
@@ -101,11 +114,370 @@ def start(config):
         click.echo(f"Error: app.py does not exist at {app_path}")
         return
     
+    api_process = None
+    if with_api:
+        api_process = subprocess.Popen([sys.executable, "-m", "sharesphere.cli", "api"])
+    worker_process = None
+    if not no_worker:
+        worker_process = subprocess.Popen([sys.executable, "-m", "sharesphere.cli", "worker"])
+    if profile:
+        # Set after the API and worker started, so only the app processes inherit it
+        os.environ["SHARESPHERE_PROFILE"] = "1"
+
     # Run Streamlit with the absolute path to app.py
     try:
-        subprocess.run(["streamlit", "run", str(app_path)], check=True)
+        if workers > 1:
+            from sharesphere.supervisor import run_supervisor
+
+            run_supervisor(str(app_path), workers, port, host, drain_timeout)
+        else:
+            subprocess.run(
+                ["streamlit", "run", str(app_path), "--server.port", str(port), "--server.address", host],
+                check=True,
+            )
     except subprocess.CalledProcessError as e:
         click.echo(f"Error: Failed to start Streamlit. {e}")
+    finally:
+        for process in (api_process, worker_process):
+            if process:
+                process.terminate()
+                process.wait()
+
+@main.command()
+@click.option('--config', default=None, help='Path to the configuration file.')
+@click.option('--host', default=None, help='Interface to bind. Defaults to api.host from the configuration.')
+@click.option('--port', default=None, type=int, help='Port to listen on. Defaults to api.port from the configuration.')
+def api(config, host, port):
+    """Start the headless HTTP API."""
+    if config:
+        os.environ["SHARESPHERE_CONFIG_PATH"] = str(Path(config).resolve())
+    try:
+        import uvicorn
+    except ImportError:
+        click.echo("Error: The HTTP API requires uvicorn. Install it with `pip install sharesphere[api]`.")
+        return
+    from sharesphere.config import get_config
+
+    api_config = get_config().get("api", {})
+    uvicorn.run(
+        "sharesphere.api:app",
+        host=host or api_config.get("host", "127.0.0.1"),
+        port=port or api_config.get("port", 8502),
+    )
+
+@main.command()
+@click.option('--config', default=None, help='Path to the configuration file.')
+@click.option('--processes', default=None, type=click.IntRange(min=1), help='Number of job processes. Defaults to jobs.processes from the configuration.')
+def worker(config, processes):
+    """Run background jobs (checksums, type checks, previews) from the queue."""
+    if config:
+        os.environ["SHARESPHERE_CONFIG_PATH"] = str(Path(config).resolve())
+    from sharesphere.config import get_config
+    from sharesphere.worker import run_worker
+
+    run_worker(processes or get_config().get("jobs", {}).get("processes", 2))
+
+@main.group()
+def token():
+    """Manage API tokens."""
+    pass
+
+@token.command("create")
+@click.argument('username')
+@click.option('--name', default=None, help='Label to remember the token by.')
+def token_create(username, name):
+    """Create an API token for USERNAME."""
+    from sharesphere.database import init_db
+    from sharesphere.auth import get_user_by_username, create_api_token
+
+    init_db()
+    user = get_user_by_username(username)
+    if not user:
+        click.echo(f"Error: User '{username}' does not exist.")
+        raise SystemExit(1)
+    click.echo(create_api_token(user.id, name))
+
+@token.command("list")
+@click.argument('username')
+def token_list(username):
+    """List the API tokens of USERNAME."""
+    from sharesphere.database import init_db
+    from sharesphere.auth import get_user_by_username, list_api_tokens
+
+    init_db()
+    user = get_user_by_username(username)
+    if not user:
+        click.echo(f"Error: User '{username}' does not exist.")
+        raise SystemExit(1)
+    for api_token in list_api_tokens(user.id):
+        click.echo(f"{api_token.id}\t{api_token.name or '-'}\t{api_token.created_at:%Y-%m-%d %H:%M:%S}")
+
+@token.command("revoke")
+@click.argument('token_id', type=int)
+def token_revoke(token_id):
+    """Revoke the API token with ID TOKEN_ID."""
+    from sharesphere.database import init_db
+    from sharesphere.auth import revoke_api_token
+
+    init_db()
+    if revoke_api_token(token_id):
+        click.echo(f"Token {token_id} revoked.")
+    else:
+        click.echo(f"Error: Token {token_id} not found.")
+        raise SystemExit(1)
+
+@main.command()
+def rollup():
+    """Roll up recorded access events into hourly and daily statistics."""
+    from sharesphere.database import init_db
+    from sharesphere.activity import rollup_access_events
+
+    init_db()
+    processed = rollup_access_events()
+    click.echo(f"Rolled up {processed} access event(s).")
+
+@main.command()
+@click.option('--older-than', 'older_than', default=None, type=click.IntRange(min=0), help='Purge files in the trash for more than this many days. Defaults to trash.retention_days.')
+def purge(older_than):
+    """Permanently remove trashed files past their retention period, and expired files and shares."""
+    from sharesphere.database import init_db
+    from sharesphere.file_manager import purge_deleted_files, sweep_expired
+
+    init_db()
+    purged = purge_deleted_files(older_than)
+    shares, files = sweep_expired()
+    click.echo(f"Purged {purged} file(s) from the trash; removed {files} expired file(s) and {shares} expired share(s).")
+
+@main.command()
+@click.option('--older-than', 'older_than', default=None, type=click.IntRange(min=0), help='Archive files not read for this many days. Defaults to tiering.archive_after_days.')
+def archive(older_than):
+    """Move files nobody has read recently into the compressed archive tier."""
+    from sharesphere.database import init_db
+    from sharesphere.tiering import archive_cold_files, flush_touches
+
+    init_db()
+    flush_touches()
+    archived = archive_cold_files(older_than)
+    click.echo(f"Archived {archived} file(s).")
+
+@main.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the admin dashboard's summary tables from the files, shares, users and groups."""
+    from sharesphere.database import init_db
+    from sharesphere.stats import rebuild_stats
+
+    init_db()
+    before, after = rebuild_stats()
+    drift = {field: after[field] - before[field] for field in after if after[field] != before[field]}
+    click.echo("Rebuilt dashboard statistics: " + ", ".join(f"{field} {value}" for field, value in after.items()) + ".")
+    if drift:
+        click.echo("Corrected drift: " + ", ".join(f"{field} {value:+d}" for field, value in drift.items()) + ".")
+
+@main.command()
+@click.argument('source', type=click.Path(exists=True, file_okay=False))
+@click.option('--owner', required=True, help='Username that will own the ingested files.')
+@click.option('--group', default=None, help='Share every ingested file with the members of this group.')
+@click.option('--link', is_flag=True, help='Hard-link instead of copying where possible. The source files must then be read-only: an edit in place changes the stored file too. Not allowed with --watch.')
+@click.option('--comment', default=None, help='Comment stored with each file. Defaults to "Ingested from SOURCE".')
+@click.option('--threads', default=None, type=click.IntRange(min=1), help='Files hashed and copied in parallel. Defaults to ingest.threads.')
+@click.option('--watch', is_flag=True, help='Keep running and ingest files added to SOURCE later.')
+def ingest(source, owner, group, link, comment, threads, watch):
+    """Bring the files under SOURCE into ShareSphere; rerun to resume or pick up changes."""
+    from sharesphere.database import init_db
+    from sharesphere.ingest import ingest_directory, resolve_target, summary, watch_directory
+
+    init_db()
+    try:
+        owner_id, owner_name, group_id = resolve_target(owner, group)
+        run = watch_directory if watch else ingest_directory
+        counts = run(source, owner_id, owner_name, group_id, link, comment, threads, echo=click.echo)
+    except ValueError as e:
+        click.echo(f"Error: {e}")
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        click.echo("Stopped; run the same command again to continue.")
+        raise SystemExit(130)
+    click.echo(f"Done: {summary(counts)}")
+    if counts["failed"]:
+        click.echo(f"{counts['failed']} file(s) failed; see the log, then run the same command again to retry them.")
+        raise SystemExit(1)
+
+@main.command()
+@click.option('--repair', is_flag=True, help='Move orphaned files to lost+found and delete rows whose file is missing.')
+@click.option('--checksums', is_flag=True, help='Also verify stored SHA-256 checksums (reads every file).')
+@click.option('--threads', default=16, show_default=True, type=click.IntRange(min=1), help='Threads for scanning and stat calls.')
+@click.option('--checkpoint', default=None, help='Checkpoint file. Defaults to fsck-checkpoint.json in the logging folder.')
+@click.option('--fresh', is_flag=True, help='Ignore an existing checkpoint and start over.')
+def fsck(repair, checksums, threads, checkpoint, fresh):
+    """Check the upload folder and the database against each other."""
+    from collections import Counter
+    from sharesphere.config import get_config
+    from sharesphere.database import init_db
+    from sharesphere.fsck import run_fsck
+
+    init_db()
+    config = get_config()
+    if checkpoint is None:
+        os.makedirs(config.logging.folder, exist_ok=True)
+        checkpoint = os.path.join(config.logging.folder, "fsck-checkpoint.json")
+
+    def report(finding):
+        details = f"file {finding['file_id']}" if "file_id" in finding else f"files {finding['file_ids']}" if "file_ids" in finding else ""
+        repaired = f" -> {finding['repaired']}" if "repaired" in finding else ""
+        click.echo(f"{finding['kind']}\t{finding['path']}\t{details}{repaired}")
+
+    try:
+        findings = run_fsck(config.upload.folder, checkpoint, repair, checksums, threads, fresh, report)
+    except ValueError as e:
+        click.echo(f"Error: {e}")
+        raise SystemExit(1)
+    counts = Counter(finding["kind"] for finding in findings)
+    click.echo(", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())) or "No problems found.")
+    if any("repaired" not in finding for finding in findings):
+        raise SystemExit(1)
+
+@main.command()
+@click.option('--sizes', default="100,1000", show_default=True, help='Comma-separated numbers of files to seed.')
+@click.option('--sessions', default=4, show_default=True, type=click.IntRange(min=1), help='Concurrent sessions.')
+@click.option('--iterations', default=3, show_default=True, type=click.IntRange(min=1), help='Passes over every page per session.')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False), help='Fail if a page is slower than in these results.')
+@click.option('--threshold', default=0.25, show_default=True, type=float, help='Allowed p95 slowdown as a fraction of the baseline.')
+@click.option('--workspace', default=None, type=click.Path(file_okay=False), help='Keep the seeded workspaces in this folder.')
+def loadtest(sizes, sessions, iterations, output, baseline, threshold, workspace):
+    """Measure per-page rerun latency and memory against seeded datasets."""
+    import json
+    from sharesphere.loadtest import compare_with_baseline, run_loadtest
+
+    try:
+        sizes = [int(size) for size in sizes.split(",")]
+    except ValueError:
+        raise click.BadParameter("Sizes must be comma-separated integers.", param_hint="--sizes")
+    results = run_loadtest(sizes, sessions, iterations, workspace=workspace, echo=click.echo)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        click.echo(f"Results written to {output}.")
+    if baseline:
+        with open(baseline) as f:
+            failures = compare_with_baseline(results, json.load(f), threshold)
+        if failures:
+            for failure in failures:
+                click.echo(f"FAIL: {failure}", err=True)
+            raise SystemExit(1)
+        click.echo("No page regressed against the baseline.")
+
+@main.command("export")
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--threads', default=None, type=click.IntRange(min=1), help='Compression threads. Defaults to the number of CPUs.')
+@click.option('--level', default=6, show_default=True, type=click.IntRange(0, 9), help='zlib compression level.')
+def export_command(output, threads, level):
+    """Write the database and all uploaded files to one archive ('-' for stdout)."""
+    from sharesphere.migration import export_instance
+
+    # Progress goes to stderr, since the archive itself may go to stdout
+    echo = lambda message: click.echo(message, err=True)
+    with click.open_file(output, "wb") as out:
+        manifest = export_instance(out, threads, level, echo=echo)
+    echo(f"Archive written to {output} ({len(manifest['entries'])} entries).")
+
+@main.command("import")
+@click.argument('archive', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--threads', default=None, type=click.IntRange(min=1), help='Decompression threads. Defaults to the number of CPUs.')
+@click.option('--remap', multiple=True, help='Rewrite stored paths outside the upload folder, as OLD=NEW. Repeatable.')
+def import_command(archive, threads, remap):
+    """Load an archive written by `sharesphere export` into an empty instance ('-' for stdin)."""
+    from sharesphere.migration import ArchiveError, import_instance
+
+    try:
+        with click.open_file(archive, "rb") as stream:
+            import_instance(stream, threads, list(remap), echo=click.echo)
+    except (ArchiveError, ValueError) as e:
+        click.echo(f"Import failed: {e}", err=True)
+        raise SystemExit(1)
+    click.echo("Import complete.")
+
+@main.command("query-budget")
+@click.option('--sizes', default="20,200", show_default=True, help='Comma-separated numbers of files to seed.')
+@click.option('--workspace', default=None, type=click.Path(file_okay=False), help='Keep the seeded workspaces in this folder.')
+def query_budget_command(sizes, workspace):
+    """Check SQL statement counts of file, auth and admin operations against their budgets."""
+    from sharesphere.querybudget import check_query_budgets
+
+    try:
+        sizes = [int(size) for size in sizes.split(",")]
+    except ValueError:
+        raise click.BadParameter("Sizes must be comma-separated integers.", param_hint="--sizes")
+    failures = check_query_budgets(sizes, workspace, echo=click.echo)
+    if failures:
+        for failure in failures:
+            click.echo(f"FAIL: {failure}", err=True)
+        raise SystemExit(1)
+    click.echo("All query budgets OK.")
+
+@main.command("calibrate-bcrypt")
+@click.option('--target-ms', default=None, type=float, help='Target time for one password check. Defaults to 250 ms.')
+@click.option('--samples', default=3, show_default=True, type=click.IntRange(min=1), help='Timings per cost factor.')
+@click.option('--write', is_flag=True, help='Save the recommended cost as security.bcrypt_rounds.')
+def calibrate_bcrypt_command(target_ms, samples, write):
+    """Benchmark bcrypt on this host and recommend a cost factor."""
+    from sharesphere.benchmarks import calibrate_bcrypt
+
+    rounds = calibrate_bcrypt(target_ms, samples, echo=click.echo)
+    click.echo(f"Recommended security.bcrypt_rounds: {rounds}")
+    if write:
+        from omegaconf import OmegaConf
+        from sharesphere.config import get_config, save_config
+
+        config = OmegaConf.merge(get_config(), {"security": {"bcrypt_rounds": rounds}})
+        save_config(config, os.getenv("SHARESPHERE_CONFIG_PATH"))
+        click.echo("Saved. Existing passwords are re-hashed at their next successful login.")
+
+@main.command("bench-startup")
+@click.option('--runs', default=5, show_default=True, help='Number of fresh interpreters to time.')
+@click.option('--budget-ms', default=None, type=float, help='Override the cumulative import-time budget.')
+def bench_startup(runs, budget_ms):
+    """Check CLI import time and heavy imports against the startup budget."""
+    from sharesphere.benchmarks import check_startup
+
+    failures = check_startup(runs=runs, budget_ms=budget_ms, echo=click.echo)
+    if failures:
+        for failure in failures:
+            click.echo(f"FAIL: {failure}", err=True)
+        raise SystemExit(1)
+    click.echo("Startup budget OK.")
+
+@main.command("generate-key")
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Write the key to this file (readable only by you) instead of printing it.')
+def generate_key_command(output):
+    """Create a master key for encryption at rest (encryption.master_key or encryption.key_file)."""
+    from sharesphere.encryption import generate_key
+
+    key = generate_key()
+    if output is None:
+        click.echo(key)
+        return
+    fd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(key + "\n")
+    click.echo(f"Wrote a new master key to {output}; set encryption.key_file to it.")
+
+@main.command("bench-encryption")
+@click.option('--size-mb', default=256, show_default=True, type=click.IntRange(min=1), help='Size of the test file.')
+@click.option('--folder', default=None, type=click.Path(file_okay=False, exists=True), help='Where to write it. Defaults to the temporary folder; use the upload folder to measure its disk.')
+def bench_encryption_command(size_mb, folder):
+    """Compare write, read and ranged-read throughput of encrypted files with plaintext."""
+    from sharesphere.benchmarks import bench_encryption
+    from sharesphere.encryption import encryption_settings
+
+    results = bench_encryption(size_mb, folder)
+    click.echo(f"{size_mb} MB, {encryption_settings['chunk_size_kb']} KB chunks, {encryption_settings['threads']} thread(s)")
+    click.echo(f"{'':12}{'write MB/s':>12}{'read MB/s':>12}{'ranged MB/s':>13}")
+    for mode in ("plaintext", "encrypted"):
+        row = results[mode]
+        click.echo(f"{mode:12}{row['write']:12.0f}{row['read']:12.0f}{row['ranged']:13.1f}")
+    overhead = results["overhead"]
+    click.echo(f"{'overhead':12}{overhead['write']:12.0%}{overhead['read']:12.0%}{overhead['ranged']:13.0%}")
 
 if __name__ == "__main__":
     main()
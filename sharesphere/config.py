@@ -3,6 +3,8 @@ import os
 from pathlib import Path
 import logging
 import sys
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -110,4 +112,110 @@ def save_config(config: DictConfig, config_path: str = None):
     if not config_path:
         config_path = Path(os.getcwd()) / "config.yaml"
     OmegaConf.save(config, config_path)
-    logger.info(f"Configuration saved to '{config_path}'.")
\ No newline at end of file
+    logger.info(f"Configuration saved to '{config_path}'.")
+    if _service is not None:
+        _service.reload()
+
+def config_file_path(config_path: str = None) -> Path:
+    """
+    Return the configuration file `load_config` would read, using the same priority.
+    """
+    if config_path:
+        return Path(config_path)
+    cwd_config_path = Path(os.getcwd()) / "config.yaml"
+    if cwd_config_path.is_file():
+        return cwd_config_path
+    return Path(__file__).parent / "config.yaml"
+
+class ConfigService:
+    """
+    Process-wide configuration cache with hot reload.
+
+    The YAML file is parsed once and parsed again only when its modification
+    time changes; the file is stat-ed at most once every `check_interval`
+    seconds. Subscribers are called with the new configuration after every
+    reload, so settings such as the logging level apply without a restart.
+    """
+
+    def __init__(self, config_path: str = None, check_interval: float = 1.0):
+        self.config_path = config_path
+        self.check_interval = check_interval
+        self._config = None
+        self._source = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._subscribers = {}
+        self._lock = threading.RLock()
+
+    def get(self) -> DictConfig:
+        """Return the current configuration, reloading it if the file changed on disk."""
+        now = time.monotonic()
+        if self._config is not None and now - self._checked_at < self.check_interval:
+            return self._config
+        with self._lock:
+            self._checked_at = now
+            source = config_file_path(self.config_path)
+            try:
+                mtime = source.stat().st_mtime_ns
+            except OSError:
+                mtime = None
+            if self._config is None or source != self._source or mtime != self._mtime:
+                self._load(source, mtime)
+        return self._config
+
+    def reload(self) -> DictConfig:
+        """Re-read the configuration file unconditionally."""
+        with self._lock:
+            # Forget what was read, not the configuration itself: if the file no longer
+            # parses, `_load` keeps serving the last good one
+            self._source, self._mtime = None, None
+            self._checked_at = 0.0
+        return self.get()
+
+    def subscribe(self, key: str, callback, call_now: bool = True):
+        """
+        Register `callback(config)` to run after each reload.
+
+        Subscribing again with the same key replaces the earlier callback, which
+        lets Streamlit scripts re-register on every rerun.
+        """
+        with self._lock:
+            self._subscribers[key] = callback
+        if call_now:
+            callback(self.get())
+
+    def _load(self, source: Path, mtime):
+        first_load = self._config is None and self._source is None
+        try:
+            config = load_config(self.config_path)
+        except Exception:
+            if self._config is None:
+                raise
+            # Keep serving the last good configuration if an edit left the file unreadable
+            logger.error(f"Keeping previous configuration; reloading '{source}' failed.")
+            self._source, self._mtime = source, mtime
+            return
+        self._config, self._source, self._mtime = config, source, mtime
+        if not first_load:
+            logger.info(f"Configuration reloaded from '{source}'.")
+        for key, callback in list(self._subscribers.items()):
+            try:
+                callback(config)
+            except Exception as e:
+                logger.error(f"Configuration subscriber '{key}' failed: {e}")
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_config_service() -> ConfigService:
+    """Return the process-wide ConfigService, honouring SHARESPHERE_CONFIG_PATH."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ConfigService(os.getenv("SHARESPHERE_CONFIG_PATH", None))
+    return _service
+
+def get_config() -> DictConfig:
+    """Shortcut for `get_config_service().get()`."""
+    return get_config_service().get()
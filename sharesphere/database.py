@@ -1,25 +1,115 @@
 # sharesphere/database.py
 
-from sqlalchemy import create_engine
+from sqlalchemy import literal_column
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sharesphere.config import load_config
+from sharesphere.config import get_config
+from datetime import datetime
 import os
+import threading
 
-config = load_config()
-DATABASE_URL = config.db.url
+Base = declarative_base()
 
-# Ensure the database URL is set correctly
-if DATABASE_URL.startswith('sqlite:///'):
-    db_path = DATABASE_URL.replace('sqlite:///', '')
-    if not os.path.isabs(db_path):
-        db_path = os.path.join(os.getcwd(), db_path)
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    DATABASE_URL = f"sqlite:///{db_path}"
+_engine = None
+_engine_lock = threading.Lock()
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def database_url() -> str:
+    """Return the configured database URL, with relative SQLite paths made absolute."""
+    url = get_config().db.url
+    # Ensure the database URL is set correctly
+    if url.startswith('sqlite:///'):
+        db_path = url.replace('sqlite:///', '')
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(os.getcwd(), db_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        url = f"sqlite:///{db_path}"
+    return url
 
-Base = declarative_base()
\ No newline at end of file
+def get_engine():
+    """Create the SQLAlchemy engine on first use and bind SessionLocal to it."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                from sqlalchemy import create_engine, event
+
+                url = database_url()
+                _engine = create_engine(
+                    url, connect_args={"check_same_thread": False, "timeout": 30}
+                )
+                if url.startswith("sqlite"):
+                    # Several processes (app workers, API) share the file; WAL lets readers
+                    # proceed during writes and the timeout waits out short write locks.
+                    event.listen(_engine, "connect", _set_sqlite_pragmas)
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+class _LazySessionmaker(sessionmaker):
+    """sessionmaker that creates the engine the first time a session is opened."""
+
+    def __call__(self, **local_kw):
+        if _engine is None:
+            get_engine()
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+
+def __getattr__(name):
+    # `engine`, `config` and `DATABASE_URL` used to be created at import time
+    if name == "engine":
+        return get_engine()
+    if name == "config":
+        return get_config()
+    if name == "DATABASE_URL":
+        return database_url()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+_schema_ready = False
+
+# Initial values (or SQL expressions over the row) for columns added to an
+# existing table, by (table, column); other added columns start out NULL.
+# Counting every existing file as read at upgrade time gives it a full
+# tiering.archive_after_days before it can be archived.
+COLUMN_BACKFILLS = {
+    ("files", "last_accessed_at"): datetime.utcnow,
+    ("jobs", "file_id"): lambda: literal_column("json_extract(payload, '$.file_id')"),
+}
+
+def init_db():
+    """
+    Bring the database schema up to date with the models.
+
+    Creates missing tables, adds columns introduced after the database was
+    created (filling them from COLUMN_BACKFILLS) and creates missing indexes,
+    then backfills the group closure table if it is new. Runs once per process.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    from sqlalchemy import inspect, text
+    from sharesphere import models  # noqa: F401  (registers the tables on Base.metadata)
+
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                    backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                    if backfill is not None:
+                        conn.execute(table.update().values({column.name: backfill()}))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+    from sharesphere.groups import ensure_closure
+
+    ensure_closure()
+    _schema_ready = True
@@ -0,0 +1,332 @@
+# sharesphere/encryption.py
+
+"""
+Envelope encryption at rest for uploaded files. Optional: it needs the
+`cryptography` package (`pip install sharesphere[encryption]`).
+
+With `encryption.enabled`, every file written through UploadWriter, and
+every chunk of the version store, gets a fresh 256-bit data key. The data
+key is wrapped with AES-GCM under the master key from `encryption.master_key`
+or `encryption.key_file` and stored in the file's header. The content follows
+as independent AES-GCM chunks of `encryption.chunk_size_kb`. Each chunk's
+nonce is a per-file prefix plus the chunk number, and its associated data is
+the chunk number and a last-chunk flag, so chunks cannot be reordered,
+dropped or cut off unnoticed.
+
+Because the chunks are independent, batches of them are sealed and opened in
+parallel on a thread pool of `encryption.threads`. A ranged read decrypts only
+the chunks it overlaps, and no more than one batch is held in memory.
+
+Files are recognised by their header. Files written before encryption was
+enabled stay readable as they are, and turning it off again only affects new
+uploads. Without the master key the files cannot be read, so keep it safe and
+apart from backups of the upload folder.
+"""
+
+from .config import get_config_service
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import base64
+import hashlib
+import io
+import logging
+import os
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SSENC\x00\x00\x01"
+# magic, chunk size, master key ID, wrapping nonce, wrapped data key (key + tag), chunk nonce prefix
+HEADER = struct.Struct(">8sI8s12s48s8s")
+TAG_SIZE = 16
+KEY_SIZE = 32
+
+# Encryption settings, refreshed by the config service whenever config.yaml changes
+encryption_settings = {
+    "enabled": False,
+    "master_key": None,
+    "key_file": None,
+    "chunk_size_kb": 256,
+    "threads": min(4, os.cpu_count() or 1),
+}
+
+_master_key = None
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+def _apply_encryption_settings(config):
+    global _master_key
+    settings = config.get("encryption", {}) or {}
+    for key in encryption_settings:
+        if key in settings:
+            encryption_settings[key] = settings[key]
+    _master_key = None
+
+get_config_service().subscribe("encryption.encryption_settings", _apply_encryption_settings)
+
+def _aesgcm():
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise RuntimeError("Encryption at rest needs the 'cryptography' package: pip install sharesphere[encryption]")
+    return AESGCM
+
+def generate_key() -> str:
+    """Return a new random master key, base64-encoded for `encryption.master_key` or a key file."""
+    return base64.b64encode(os.urandom(KEY_SIZE)).decode("ascii")
+
+def _decode_key(value) -> bytes:
+    if isinstance(value, str):
+        value = value.strip().encode("ascii")
+    if len(value) != KEY_SIZE:
+        value = base64.b64decode(value.strip(), validate=True)
+    if len(value) != KEY_SIZE:
+        raise ValueError(f"The encryption master key must be {KEY_SIZE} bytes (base64-encoded).")
+    return value
+
+def master_key() -> bytes:
+    """Return the configured master key, read from `encryption.key_file` if `encryption.master_key` is not set."""
+    global _master_key
+    if _master_key is None:
+        if encryption_settings["master_key"]:
+            _master_key = _decode_key(encryption_settings["master_key"])
+        elif encryption_settings["key_file"]:
+            _master_key = _decode_key(Path(encryption_settings["key_file"]).read_bytes())
+        else:
+            raise ValueError("No encryption master key configured; set encryption.master_key or encryption.key_file.")
+    return _master_key
+
+def _key_id(key: bytes) -> bytes:
+    return hashlib.sha256(b"sharesphere key id" + key).digest()[:8]
+
+def enabled() -> bool:
+    return bool(encryption_settings["enabled"])
+
+def chunk_size() -> int:
+    return int(encryption_settings["chunk_size_kb"]) * 1024
+
+def _threads() -> int:
+    return max(1, int(encryption_settings["threads"] or 1))
+
+def _map(function, items: list) -> list:
+    """Apply `function` to `items` on the shared thread pool, in order; inline for a single item."""
+    global _pool, _pool_size
+    threads = _threads()
+    if len(items) < 2 or threads < 2:
+        return [function(item) for item in items]
+    with _pool_lock:
+        if _pool is None or _pool_size != threads:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool, _pool_size = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="encryption"), threads
+        pool = _pool
+    return list(pool.map(function, items))
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + struct.pack(">I", index)
+
+def _associated_data(index: int, last: bool) -> bytes:
+    return struct.pack(">I?", index, last)
+
+class EncryptingWriter:
+    """
+    Binary file-like object that encrypts what is written to it into `raw`.
+
+    Full chunks are sealed in batches of up to `encryption.threads` chunks;
+    `close()` seals the remainder as the last chunk and closes `raw`.
+    """
+
+    def __init__(self, raw, key: bytes = None, chunk_size_bytes: int = None):
+        AESGCM = _aesgcm()
+        key = key or master_key()
+        self.raw = raw
+        self.chunk_size = chunk_size_bytes or chunk_size()
+        self.closed = False
+        data_key = AESGCM.generate_key(bit_length=256)
+        prefix = os.urandom(8)
+        wrap_nonce = os.urandom(12)
+        key_id = _key_id(key)
+        wrapped = AESGCM(key).encrypt(wrap_nonce, data_key, MAGIC + struct.pack(">I", self.chunk_size) + key_id + prefix)
+        raw.write(HEADER.pack(MAGIC, self.chunk_size, key_id, wrap_nonce, wrapped, prefix))
+        self._cipher = AESGCM(data_key)
+        self._prefix = prefix
+        self._index = 0
+        self._buffer = bytearray()
+
+    def _seal(self, item) -> bytes:
+        index, data, last = item
+        return self._cipher.encrypt(_nonce(self._prefix, index), data, _associated_data(index, last))
+
+    def _seal_all(self, chunks: list):
+        for sealed in _map(self._seal, [(self._index + n, data, False) for n, data in enumerate(chunks)]):
+            self.raw.write(sealed)
+        self._index += len(chunks)
+
+    def write(self, data) -> int:
+        view = memoryview(data).cast("B")
+        size = self.chunk_size
+        pending = []
+        taken = 0
+        while taken < len(view):
+            # A full buffered chunk is only sealed once more data shows it is not the last one
+            if len(self._buffer) == size:
+                pending.append(bytes(self._buffer))
+                self._buffer = bytearray()
+            if not self._buffer and len(view) - taken > size:
+                pending.append(view[taken:taken + size])
+                taken += size
+            else:
+                step = min(size - len(self._buffer), len(view) - taken)
+                self._buffer += view[taken:taken + step]
+                taken += step
+            if len(pending) == _threads():
+                self._seal_all(pending)
+                pending = []
+        if pending:
+            self._seal_all(pending)
+        return len(view)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.raw.write(self._seal((self._index, bytes(self._buffer), True)))
+            self._buffer = bytearray()
+        finally:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+def wrap_writer(raw):
+    """Return `raw`, a binary file open for writing, wrapped to encrypt if encryption is enabled."""
+    return EncryptingWriter(raw) if enabled() else raw
+
+def is_encrypted_file(raw) -> bool:
+    """Return True if the binary file `raw`, open for reading, starts with an encryption header."""
+    return os.pread(raw.fileno(), len(MAGIC), 0) == MAGIC
+
+class DecryptingReader(io.RawIOBase):
+    """Seekable reader of the plaintext of an encrypted file open as `raw`."""
+
+    def __init__(self, raw, key: bytes = None):
+        super().__init__()
+        self.raw = raw
+        self.name = getattr(raw, "name", "?")
+        header = os.pread(raw.fileno(), HEADER.size, 0)
+        if len(header) != HEADER.size:
+            raise IOError(f"Encrypted file '{self.name}' is truncated.")
+        magic, self.chunk_size, key_id, wrap_nonce, wrapped, self._prefix = HEADER.unpack(header)
+        AESGCM = _aesgcm()
+        key = key or master_key()
+        if key_id != _key_id(key):
+            raise ValueError(f"'{self.name}' was encrypted with a different master key.")
+        try:
+            data_key = AESGCM(key).decrypt(wrap_nonce, wrapped, magic + struct.pack(">I", self.chunk_size) + key_id + self._prefix)
+        except Exception:
+            raise IOError(f"The data key of '{self.name}' failed authentication.")
+        self._cipher = AESGCM(data_key)
+        self.chunks, self.size = _plaintext_layout(os.fstat(raw.fileno()).st_size, self.chunk_size)
+        self._position = 0
+        self._cached = (None, b"")
+
+    def _open(self, item) -> bytes:
+        index, data = item
+        try:
+            return self._cipher.decrypt(_nonce(self._prefix, index), data, _associated_data(index, index == self.chunks - 1))
+        except Exception:
+            raise IOError(f"Chunk {index} of '{self.name}' failed authentication.")
+
+    def read_chunks(self, first: int, last: int) -> list:
+        """Decrypt chunks `first` to `last` (inclusive), reading them in one call and opening them in parallel."""
+        stride = self.chunk_size + TAG_SIZE
+        data = memoryview(os.pread(self.raw.fileno(), (last - first + 1) * stride, HEADER.size + first * stride))
+        pieces = [(first + n, data[n * stride:(n + 1) * stride]) for n in range(last - first + 1)]
+        return _map(self._open, pieces)
+
+    def iter_range(self, start: int = 0, end: int = None):
+        """Yield the plaintext from `start` up to, but excluding, `end`, decrypting only the chunks it overlaps."""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        first, last = start // self.chunk_size, (end - 1) // self.chunk_size
+        batch = _threads()
+        for batch_first in range(first, last + 1, batch):
+            batch_last = min(batch_first + batch - 1, last)
+            for index, plaintext in enumerate(self.read_chunks(batch_first, batch_last), start=batch_first):
+                offset = index * self.chunk_size
+                if start <= offset and offset + len(plaintext) <= end:
+                    yield plaintext
+                else:
+                    yield plaintext[max(start - offset, 0):end - offset]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.size:
+            return 0
+        index = self._position // self.chunk_size
+        if self._cached[0] != index:
+            self._cached = (index, self.read_chunks(index, index)[0])
+        offset = self._position - index * self.chunk_size
+        data = self._cached[1][offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+def _plaintext_layout(stored_size: int, chunk_size_bytes: int) -> tuple:
+    """Return (number of chunks, plaintext size) of an encrypted file of `stored_size` bytes."""
+    payload = stored_size - HEADER.size
+    stride = chunk_size_bytes + TAG_SIZE
+    chunks = -(-payload // stride)
+    if payload < TAG_SIZE or payload - (chunks - 1) * stride < TAG_SIZE:
+        raise IOError(f"Encrypted file of {stored_size} bytes is truncated.")
+    return chunks, payload - chunks * TAG_SIZE
+
+def open_file(path):
+    """Open a stored file for reading its plaintext, whether it is encrypted or not."""
+    raw = open(path, "rb")
+    try:
+        if not is_encrypted_file(raw):
+            return raw
+        reader = DecryptingReader(raw)
+    except BaseException:
+        raw.close()
+        raise
+    return io.BufferedReader(reader, buffer_size=reader.chunk_size)
+
+def iter_range(raw, start: int = 0, end: int = None):
+    """Yield the plaintext of the encrypted file open as `raw` from `start` up to `end`."""
+    yield from DecryptingReader(raw).iter_range(start, end)
+
+def plaintext_size(path) -> int:
+    """Return the size of a stored file's content: its own size, less the header and tags if encrypted."""
+    with open(path, "rb") as raw:
+        if not is_encrypted_file(raw):
+            return os.fstat(raw.fileno()).st_size
+        chunk_size_bytes = HEADER.unpack(os.pread(raw.fileno(), HEADER.size, 0))[1]
+        return _plaintext_layout(os.fstat(raw.fileno()).st_size, chunk_size_bytes)[1]
@@ -1,78 +1,635 @@
 # sharesphere/file_manager.py
 
+from .activity import record_event
+from .jobs import enqueue_many, forget_file_jobs
+from .config import get_config_service
 from .database import SessionLocal
-from .models import File, FileSharing, Group
+from .groups import member_ids
+from .models import File, FileSharing, FileVersion
+from .versioning import iter_version, release_versions, remove_chunk_blobs, remove_version_files
+from .tiering import ensure_hot, release_archived, remove_dead_packs
+from .limits import TransferQueueTimeout, throttled, transfer_slot
+from . import encryption, stats
 from sharesphere.models import User
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import joinedload  # Ensure this import is correct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from pathlib import Path
+import itertools
 import os
+import tempfile
 import logging
 
 logger = logging.getLogger(__name__)
 
-def upload_file(uploader_id: int, uploader_name: str, file_storage, file_comment: str, shared_with_group: bool, shared_users: list, shared_groups: list):
-    filename = file_storage.name
-    upload_folder = Path("uploads") / uploader_name
+# Upload settings, refreshed by the config service whenever config.yaml changes
+upload_settings = {"folder": "uploads", "allowed_extensions": None, "max_file_size": None, "parallel_writes": 4}
+
+def _apply_upload_settings(config):
+    upload = config.get("upload", {})
+    extensions = upload.get("allowed_extensions")
+    upload_settings["folder"] = upload.get("folder", "uploads")
+    upload_settings["allowed_extensions"] = {ext.lower().lstrip(".") for ext in extensions} if extensions else None
+    upload_settings["max_file_size"] = upload.get("max_file_size")
+    upload_settings["parallel_writes"] = upload.get("parallel_writes", 4)
+
+get_config_service().subscribe("file_manager.upload_settings", _apply_upload_settings)
+
+PURGE_BATCH_SIZE = 500
+BUSY_MESSAGE = "The server is busy with other transfers; please try again shortly."
+
+# Background jobs enqueued for every new file; handlers live in sharesphere/processing.py
+POST_UPLOAD_JOBS = ("sniff_type", "checksum", "metadata", "preview", "chunk_version")
+
+def check_upload_allowed(filename: str, size: int):
+    """
+    Validate a file against the configured allowed extensions and maximum size.
+
+    Returns:
+        tuple: (True, None) if the file may be uploaded, else (False, reason).
+    """
+    allowed = upload_settings["allowed_extensions"]
+    extension = Path(filename).suffix.lower().lstrip(".")
+    if allowed is not None and extension not in allowed:
+        return False, f"File type '.{extension}' is not allowed." if extension else "Files without an extension are not allowed."
+    max_size = upload_settings["max_file_size"]
+    if max_size and size > max_size:
+        return False, f"File exceeds the maximum size of {max_size} bytes."
+    return True, None
+
+def safe_filename(filename: str) -> str:
+    """Strip any directory components from a client-supplied filename; raise ValueError if nothing is left."""
+    name = Path(str(filename).replace("\\", "/")).name
+    if name in ("", ".", ".."):
+        raise ValueError(f"Invalid filename '{filename}'.")
+    return name
+
+def upload_path(uploader_name: str, filename: str) -> Path:
+    """Return where an upload named `filename` by `uploader_name` is stored, creating the folder."""
+    upload_folder = Path(upload_settings["folder"]) / uploader_name
     upload_folder.mkdir(parents=True, exist_ok=True)
-    file_path = upload_folder / filename
-    
+    return upload_folder / filename
+
+def name_candidates(file_path):
+    """Yield `file_path`, then "name (1).ext", "name (2).ext" and so on, for finding a free name."""
+    file_path = Path(file_path)
+    yield file_path
+    for n in itertools.count(1):
+        yield file_path.with_name(f"{file_path.stem} ({n}){file_path.suffix}")
+
+class UploadWriter:
+    """
+    Write an upload incrementally to a temporary file next to `file_path`.
+
+    `commit()` moves the bytes into place, so readers never see a partial
+    upload; `abort()` discards them. An existing file is never overwritten
+    unless `commit(replace=True)`: if `file_path` is taken, the upload is
+    stored as "name (1).ext" and so on, and `file_path` is updated to the
+    name actually used. With `encryption.enabled` the bytes are encrypted
+    as they are written (see sharesphere/encryption.py).
+    """
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        fd, part_path = tempfile.mkstemp(prefix=self.file_path.name + ".", suffix=".part", dir=self.file_path.parent)
+        self.part_path = Path(part_path)
+        self.size = 0
+        self._file = os.fdopen(fd, "wb")
+        try:
+            self._file = encryption.wrap_writer(self._file)
+        except BaseException:
+            self.abort()
+            raise
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, replace: bool = False):
+        self._file.close()
+        if replace:
+            os.replace(self.part_path, self.file_path)
+            return self.file_path
+        for candidate in name_candidates(self.file_path):
+            try:
+                # link() fails instead of replacing an existing file
+                os.link(self.part_path, candidate)
+            except FileExistsError:
+                continue
+            except OSError:
+                # Filesystem without hard links: reserve the name, then move over it
+                try:
+                    os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                except FileExistsError:
+                    continue
+                os.replace(self.part_path, candidate)
+            else:
+                os.unlink(self.part_path)
+            self.file_path = candidate
+            return candidate
+
+    def abort(self):
+        self._file.close()
+        if self.part_path.exists():
+            self.part_path.unlink()
+
+def write_stream(file_path, chunks, replace: bool = False) -> Path:
+    """
+    Write an iterable of byte chunks to `file_path` through an UploadWriter.
+
+    Returns:
+        Path: Where the file was stored; differs from `file_path` if that name
+        was taken, unless `replace` overwrites it.
+    """
+    writer = UploadWriter(file_path)
     try:
-        with open(file_path, "wb") as f:
-            f.write(file_storage.getbuffer())
-        logger.info(f"File '{filename}' uploaded by user ID {uploader_id} to '{uploader_name}' folder.")
-        
-        # Add file record to the database
-        db = SessionLocal()
-        new_file = File(filename=filename, filepath=str(file_path), owner_id=uploader_id, comment=file_comment)
-        db.add(new_file)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.commit(replace)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.file_path
+
+def write_upload(uploader_id: int, uploader_name: str, filename: str, buffer) -> Path:
+    """
+    Write an upload held in memory to the uploader's folder, within the
+    uploader's transfer slot and bandwidth share (see sharesphere/limits.py).
+
+    Returns:
+        Path: Where the file was stored.
+    """
+    with transfer_slot(uploader_id, uploader_name):
+        return write_stream(upload_path(uploader_name, filename), throttled(uploader_id, [buffer], "upload"))
+
+def iter_file(file_path, start: int = 0, end: int = None, chunk_size: int = 1024 * 1024):
+    """
+    Yield the bytes of `file_path` from `start` up to, but excluding, `end` in chunks.
+    An encrypted file is decrypted, only the chunks the range overlaps.
+    """
+    with open(file_path, "rb") as f:
+        if encryption.is_encrypted_file(f):
+            yield from encryption.iter_range(f, start, end)
+            return
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def file_size(file_path) -> int:
+    """Return the size of a stored file's content, which for an encrypted file is less than its size on disk."""
+    return encryption.plaintext_size(file_path)
+
+def _share_recipients(db, uploader_id: int, shared_with_group: bool, shared_users: list, shared_groups: list):
+    """
+    Resolve sharing options to a sorted list of recipient user IDs with set-based queries.
+    A group stands for its members and the members of all its subgroups.
+    """
+    if shared_with_group:
+        queries = [select(User.id)]
+    else:
+        queries = []
+        if shared_users:
+            queries.append(select(User.id).where(User.id.in_(shared_users)))
+        if shared_groups:
+            queries.append(member_ids(shared_groups))
+    recipients = set()
+    for query in queries:
+        recipients.update(row[0] for row in db.execute(query.distinct()))
+    recipients.discard(uploader_id)
+    return sorted(recipients)
+
+def _supersede_versions(db, uploader_id: int, previous: dict, paths: dict, now) -> list:
+    """
+    Hand the working copies of the files in `previous` (filename -> File row)
+    over to their outgoing versions, within the caller's transaction. Files
+    from before version history was kept get a row for the outgoing version.
+
+    Returns:
+        list: Dicts with the id, file_id, version and chunked_at of each
+        outgoing version, and its filepath: the old working copy. Versions
+        not chunked yet keep it as FileVersion.filepath until the
+        chunk_version job runs.
+    """
+    rows = {
+        (row.id, row.version or 1): row for filename, row in previous.items()
+        # A working copy missing from disk leaves its name free for the new upload; nothing to hand over
+        if os.path.abspath(row.filepath) != os.path.abspath(paths[filename])
+    }
+    if not rows:
+        return []
+    db.execute(
+        sqlite_insert(FileVersion.__table__).on_conflict_do_nothing(),
+        [{"file_id": file_id, "version": number, "size": row.size, "uploaded_by": uploader_id,
+          "comment": row.comment, "created_at": row.uploaded_at or now} for (file_id, number), row in rows.items()],
+    )
+    superseded = [
+        dict(version._asdict(), filepath=rows[(version.file_id, version.version)].filepath)
+        for version in db.query(FileVersion.id, FileVersion.file_id, FileVersion.version, FileVersion.chunked_at)
+        .filter(tuple_(FileVersion.file_id, FileVersion.version).in_(list(rows)))
+    ]
+    pending = [{"version_id": row["id"], "pending_path": row["filepath"]} for row in superseded if row["chunked_at"] is None]
+    if pending:
+        table = FileVersion.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam("version_id")).values(filepath=bindparam("pending_path")),
+            pending,
+        )
+    return superseded
+
+def register_files(uploader_id: int, uploads: list, file_comment: str, shared_with_group: bool = False,
+                   shared_users: list = None, shared_groups: list = None, expires_at=None, share_expires_at=None,
+                   version_of: int = None, before_commit=None) -> list:
+    """
+    Record uploaded files and their sharing rows in one transaction.
+
+    An upload named like a live file of the same owner becomes a new version
+    of that file: the file keeps its ID and shares and its working copy
+    becomes the uploaded file. The outgoing version's file is removed after
+    the commit if its chunks are stored, or else left for the chunk_version
+    job, which removes it once it has stored them (see sharesphere/versioning.py).
+
+    Args:
+        uploads (list): (filename, file_path) pairs of files already written to disk.
+        expires_at (datetime, optional): When the files are removed by the expiry sweeper.
+        share_expires_at (datetime, optional): When the recipients lose access.
+        version_of (int, optional): For a single upload, the ID of the file it
+            becomes a new version of, instead of looking it up by name.
+        before_commit (callable, optional): Called as `before_commit(db, file_ids)`
+            just before the transaction commits, to write rows that must be
+            committed together with the files.
+
+    Returns:
+        list: IDs of the File rows, in the order of `uploads`.
+    """
+    db = SessionLocal()
+    try:
+        previous = {}
+        candidates = db.query(File.id, File.filename, File.filepath, File.version, File.size, File.comment,
+                              File.uploaded_at, File.archived_at).filter(
+            File.owner_id == uploader_id, File.deleted_at.is_(None), _not_expired(File.expires_at)
+        )
+        if version_of is not None:
+            candidates = candidates.filter(File.id == version_of)
+        else:
+            candidates = candidates.filter(File.filename.in_([filename for filename, _ in uploads]))
+        # Older rows sharing a name (from before versioning) lose to the newest one
+        for row in candidates.order_by(File.id):
+            previous[uploads[0][0] if version_of is not None else row.filename] = row
+        sizes = {filename: file_size(file_path) for filename, file_path in uploads}
+        for row in previous.values():
+            if row.archived_at is not None:
+                # The outgoing version may never have been chunked; its bytes must be on disk for the job
+                ensure_hot(row.id)
+
+        now = datetime.utcnow()
+        paths = dict(uploads)
+        new_files = [
+            {"filename": filename, "filepath": str(file_path), "owner_id": uploader_id, "uploaded_at": now,
+             "comment": file_comment, "size": sizes[filename], "expires_at": expires_at, "version": 1}
+            for filename, file_path in uploads
+            if filename not in previous
+        ]
+        # One multi-row INSERT ... RETURNING for the whole batch rather than a statement per file
+        file_ids = {}
+        if new_files:
+            file_ids = {
+                row.filename: row.id for row in
+                db.execute(insert(File).returning(File.id, File.filename), new_files)
+            }
+        numbers = {filename: 1 for filename in file_ids}
+        if previous:
+            values = {
+                "version": bindparam("new_version"), "filepath": bindparam("new_path"), "size": bindparam("new_size"),
+                "uploaded_at": now, "checksum": None, "mime_type": None, "content_warning": None, "preview_path": None,
+                "file_metadata": None, "archived_at": None,
+            }
+            if file_comment:
+                values["comment"] = file_comment
+            if expires_at:
+                values["expires_at"] = expires_at
+            for filename, row in previous.items():
+                file_ids[filename] = row.id
+                numbers[filename] = (row.version or 1) + 1
+            # One executemany for every new version rather than an UPDATE per file
+            table = File.__table__
+            db.execute(update(table).where(table.c.id == bindparam("file_id")).values(**values), [
+                {"file_id": row.id, "new_version": numbers[filename], "new_path": str(paths[filename]),
+                 "new_size": sizes[filename]}
+                for filename, row in previous.items()
+            ])
+        superseded = _supersede_versions(db, uploader_id, previous, paths, now) if previous else []
+        # In case the archiver took the outgoing version after `ensure_hot`
+        dead_packs = release_archived(db, [row.id for row in previous.values()])
+        # RETURNING carries the keys because multi-row inserts do not promise to return rows in order
+        version_ids_by_file = {
+            row.file_id: row.id for row in db.execute(
+                insert(FileVersion).returning(FileVersion.id, FileVersion.file_id),
+                [{"file_id": file_ids[filename], "version": numbers[filename], "size": sizes[filename],
+                  "comment": file_comment, "uploaded_by": uploader_id, "created_at": now} for filename, _ in uploads],
+            )
+        }
+        version_ids = {filename: version_ids_by_file[file_ids[filename]] for filename, _ in uploads}
+
+        recipients = _share_recipients(db, uploader_id, shared_with_group, shared_users, shared_groups)
+        if recipients:
+            already_shared = {
+                (row.file_id, row.user_id) for row in db.query(FileSharing.file_id, FileSharing.user_id).filter(
+                    FileSharing.file_id.in_([row.id for row in previous.values()]),
+                    FileSharing.is_shared == True,
+                    _not_expired(FileSharing.expires_at),
+                )
+            } if previous else set()
+            shares = [
+                {"file_id": file_id, "user_id": user_id, "is_shared": True, "expires_at": share_expires_at}
+                for file_id in file_ids.values()
+                for user_id in recipients
+                if (file_id, user_id) not in already_shared
+            ]
+            if shares:
+                db.execute(insert(FileSharing), shares)
+        else:
+            shares = []
+        stats.apply_file_deltas(db, {uploader_id: {
+            "files": len(new_files),
+            "bytes": sum(row["size"] for row in new_files)
+                     + sum(sizes[filename] - (row.size or 0) for filename, row in previous.items()),
+            "shares": len(shares),
+        }})
+        stats.record_uploads(db, len(uploads), sum(sizes[filename] for filename, _ in uploads))
+        # Sniffing, checksumming, previews and chunking run later in `sharesphere worker`;
+        # the jobs commit with the rows so none are lost if the app stops now.
+        enqueue_many([
+            (kind, {"file_id": file_ids[filename], "version_id": version_id}, f"{kind}:{file_ids[filename]}:v{numbers[filename]}")
+            for filename, version_id in version_ids.items()
+            for kind in POST_UPLOAD_JOBS
+        ] + [
+            ("chunk_version", {"file_id": row["file_id"], "version_id": row["id"]}, f"chunk_version:{row['file_id']}:v{row['version']}")
+            for row in superseded if row["chunked_at"] is None
+        ], db)
+        if before_commit:
+            before_commit(db, [file_ids[filename] for filename, _ in uploads])
+        # Outgoing versions already in the chunk store no longer need their file
+        obsolete = [row["filepath"] for row in superseded if row["chunked_at"] is not None]
+        if obsolete:
+            still_used = {path for (path,) in db.query(File.filepath).filter(File.filepath.in_(obsolete))}
+            obsolete = [path for path in obsolete if path not in still_used]
         db.commit()
-        db.refresh(new_file)
-        
-        # Handle sharing permissions
-        if shared_with_group:
-            users = db.query(User).all()
-            for user in users:
-                if user.id != uploader_id:
-                    fs = FileSharing(file_id=new_file.id, user_id=user.id, is_shared=True)
-                    db.add(fs)
-            db.commit()
+    finally:
+        db.close()
+    remove_dead_packs(dead_packs)
+    remove_version_files(obsolete)
+
+    for filename, _ in uploads:
+        file_id = file_ids[filename]
+        record_event("upload", file_id, uploader_id)
+        if filename in previous:
+            logger.info(f"File '{filename}' (ID {file_id}) uploaded as version {numbers[filename]} by user ID {uploader_id}.")
+        elif shared_with_group:
             logger.info(f"File '{filename}' shared with the entire group by user ID {uploader_id}.")
-        elif shared_users:
-            for user_id in shared_users:
-                fs = FileSharing(file_id=new_file.id, user_id=user_id, is_shared=True)
-                db.add(fs)
-            db.commit()
-            logger.info(f"File '{filename}' shared with specific users by user ID {uploader_id}.")
-        elif shared_groups:
-            for group_id in shared_groups:
-                group = db.query(Group).filter(Group.id == group_id).first()
-                for user in group.members:
-                    if user.id != uploader_id:
-                        fs = FileSharing(file_id=new_file.id, user_id=user.id, is_shared=True)
-                        db.add(fs)
-            db.commit()
-            logger.info(f"File '{filename}' shared with specific groups by user ID {uploader_id}.")
+        elif shared_users or shared_groups:
+            logger.info(f"File '{filename}' shared with specific users or groups by user ID {uploader_id}.")
         else:
             logger.info(f"File '{filename}' uploaded without sharing by user ID {uploader_id}.")
-        
-        db.close()
+    return [file_ids[filename] for filename, _ in uploads]
+
+def register_file(uploader_id: int, filename: str, file_path, file_comment: str, shared_with_group: bool = False,
+                  shared_users: list = None, shared_groups: list = None, expires_at=None, share_expires_at=None) -> int:
+    """
+    Record an uploaded file and its sharing rows in one transaction.
+
+    Returns:
+        int: ID of the new File row.
+    """
+    return register_files(uploader_id, [(filename, file_path)], file_comment, shared_with_group, shared_users, shared_groups,
+                          expires_at, share_expires_at)[0]
+
+def discard_uploads(paths):
+    """Delete files written for an upload that could not be registered, so they do not linger as orphans."""
+    for path in paths:
+        try:
+            Path(path).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not remove unregistered upload '{path}': {e}")
+
+def upload_file(uploader_id: int, uploader_name: str, file_storage, file_comment: str, shared_with_group: bool, shared_users: list, shared_groups: list,
+                expires_at=None, share_expires_at=None):
+    try:
+        filename = safe_filename(file_storage.name)
+    except ValueError as e:
+        return False, str(e)
+    allowed, reason = check_upload_allowed(filename, file_storage.size)
+    if not allowed:
+        logger.warning(f"Rejected upload of '{filename}' by user ID {uploader_id}: {reason}")
+        return False, reason
+    file_path = None
+    try:
+        file_path = write_upload(uploader_id, uploader_name, filename, file_storage.getbuffer())
+        logger.info(f"File '{filename}' uploaded by user ID {uploader_id} to '{uploader_name}' folder.")
+        register_file(uploader_id, filename, file_path, file_comment, shared_with_group, shared_users, shared_groups,
+                      expires_at, share_expires_at)
         return True, "File uploaded successfully."
+    except TransferQueueTimeout:
+        logger.warning(f"Upload of '{filename}' by user ID {uploader_id} timed out waiting for a transfer slot.")
+        return False, BUSY_MESSAGE
     except Exception as e:
         logger.error(f"Error uploading file '{filename}': {e}")
+        if file_path is not None:
+            discard_uploads([file_path])
         return False, "Failed to upload file."
 
+def upload_files(uploader_id: int, uploader_name: str, file_storages: list, file_comment: str, shared_with_group: bool,
+                 shared_users: list, shared_groups: list, progress=None, expires_at=None, share_expires_at=None) -> list:
+    """
+    Upload several files at once.
+
+    File bodies are written in parallel on a bounded thread pool, then every
+    file that reached the disk is registered, with its sharing rows, in a
+    single transaction.
+
+    Args:
+        progress (callable, optional): Called on the calling thread as
+            `progress(filename, success, message)` when each file finishes writing.
+        expires_at, share_expires_at (datetime, optional): See `register_files`.
+
+    Returns:
+        list: (filename, success, message) tuples in the order of `file_storages`.
+    """
+    results = {}
+    pending = []
+    seen = set()
+    for index, file_storage in enumerate(file_storages):
+        try:
+            filename = safe_filename(file_storage.name)
+        except ValueError as e:
+            results[index] = (file_storage.name, False, str(e))
+            continue
+        allowed, reason = check_upload_allowed(filename, file_storage.size)
+        if not allowed:
+            logger.warning(f"Rejected upload of '{filename}' by user ID {uploader_id}: {reason}")
+            results[index] = (filename, False, reason)
+        elif filename in seen:
+            results[index] = (filename, False, "A file with the same name is already part of this upload.")
+        else:
+            seen.add(filename)
+            pending.append((index, filename, file_storage))
+    if progress:
+        for filename, success, message in results.values():
+            progress(filename, success, message)
+
+    written = []
+    workers = max(1, min(upload_settings["parallel_writes"], len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload-writer") as pool:
+        futures = {
+            pool.submit(write_upload, uploader_id, uploader_name, filename, file_storage.getbuffer()): (index, filename)
+            for index, filename, file_storage in pending
+        }
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            try:
+                file_path = future.result()
+            except TransferQueueTimeout:
+                logger.warning(f"Upload of '{filename}' by user ID {uploader_id} timed out waiting for a transfer slot.")
+                results[index] = (filename, False, BUSY_MESSAGE)
+                if progress:
+                    progress(filename, False, BUSY_MESSAGE)
+                continue
+            except Exception as e:
+                logger.error(f"Error uploading file '{filename}': {e}")
+                results[index] = (filename, False, "Failed to upload file.")
+                if progress:
+                    progress(filename, False, "Failed to upload file.")
+                continue
+            logger.info(f"File '{filename}' uploaded by user ID {uploader_id} to '{uploader_name}' folder.")
+            written.append((index, filename, file_path))
+            if progress:
+                progress(filename, True, "Written to disk.")
+
+    written.sort()
+    if written:
+        try:
+            register_files(
+                uploader_id,
+                [(filename, file_path) for _, filename, file_path in written],
+                file_comment,
+                shared_with_group,
+                shared_users,
+                shared_groups,
+                expires_at,
+                share_expires_at,
+            )
+            for index, filename, _ in written:
+                results[index] = (filename, True, "File uploaded successfully.")
+        except Exception as e:
+            logger.error(f"Error registering {len(written)} uploaded file(s) for user ID {uploader_id}: {e}")
+            discard_uploads([file_path for _, _, file_path in written])
+            for index, filename, _ in written:
+                results[index] = (filename, False, "Failed to record the upload.")
+    return [results[index] for index in sorted(results)]
+
+def share_file(file_id: int, owner_id: int, user_ids: list = None, group_ids: list = None, expires_at=None):
+    """
+    Share an existing file with more users and groups, skipping users who already have access.
+    The new shares end at `expires_at`, if given.
+
+    Returns:
+        tuple: (success, message)
+    """
+    db = SessionLocal()
+    try:
+        # A file in the trash or past its expiry cannot be shared
+        file = db.query(File.id, File.owner_id).filter(
+            File.id == file_id, File.deleted_at.is_(None), _not_expired(File.expires_at)
+        ).first()
+        if not file:
+            return False, "File not found."
+        if file.owner_id != owner_id:
+            return False, "You do not have permission to share this file."
+        recipients = set(_share_recipients(db, owner_id, False, user_ids, group_ids))
+        already_shared = {
+            row[0] for row in db.query(FileSharing.user_id).filter(
+                FileSharing.file_id == file_id, FileSharing.is_shared == True, _not_expired(FileSharing.expires_at)
+            )
+        }
+        new_recipients = sorted(recipients - already_shared)
+        if new_recipients:
+            db.execute(insert(FileSharing), [
+                {"file_id": file_id, "user_id": user_id, "is_shared": True, "expires_at": expires_at} for user_id in new_recipients
+            ])
+            stats.apply_file_deltas(db, {owner_id: {"shares": len(new_recipients)}})
+            db.commit()
+        logger.info(f"File ID {file_id} shared with {len(new_recipients)} more user(s) by user ID {owner_id}.")
+        return True, f"File shared with {len(new_recipients)} more user(s)."
+    finally:
+        db.close()
+
+def _not_expired(column):
+    return or_(column.is_(None), column > datetime.utcnow())
+
+def _accessible_filter(user_id: int):
+    shared_ids = select(FileSharing.file_id).where(
+        FileSharing.user_id == user_id, FileSharing.is_shared == True, _not_expired(FileSharing.expires_at)
+    )
+    return and_(
+        File.deleted_at.is_(None),
+        _not_expired(File.expires_at),
+        or_(File.owner_id == user_id, File.id.in_(shared_ids)),
+    )
+
+def count_accessible_files(user_id: int) -> int:
+    db = SessionLocal()
+    total = db.query(func.count(File.id)).filter(_accessible_filter(user_id)).scalar()
+    db.close()
+    return total
+
+def list_accessible_files(user_id: int, page: int = 1, page_size: int = 50):
+    """Return one page of (id, filename, owner_id, owner, uploaded_at, comment) rows the user owns or can access."""
+    db = SessionLocal()
+    rows = (
+        db.query(File.id, File.filename, File.owner_id, User.username.label("owner"), File.uploaded_at, File.comment)
+        .outerjoin(User, File.owner_id == User.id)
+        .filter(_accessible_filter(user_id))
+        .order_by(File.uploaded_at.desc(), File.id.desc())
+        .offset((max(int(page), 1) - 1) * page_size)
+        .limit(page_size)
+        .all()
+    )
+    db.close()
+    return rows
+
+def get_accessible_file(file_id: int, user_id: int):
+    """Return the File if `user_id` owns it or it is shared with them, else None."""
+    db = SessionLocal()
+    file = db.query(File).filter(File.id == file_id, _accessible_filter(user_id)).first()
+    db.close()
+    return file
+
 def get_shared_files(user_id: int):
     db = SessionLocal()
     # Files owned by the user
-    own_files = db.query(File).options(joinedload(File.owner)).filter(File.owner_id == user_id).all()
-    # Files shared with the user
-    shared_file_links = db.query(File).options(joinedload(File.owner)).join(FileSharing).filter(FileSharing.user_id == user_id, FileSharing.is_shared == True).all()
+    own_files = db.query(File).options(joinedload(File.owner)).filter(File.owner_id == user_id, File.deleted_at.is_(None), _not_expired(File.expires_at)).all()
+    # Files shared with the user; expired shares and files are left out until the sweeper removes them
+    shared_file_links = db.query(File).options(joinedload(File.owner)).join(FileSharing).filter(
+        FileSharing.user_id == user_id, FileSharing.is_shared == True, _not_expired(FileSharing.expires_at),
+        File.deleted_at.is_(None), _not_expired(File.expires_at),
+    ).all()
     db.close()
     return own_files, shared_file_links
 
 def delete_file(file_id: int, user_id: int, admin: bool = False):
+    """
+    Move a file to the trash. It stays restorable until the purger removes
+    it after `trash.retention_days`.
+    """
     db = SessionLocal()
-    file = db.query(File).filter(File.id == file_id).first()
+    file = db.query(File.owner_id, File.filename, File.size).filter(File.id == file_id, File.deleted_at.is_(None)).first()
     if not file:
         db.close()
         logger.warning(f"File ID '{file_id}' not found.")
@@ -84,15 +641,198 @@ def delete_file(file_id: int, user_id: int, admin: bool = False):
         return False, "You do not have permission to delete this file."
     
     try:
-        os.remove(file.filepath)
-        db.delete(file)
-        # Also delete sharing records
-        db.query(FileSharing).filter(FileSharing.file_id == file_id).delete()
+        result = db.execute(
+            update(File)
+            .where(File.id == file_id, File.deleted_at.is_(None))
+            .values(deleted_at=datetime.utcnow(), deleted_by=user_id)
+        )
+        if result.rowcount:
+            size = file.size or 0
+            stats.apply_file_deltas(db, {file.owner_id: {"files": -1, "bytes": -size, "trashed_files": 1, "trashed_bytes": size}})
         db.commit()
-        logger.info(f"File '{file.filename}' deleted by user ID '{user_id}'.")
+        record_event("delete", file_id, user_id)
+        logger.info(f"File '{file.filename}' moved to the trash by user ID '{user_id}'.")
         db.close()
-        return True, "File deleted successfully."
+        return True, "File moved to the trash."
     except Exception as e:
         logger.error(f"Error deleting file ID '{file_id}': {e}")
         db.close()
-        return False, "Failed to delete file."
\ No newline at end of file
+        return False, "Failed to delete file."
+
+def restore_file(file_id: int, user_id: int, admin: bool = False):
+    db = SessionLocal()
+    file = db.query(File.owner_id, File.filename, File.size).filter(File.id == file_id, File.deleted_at.isnot(None)).first()
+    if not file:
+        db.close()
+        return False, "File not found in the trash."
+    if not admin and file.owner_id != user_id:
+        db.close()
+        logger.warning(f"User ID '{user_id}' attempted to restore file ID '{file_id}' without permission.")
+        return False, "You do not have permission to restore this file."
+    result = db.execute(update(File).where(File.id == file_id, File.deleted_at.isnot(None)).values(deleted_at=None, deleted_by=None))
+    if result.rowcount:
+        size = file.size or 0
+        stats.apply_file_deltas(db, {file.owner_id: {"files": 1, "bytes": size, "trashed_files": -1, "trashed_bytes": -size}})
+    db.commit()
+    db.close()
+    logger.info(f"File '{file.filename}' restored from the trash by user ID '{user_id}'.")
+    return True, "File restored."
+
+def list_trash(user_id: int = None, limit: int = 200):
+    """
+    Return (id, filename, owner, deleted_at) rows of files in the trash,
+    most recently deleted first; only `user_id`'s files unless it is None.
+    """
+    db = SessionLocal()
+    query = (
+        db.query(File.id, File.filename, User.username.label("owner"), File.deleted_at)
+        .outerjoin(User, File.owner_id == User.id)
+        .filter(File.deleted_at.isnot(None))
+    )
+    if user_id is not None:
+        query = query.filter(File.owner_id == user_id)
+    rows = query.order_by(File.deleted_at.desc()).limit(limit).all()
+    db.close()
+    return rows
+
+def restore_version(file_id: int, version: int, user_id: int):
+    """
+    Make an earlier version current again by uploading its bytes as a new version.
+
+    Returns:
+        tuple: (success, message)
+    """
+    db = SessionLocal()
+    file = db.query(File.id, File.filename, File.filepath, File.owner_id, File.version).filter(
+        File.id == file_id, File.deleted_at.is_(None)
+    ).first()
+    stored = None
+    if file:
+        stored = db.query(FileVersion.id, FileVersion.chunked_at).filter(
+            FileVersion.file_id == file_id, FileVersion.version == version
+        ).first()
+    db.close()
+    if not file:
+        return False, "File not found."
+    if file.owner_id != user_id:
+        logger.warning(f"User ID '{user_id}' attempted to restore a version of file ID '{file_id}' without permission.")
+        return False, "You do not have permission to restore this file."
+    if version == (file.version or 1):
+        return False, f"Version {version} is already the current version."
+    if not stored or stored.chunked_at is None:
+        return False, f"Version {version} is not available."
+    try:
+        restored_path = write_stream(file.filepath, iter_version(stored.id))
+        register_files(user_id, [(file.filename, restored_path)], f"Restored from version {version}", version_of=file_id)
+    except Exception as e:
+        logger.error(f"Error restoring version {version} of file ID '{file_id}': {e}")
+        return False, "Failed to restore the version."
+    return True, f"Version {version} restored as the current version."
+
+def trash_retention_days() -> int:
+    return get_config_service().get().get("trash", {}).get("retention_days", 30)
+
+def _remove_files(condition, batch_size: int) -> int:
+    """
+    Permanently remove the files matching `condition`, a batch at a time.
+
+    Each batch's rows and sharing rows are deleted in one short transaction
+    that checks `condition` again, so a file restored since the batch was
+    read is left alone. The files are removed from disk once it commits; one
+    that cannot be removed is logged and left for `sharesphere fsck --repair`.
+
+    Returns:
+        int: Number of files removed.
+    """
+    removed_total = 0
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            batch = [
+                file_id for (file_id,) in
+                db.query(File.id).filter(condition, File.id > last_id).order_by(File.id).limit(batch_size)
+            ]
+            if not batch:
+                return removed_total
+            last_id = batch[-1]
+            rows = db.query(File.id, File.filepath, File.preview_path).filter(File.id.in_(batch), condition).all()
+            removed = [row.id for row in rows]
+            if not removed:
+                continue
+            # Rows from before same-name uploads got unique paths may share a file with a live row
+            shared_paths = {
+                path for (path,) in db.query(File.filepath).filter(
+                    File.filepath.in_([row.filepath for row in rows]), File.id.notin_(removed)
+                )
+            }
+            stats.forget_files(db, removed)
+            db.query(FileSharing).filter(FileSharing.file_id.in_(removed)).delete(synchronize_session=False)
+            unreferenced, pending = release_versions(db, removed)
+            packs = release_archived(db, removed)
+            forget_file_jobs(db, removed)
+            deleted = db.query(File).filter(File.id.in_(removed), condition).delete(synchronize_session=False)
+            if deleted != len(removed):
+                # A file changed after it was read; leave the whole batch for the next run
+                db.rollback()
+                logger.warning(f"Files changed while being removed; retrying IDs {removed[0]}-{removed[-1]} later.")
+                continue
+            db.commit()
+        finally:
+            db.close()
+        for row in rows:
+            paths = (row.preview_path,) if row.filepath in shared_paths else (row.filepath, row.preview_path)
+            for path in filter(None, paths):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Could not remove '{path}' (file ID {row.id}) after deleting its record: {e}")
+        remove_chunk_blobs(unreferenced)
+        remove_version_files(pending)
+        remove_dead_packs(packs)
+        removed_total += len(removed)
+
+def purge_deleted_files(retention_days: int = None, batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """
+    Permanently remove files that have been in the trash longer than
+    `retention_days` (default: trash.retention_days).
+
+    Returns:
+        int: Number of files purged.
+    """
+    if retention_days is None:
+        retention_days = trash_retention_days()
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    purged = _remove_files(and_(File.deleted_at.isnot(None), File.deleted_at <= cutoff), batch_size)
+    if purged:
+        logger.info(f"Purged {purged} file(s) from the trash.")
+    return purged
+
+def sweep_expired(batch_size: int = PURGE_BATCH_SIZE):
+    """
+    Delete expired shares, then expired files and their blobs, in batches of
+    at most `batch_size` rows so the SQLite write lock is only held briefly.
+
+    Returns:
+        tuple: (shares removed, files removed)
+    """
+    now = datetime.utcnow()
+    shares = 0
+    while True:
+        expired = select(FileSharing.id).where(FileSharing.expires_at <= now).limit(batch_size).scalar_subquery()
+        db = SessionLocal()
+        removed = [file_id for (file_id,) in db.execute(
+            delete(FileSharing).where(FileSharing.id.in_(expired)).returning(FileSharing.file_id)
+        )]
+        stats.forget_shares(db, removed)
+        db.commit()
+        db.close()
+        shares += len(removed)
+        if len(removed) < batch_size:
+            break
+    files = _remove_files(File.expires_at <= now, batch_size)
+    if shares or files:
+        logger.info(f"Expiry sweep removed {shares} share(s) and {files} file(s).")
+    return shares, files
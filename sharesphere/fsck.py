@@ -0,0 +1,299 @@
+# sharesphere/fsck.py
+
+"""
+Consistency check between the `files` table and the upload folder (`sharesphere fsck`).
+
+The check runs in two resumable phases:
+
+1. Walk the upload folder with os.scandir on a thread pool. Each directory's
+   entries are looked up in the database in batches; files no row refers to
+   are orphans.
+2. Stream File rows in id order (keyset batches) and stat them on the thread
+   pool. Rows whose file is missing are dangling; rows whose size or
+   checksum no longer matches the bytes on disk are mismatches; encrypted
+   files are compared by their decrypted content. Archived rows are checked
+   against their pack instead (archive_missing).
+
+Duplicate paths (several rows sharing one file, typically left behind by
+same-name re-uploads that overwrote each other) are found with a single
+grouped query at the end. Progress and findings are saved to a JSON
+checkpoint after every directory and batch, so an interrupted run resumes
+where it stopped.
+"""
+
+from .database import SessionLocal
+from .encryption import open_file, plaintext_size
+from .models import ArchivedFile, File, FileSharing, FileVersion
+from .jobs import forget_file_jobs
+from .tiering import SIDECAR_SUFFIX, archive_folder, archived_entry_ok, release_archived, remove_dead_packs
+from .versioning import release_versions, remove_chunk_blobs, remove_version_files
+from . import stats
+from sqlalchemy import func, update
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+ROW_BATCH_SIZE = 1000
+LOOKUP_BATCH_SIZE = 500
+CHECKPOINT_INTERVAL_SECONDS = 5.0
+# Files younger than this may belong to an upload that is still being registered
+ORPHAN_GRACE_SECONDS = 3600
+# Folders inside the upload folder that do not hold user uploads
+SKIP_FOLDERS = {".previews", ".chunks", "lost+found"}
+
+class Checkpoint:
+    """Progress and findings of an fsck run, persisted as JSON."""
+
+    def __init__(self, path, options: dict):
+        self.path = Path(path)
+        self.options = options
+        self.done_dirs = set()
+        self.last_id = 0
+        self.phase = "walk"
+        self.findings = []
+        self._saved_at = 0.0
+
+    @classmethod
+    def load(cls, path, options: dict):
+        checkpoint = cls(path, options)
+        if checkpoint.path.exists():
+            data = json.loads(checkpoint.path.read_text())
+            if data.get("options") != options:
+                raise ValueError(f"Checkpoint {path} was written with different options; rerun with --fresh.")
+            checkpoint.done_dirs = set(data["done_dirs"])
+            checkpoint.last_id = data["last_id"]
+            checkpoint.phase = data["phase"]
+            checkpoint.findings = data["findings"]
+        return checkpoint
+
+    def save(self, force: bool = False):
+        if not force and time.monotonic() - self._saved_at < CHECKPOINT_INTERVAL_SECONDS:
+            return
+        data = {
+            "options": self.options,
+            "phase": self.phase,
+            "done_dirs": sorted(self.done_dirs),
+            "last_id": self.last_id,
+            "findings": self.findings,
+            "saved_at": datetime.utcnow().isoformat(),
+        }
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
+
+def _scan_directory(path: str):
+    """Return ([(file path, mtime)], [subdirectory paths]) for one directory."""
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_FOLDERS:
+                    subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                if entry.name.endswith(SIDECAR_SUFFIX):
+                    continue  # Hot copy the archiver is removing; see tiering.py
+                files.append((entry.path, entry.stat(follow_symlinks=False).st_mtime))
+    return files, subdirs
+
+def _walk(root: str, pool):
+    """Yield (directory, files) for every directory under `root`, scanning directories in parallel."""
+    pending = {pool.submit(_scan_directory, root): root}
+    while pending:
+        future = next(iter(pending))
+        directory = pending.pop(future)
+        files, subdirs = future.result()
+        for subdir in subdirs:
+            pending[pool.submit(_scan_directory, subdir)] = subdir
+        yield directory, files
+
+def _referenced_paths(db, paths: list) -> set:
+    """
+    Return which of `paths` some File row refers to, or some superseded
+    version waiting to be chunked, by relative or absolute path.
+    """
+    variants = {}
+    for path in paths:
+        variants[path] = path
+        variants[os.path.abspath(path)] = path
+    found = set()
+    keys = list(variants)
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        batch = keys[start:start + LOOKUP_BATCH_SIZE]
+        rows = db.query(File.filepath).filter(File.filepath.in_(batch)).union_all(
+            db.query(FileVersion.filepath).filter(FileVersion.filepath.in_(batch))
+        ).all()
+        found.update(variants[row.filepath] for row in rows)
+    return found
+
+def _quarantine(path: str, upload_folder: str) -> str:
+    """Move an orphaned file into lost+found, keeping its path relative to the upload folder."""
+    relative = os.path.relpath(path, upload_folder)
+    target = Path(upload_folder) / "lost+found" / relative
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(path, target)
+    return str(target)
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open_file(path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _inspect_row(row, verify_checksums: bool):
+    """Compare one File row with its file on disk; return a finding dict or None."""
+    if row.archived_at is not None:
+        if row.pack is None or not archived_entry_ok(row):
+            return {"kind": "archive_missing", "file_id": row.id, "path": str(archive_folder() / (row.pack or "?"))}
+        return None
+    try:
+        size = plaintext_size(row.filepath)
+    except FileNotFoundError:
+        return {"kind": "dangling", "file_id": row.id, "path": row.filepath}
+    except OSError:
+        # An encrypted file too short to hold its header and last chunk
+        return {"kind": "truncated", "file_id": row.id, "path": row.filepath}
+    if row.size is not None and size != row.size:
+        return {"kind": "size_mismatch", "file_id": row.id, "path": row.filepath, "expected": row.size, "actual": size}
+    if verify_checksums and row.checksum:
+        try:
+            intact = _sha256(row.filepath) == row.checksum
+        except OSError:
+            intact = False  # An encrypted chunk failed authentication
+        if not intact:
+            return {"kind": "checksum_mismatch", "file_id": row.id, "path": row.filepath}
+    return None
+
+def _delete_rows(db, file_ids: list) -> list:
+    """
+    Delete the rows of dangling files, checking again under the write lock
+    that each is still hot and its file still missing: the archiver may
+    have packed it, or its owner uploaded a new version, since it was read.
+
+    Returns:
+        list: IDs of the rows deleted.
+    """
+    # A no-op UPDATE takes the write lock, so no file can be archived or re-uploaded until commit
+    rows = db.execute(
+        update(File).where(File.id.in_(file_ids), File.archived_at.is_(None))
+        .values(filepath=File.filepath).returning(File.id, File.filepath)
+    ).all()
+    file_ids = [row.id for row in rows if not os.path.exists(row.filepath)]
+    if not file_ids:
+        db.rollback()
+        return []
+    stats.forget_files(db, file_ids)
+    db.query(FileSharing).filter(FileSharing.file_id.in_(file_ids)).delete(synchronize_session=False)
+    unreferenced, pending = release_versions(db, file_ids)
+    packs = release_archived(db, file_ids)
+    forget_file_jobs(db, file_ids)
+    db.query(File).filter(File.id.in_(file_ids)).delete(synchronize_session=False)
+    db.commit()
+    remove_chunk_blobs(unreferenced)
+    remove_version_files(pending)
+    remove_dead_packs(packs)
+    return file_ids
+
+def duplicate_paths():
+    """Return (filepath, [file ids]) for every path referenced by more than one File row."""
+    db = SessionLocal()
+    rows = (
+        db.query(File.filepath, func.group_concat(File.id))
+        .group_by(File.filepath)
+        .having(func.count(File.id) > 1)
+        .all()
+    )
+    db.close()
+    return [(path, sorted(int(file_id) for file_id in ids.split(","))) for path, ids in rows]
+
+def run_fsck(upload_folder: str, checkpoint_path, repair: bool = False, verify_checksums: bool = False,
+             threads: int = 16, fresh: bool = False, report=None):
+    """
+    Check the upload folder against the database.
+
+    Args:
+        repair (bool): Move orphaned files to lost+found and delete dangling rows.
+            Mismatches and duplicate paths are only reported.
+        verify_checksums (bool): Hash every file that has a stored checksum.
+        fresh (bool): Ignore an existing checkpoint.
+        report (callable, optional): Called with each finding dict as it is found.
+
+    Returns:
+        list: All finding dicts, including those from earlier runs of a resumed check.
+    """
+    report = report or (lambda finding: None)
+    options = {"upload_folder": os.path.abspath(upload_folder), "repair": repair, "verify_checksums": verify_checksums}
+    if fresh and Path(checkpoint_path).exists():
+        Path(checkpoint_path).unlink()
+    checkpoint = Checkpoint.load(checkpoint_path, options)
+    for finding in checkpoint.findings:
+        report(finding)
+
+    def add(finding):
+        checkpoint.findings.append(finding)
+        report(finding)
+
+    now = time.time()
+    db = SessionLocal()
+    try:
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="fsck") as pool:
+            if checkpoint.phase == "walk" and os.path.isdir(upload_folder):
+                for directory, files in _walk(upload_folder, pool):
+                    if directory in checkpoint.done_dirs:
+                        continue
+                    referenced = _referenced_paths(db, [path for path, _ in files])
+                    for path, mtime in files:
+                        if path in referenced or now - mtime < ORPHAN_GRACE_SECONDS:
+                            continue
+                        finding = {"kind": "orphan", "path": path}
+                        if repair:
+                            finding["repaired"] = _quarantine(path, upload_folder)
+                        add(finding)
+                    checkpoint.done_dirs.add(directory)
+                    checkpoint.save()
+            checkpoint.phase = "rows"
+            checkpoint.save(force=True)
+
+            while True:
+                rows = (
+                    db.query(File.id, File.filepath, File.size, File.checksum, File.archived_at,
+                             ArchivedFile.pack, ArchivedFile.offset, ArchivedFile.length)
+                    .outerjoin(ArchivedFile, ArchivedFile.file_id == File.id)
+                    .filter(File.id > checkpoint.last_id)
+                    .order_by(File.id)
+                    .limit(ROW_BATCH_SIZE)
+                    .all()
+                )
+                if not rows:
+                    break
+                findings = [f for f in pool.map(lambda row: _inspect_row(row, verify_checksums), rows) if f]
+                dangling = [f["file_id"] for f in findings if f["kind"] == "dangling"]
+                deleted = set(_delete_rows(db, dangling)) if repair and dangling else set()
+                for finding in findings:
+                    if repair and finding["kind"] == "dangling":
+                        if finding["file_id"] not in deleted:
+                            continue  # Archived, re-uploaded or back on disk since it was read
+                        finding["repaired"] = "row deleted"
+                    add(finding)
+                checkpoint.last_id = rows[-1].id
+                checkpoint.save()
+    finally:
+        db.close()
+
+    for path, file_ids in duplicate_paths():
+        add({"kind": "duplicate_path", "path": path, "file_ids": file_ids})
+    checkpoint.remove()
+    return checkpoint.findings
@@ -0,0 +1,127 @@
+# sharesphere/groups.py
+
+"""
+Nested groups, resolved through a closure table.
+
+A group may have a parent (Group.parent_id). A member of a group is also a
+member of its parent, of the parent's parent, and so on. GroupClosure holds
+one row for every (ancestor, descendant) pair of the hierarchy, including
+each group paired with itself at depth 0. Both membership questions are
+then a single join over indexed columns, however deep the hierarchy:
+
+- users of a group and its subgroups: `member_ids(group_ids)`
+- groups a user belongs to, directly or through a subgroup: `user_group_ids(user_id)`
+
+The closure changes incrementally. A new group adds its ancestors' rows plus
+its own, and moving a group rewrites only the rows that link its subtree to
+its former and new ancestors. Both happen in the caller's transaction, the
+same way the dashboard summaries do (sharesphere/stats.py). `init_db`
+backfills the table from parent_id for databases created before nesting.
+"""
+
+from .database import SessionLocal
+from .models import Group, GroupClosure, user_group_association
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.orm import aliased
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Guards the backfill against a parent_id cycle written outside this module
+MAX_DEPTH = 64
+
+def member_ids(group_ids):
+    """SELECT of the distinct IDs of users in `group_ids` or any of their subgroups."""
+    return (
+        select(user_group_association.c.user_id)
+        .join(GroupClosure, GroupClosure.descendant_id == user_group_association.c.group_id)
+        .where(GroupClosure.ancestor_id.in_(group_ids))
+        .distinct()
+    )
+
+def user_group_ids(user_id):
+    """SELECT of the distinct IDs of the groups `user_id` belongs to, directly or through a subgroup."""
+    return (
+        select(GroupClosure.ancestor_id)
+        .join(user_group_association, user_group_association.c.group_id == GroupClosure.descendant_id)
+        .where(user_group_association.c.user_id == user_id)
+        .distinct()
+    )
+
+def ancestor_ids(group_ids):
+    """SELECT of `group_ids` and all their ancestors."""
+    return select(GroupClosure.ancestor_id).where(GroupClosure.descendant_id.in_(group_ids)).distinct()
+
+def add_group(db, group_id: int, parent_id: int = None):
+    """Add the closure rows of a new group, placed under `parent_id` if given."""
+    rows = select(literal(group_id), literal(group_id), literal(0))
+    if parent_id is not None:
+        rows = rows.union_all(
+            select(GroupClosure.ancestor_id, literal(group_id), GroupClosure.depth + 1)
+            .where(GroupClosure.descendant_id == parent_id)
+        )
+    db.execute(insert(GroupClosure).from_select(["ancestor_id", "descendant_id", "depth"], rows))
+
+def move_group(db, group_id: int, parent_id: int = None) -> list:
+    """
+    Put `group_id`, with its subgroups, under `parent_id` (None for the top level).
+
+    Returns:
+        list: IDs of the groups that gained or lost members: the former and
+        new ancestors of the group.
+
+    Raises:
+        ValueError: If `parent_id` is the group itself or one of its subgroups.
+    """
+    subtree = select(GroupClosure.descendant_id).where(GroupClosure.ancestor_id == group_id)
+    if parent_id is not None and db.query(GroupClosure.depth).filter(
+        GroupClosure.ancestor_id == group_id, GroupClosure.descendant_id == parent_id
+    ).first() is not None:
+        raise ValueError("A group cannot be placed under itself or one of its subgroups.")
+    affected = {ancestor for (ancestor,) in db.query(GroupClosure.ancestor_id).filter(
+        GroupClosure.descendant_id.in_([group_id] + ([parent_id] if parent_id is not None else [])),
+        GroupClosure.ancestor_id != group_id,
+    )}
+    # Unlink the subtree from its former ancestors, then link it to the new ones
+    db.execute(delete(GroupClosure).where(
+        GroupClosure.descendant_id.in_(subtree), GroupClosure.ancestor_id.notin_(subtree)
+    ))
+    if parent_id is not None:
+        above, below = aliased(GroupClosure), aliased(GroupClosure)
+        db.execute(insert(GroupClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .join(below, below.ancestor_id == group_id)
+            .where(above.descendant_id == parent_id),
+        ))
+    db.execute(update(Group).where(Group.id == group_id).values(parent_id=parent_id))
+    return sorted(affected)
+
+def rebuild_closure(db):
+    """Recompute the whole closure table from Group.parent_id."""
+    db.execute(delete(GroupClosure))
+    tree = select(Group.id.label("ancestor_id"), Group.id.label("descendant_id"), literal(0).label("depth")).cte(
+        "tree", recursive=True
+    )
+    tree = tree.union_all(
+        select(tree.c.ancestor_id, Group.id, tree.c.depth + 1)
+        .join(Group, Group.parent_id == tree.c.descendant_id)
+        .where(tree.c.depth < MAX_DEPTH)
+    )
+    db.execute(insert(GroupClosure).from_select(
+        ["ancestor_id", "descendant_id", "depth"], select(tree.c.ancestor_id, tree.c.descendant_id, tree.c.depth)
+    ))
+
+def ensure_closure():
+    """Backfill the closure table if a group has no row in it (a database from before nested groups)."""
+    db = SessionLocal()
+    try:
+        missing = db.query(func.count(Group.id)).filter(
+            ~select(GroupClosure.depth).where(GroupClosure.ancestor_id == Group.id, GroupClosure.descendant_id == Group.id).exists()
+        ).scalar()
+        if missing:
+            rebuild_closure(db)
+            db.commit()
+            logger.info(f"Built the group closure table ({missing} group(s) had no entry).")
+    finally:
+        db.close()
@@ -0,0 +1,391 @@
+# sharesphere/ingest.py
+
+"""
+Server-side bulk ingest of existing directory trees (`sharesphere ingest`).
+
+Every regular file under the source directory becomes a file of the owner,
+named by its path relative to the source ("dept/reports/q1.pdf") and stored
+at the same relative path in the owner's upload folder. Files are hashed
+and copied (through UploadWriter, so `encryption.enabled` applies), or
+hard-linked with `link=True`, on a thread pool. A hard link shares the
+source's bytes, so linked sources must be read-only: an edit in place would
+change the stored file and its checksum behind the app's back. Watch mode,
+which exists for files that are still arriving, therefore refuses `link`,
+and a source found changed on a later run is copied rather than linked. They are then registered
+with `register_files` in batches of `ingest.batch_size`, with sharing rows
+for the group's members if a group is given. The next batch is copied while
+the previous one is being registered.
+
+An IngestRecord (size, mtime and SHA-256 of the source) is written in the
+same transaction as each batch's File rows. A repeated or interrupted ingest
+skips files whose size and mtime are unchanged. A file whose content changed
+becomes a new version of the file ingested earlier. Copies of a batch that
+was interrupted before it committed are left in the upload folder for
+`sharesphere fsck --repair` to quarantine; a batch whose registration fails
+has its copies removed.
+
+Watch mode keeps ingesting files dropped into the directory. With the
+optional `watchdog` package (inotify on Linux) only the paths it reports are
+looked at; without it the tree is rescanned every `ingest.watch_interval`
+seconds. Either way a file is only taken once it has not changed for
+`ingest.settle_seconds`, so files still being written are left for later.
+"""
+
+from .config import get_config_service
+from .database import SessionLocal
+from .file_manager import UploadWriter, check_upload_allowed, discard_uploads, name_candidates, register_files, upload_settings
+from .models import Group, IngestRecord, User
+from . import encryption
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+import hashlib
+import itertools
+import logging
+import os
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+
+# Ingest settings, refreshed by the config service whenever config.yaml changes
+ingest_settings = {"threads": 8, "batch_size": 500, "watch_interval": 10, "settle_seconds": 5}
+
+def _apply_ingest_settings(config):
+    settings = config.get("ingest", {}) or {}
+    for key in ingest_settings:
+        if key in settings:
+            ingest_settings[key] = settings[key]
+
+get_config_service().subscribe("ingest.ingest_settings", _apply_ingest_settings)
+
+def resolve_target(owner: str, group: str = None):
+    """
+    Look up the owner and group of an ingest by name.
+
+    Returns:
+        tuple: (owner ID, owner username, group ID or None).
+
+    Raises:
+        ValueError: If the user or group does not exist.
+    """
+    db = SessionLocal()
+    try:
+        user = db.query(User.id, User.username).filter(User.username == owner).first()
+        if user is None:
+            raise ValueError(f"User '{owner}' does not exist.")
+        group_id = None
+        if group is not None:
+            group_id = db.query(Group.id).filter(Group.name == group).scalar()
+            if group_id is None:
+                raise ValueError(f"Group '{group}' does not exist.")
+        return user.id, user.username, group_id
+    finally:
+        db.close()
+
+def _check_source(source: Path):
+    if not source.is_dir():
+        raise ValueError(f"{source} is not a directory.")
+    upload_root = Path(upload_settings["folder"]).resolve()
+    if source == upload_root or upload_root in source.parents or source in upload_root.parents:
+        raise ValueError(f"{source} overlaps the upload folder {upload_root}.")
+
+def _iter_files(path: str):
+    """Yield (path, stat result) for every regular file under `path`, without following symlinks."""
+    pending = [path]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+        except OSError as e:
+            logger.warning(f"Cannot read directory {directory} during ingest: {e}")
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _store(source_path: str, dest: Path, link: bool, known_checksum: str = None):
+    """
+    Copy or hard-link one file into the upload folder.
+
+    Returns:
+        tuple: (stored path, SHA-256). The stored path is None if the content
+        equals `known_checksum`, in which case nothing was written.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # A source that changed since it was ingested is evidently edited in place, so it is copied
+    link = link and known_checksum is None and not encryption.enabled()
+    if known_checksum is not None or link:
+        checksum = _sha256(source_path)
+        if checksum == known_checksum:
+            return None, checksum
+        if link:
+            for candidate in name_candidates(dest):
+                try:
+                    os.link(source_path, candidate)
+                    return candidate, checksum
+                except FileExistsError:
+                    continue
+                except OSError:
+                    break  # Another filesystem, or no hard links: copy instead
+    digest = hashlib.sha256()
+    writer = UploadWriter(dest)
+    try:
+        with open(source_path, "rb") as f:
+            while chunk := f.read(READ_SIZE):
+                digest.update(chunk)
+                writer.write(chunk)
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.file_path, digest.hexdigest()
+
+def _upsert_records(fields: tuple):
+    """INSERT ... ON CONFLICT DO UPDATE of IngestRecord rows that overwrites `fields` of existing ones."""
+    stmt = sqlite_insert(IngestRecord.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["owner_id", "source_path"],
+        set_={field: getattr(stmt.excluded, field) for field in fields},
+    )
+
+def summary(counts: Counter) -> str:
+    return (f"{counts['ingested']} ingested ({counts['bytes'] / 1024 ** 2:.1f} MiB), {counts['unchanged']} unchanged, "
+            f"{counts['rejected']} rejected, {counts['failed']} failed.")
+
+class Ingest:
+    """
+    One ingest into one owner's files; feed it (path, stat) pairs with `add`
+    and call `finish` at the end. Counts of what happened are in `counts`.
+    """
+
+    def __init__(self, source, owner_id: int, owner_name: str, group_id: int = None, link: bool = False,
+                 comment: str = None, threads: int = None, echo=None):
+        self.source = Path(source).resolve()
+        _check_source(self.source)
+        self.owner_id = owner_id
+        self.dest_root = Path(upload_settings["folder"]) / owner_name
+        self.group_id = group_id
+        self.link = link
+        self.comment = comment or f"Ingested from {self.source}"
+        self.echo = echo or (lambda message: None)
+        self.counts = Counter()
+        self._pool = ThreadPoolExecutor(max_workers=threads or int(ingest_settings["threads"]),
+                                        thread_name_prefix="ingest")
+        self._pending = []  # (path, stat) not yet submitted
+        self._in_flight = None  # Submitted batch awaiting registration
+
+    def add(self, path: str, st):
+        self._pending.append((path, st))
+        if len(self._pending) >= int(ingest_settings["batch_size"]):
+            self._submit()
+
+    def finish(self):
+        """Ingest whatever is still pending; returns `counts`."""
+        self._submit()
+        self._register(self._in_flight)
+        self._in_flight = None
+        return self.counts
+
+    def close(self):
+        # After an interruption, copies not started yet are dropped; the next run does them
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self):
+        """Start copying the pending files, then register the batch submitted before them."""
+        entries, self._pending = self._pending, []
+        if not entries:
+            return
+        db = SessionLocal()
+        try:
+            records = {
+                row.source_path: row for row in db.query(
+                    IngestRecord.source_path, IngestRecord.size, IngestRecord.mtime_ns, IngestRecord.checksum
+                ).filter(
+                    IngestRecord.owner_id == self.owner_id,
+                    IngestRecord.source_path.in_([path for path, _ in entries]),
+                )
+            }
+        finally:
+            db.close()
+        batch = []
+        for path, st in entries:
+            record = records.get(path)
+            if record is not None and record.size == st.st_size and record.mtime_ns == st.st_mtime_ns:
+                self.counts["unchanged"] += 1
+                continue
+            name = PurePosixPath(Path(path).relative_to(self.source)).as_posix()
+            allowed, reason = check_upload_allowed(name, st.st_size)
+            if not allowed:
+                logger.warning(f"Not ingesting {path}: {reason}")
+                self.counts["rejected"] += 1
+                continue
+            future = self._pool.submit(_store, path, self.dest_root / name, self.link,
+                                       record.checksum if record is not None else None)
+            batch.append((path, st, name, future))
+        previous, self._in_flight = self._in_flight, batch
+        self._register(previous)
+
+    def _register(self, batch):
+        if not batch:
+            return
+        uploads, records, unchanged = [], [], []
+        now = datetime.utcnow()
+        for path, st, name, future in batch:
+            try:
+                stored, checksum = future.result()
+            except Exception as e:
+                logger.error(f"Failed to ingest {path}: {e}")
+                self.counts["failed"] += 1
+                continue
+            row = {"owner_id": self.owner_id, "source_path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                   "checksum": checksum, "ingested_at": now}
+            if stored is None:
+                unchanged.append(row)
+            else:
+                uploads.append((name, stored))
+                records.append(row)
+
+        def record(db, file_ids):
+            for row, file_id in zip(records, file_ids):
+                row["file_id"] = file_id
+            db.execute(_upsert_records(("size", "mtime_ns", "checksum", "file_id", "ingested_at")), records)
+
+        if uploads:
+            try:
+                register_files(self.owner_id, uploads, self.comment,
+                               shared_groups=[self.group_id] if self.group_id else None, before_commit=record)
+            except Exception as e:
+                logger.error(f"Failed to register {len(uploads)} ingested file(s): {e}")
+                self.counts["failed"] += len(uploads)
+                # Nothing was registered, new versions included, so every copy would be an orphan
+                discard_uploads([stored for _, stored in uploads])
+            else:
+                self.counts["ingested"] += len(uploads)
+                self.counts["bytes"] += sum(row["size"] for row in records)
+        if unchanged:
+            # Touched but identical: remember the new mtime so the file is not hashed again
+            db = SessionLocal()
+            try:
+                db.execute(_upsert_records(("size", "mtime_ns")), unchanged)
+                db.commit()
+            finally:
+                db.close()
+            self.counts["unchanged"] += len(unchanged)
+        self.echo(summary(self.counts))
+
+def ingest_directory(source, owner_id: int, owner_name: str, group_id: int = None, link: bool = False,
+                     comment: str = None, threads: int = None, echo=None) -> Counter:
+    """
+    Ingest every file under `source` once; see the module docstring.
+
+    Returns:
+        Counter: ingested, unchanged, rejected and failed files, and bytes ingested.
+    """
+    ingest = Ingest(source, owner_id, owner_name, group_id, link, comment, threads, echo)
+    try:
+        for path, st in _iter_files(str(ingest.source)):
+            ingest.add(path, st)
+        return ingest.finish()
+    finally:
+        ingest.close()
+
+def _watch_events(root: Path):
+    """
+    Start a watchdog observer on `root` that collects changed paths.
+
+    Returns:
+        tuple: (observer, set of changed paths, lock guarding the set), or None
+        if watchdog is not installed.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        return None
+    changed, lock = set(), threading.Lock()
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            # A directory is "modified" whenever an entry in it changes; the entry has its own event
+            if event.is_directory and event.event_type not in ("created", "moved"):
+                return
+            if event.event_type in ("created", "modified", "moved", "closed"):
+                with lock:
+                    changed.add(getattr(event, "dest_path", "") or event.src_path)
+
+    observer = Observer()
+    observer.schedule(Handler(), str(root), recursive=True)
+    observer.start()
+    return observer, changed, lock
+
+def watch_directory(source, owner_id: int, owner_name: str, group_id: int = None, link: bool = False,
+                    comment: str = None, threads: int = None, echo=None, stop: threading.Event = None):
+    """
+    Ingest `source`, then keep ingesting files added to or changed in it until
+    `stop` is set (or forever); see the module docstring.
+
+    Raises:
+        ValueError: If `link` is set; files in a watched directory may still change.
+    """
+    if link:
+        raise ValueError("Hard-linking cannot be combined with watching: files in a watched directory may still change.")
+    stop = stop or threading.Event()
+    ingest = Ingest(source, owner_id, owner_name, group_id, link, comment, threads, echo)
+    root = ingest.source
+    events = _watch_events(root)
+    if events is None:
+        ingest.echo(f"watchdog is not installed; rescanning {root} every {ingest_settings['watch_interval']} s.")
+    try:
+        # Everything already there is taken as it is
+        for path, st in _iter_files(str(root)):
+            ingest.add(path, st)
+        ingest.finish()
+        retry = set()  # Files that were still changing at the last pass
+        while not stop.wait(float(ingest_settings["watch_interval"])):
+            if events is None:
+                candidates = _iter_files(str(root))
+            else:
+                _, changed, lock = events
+                with lock:
+                    paths = retry | changed
+                    changed.clear()
+                candidates = itertools.chain.from_iterable(_changed_files(path) for path in paths)
+            retry = set()
+            settled_before = time.time() - float(ingest_settings["settle_seconds"])
+            for path, st in candidates:
+                if st.st_mtime > settled_before:
+                    retry.add(path)
+                    continue
+                ingest.add(path, st)
+            ingest.finish()
+    finally:
+        if events is not None:
+            events[0].stop()
+            events[0].join()
+        ingest.close()
+    return ingest.counts
+
+def _changed_files(path: str):
+    """Yield (path, stat) for a path watchdog reported: the file itself, or every file under a directory."""
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return  # Removed or renamed since
+    if stat.S_ISDIR(st.st_mode):
+        yield from _iter_files(path)
+    elif stat.S_ISREG(st.st_mode):
+        yield path, st
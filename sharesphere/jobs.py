@@ -0,0 +1,223 @@
+# sharesphere/jobs.py
+
+"""
+Durable job queue stored in the `jobs` table.
+
+Jobs are enqueued with an optional idempotency key (a second enqueue with the
+same key is ignored), claimed atomically by `sharesphere worker`, and retried
+with exponential backoff until `max_attempts` is reached.
+"""
+
+from .config import get_config
+from .database import SessionLocal
+from .models import Job
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_SECONDS = 3600
+MAX_ERROR_LENGTH = 2000
+
+# kind -> callable(payload: dict); filled in by @job_handler
+HANDLERS = {}
+
+def job_handler(kind: str):
+    """Register the decorated function as the handler for jobs of `kind`."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+def _settings():
+    jobs = get_config().get("jobs", {})
+    return {
+        "max_attempts": jobs.get("max_attempts", 5),
+        "retry_backoff": jobs.get("retry_backoff", 10),
+        "stale_after": jobs.get("stale_after", 600),
+    }
+
+def enqueue_many(jobs: list, db=None):
+    """
+    Enqueue jobs given as (kind, payload, idempotency_key) tuples.
+
+    When `db` is given the jobs join that session's transaction, so they are
+    committed together with the rows they refer to.
+    """
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    max_attempts = _settings()["max_attempts"]
+    rows = [
+        {
+            "kind": kind,
+            "payload": json.dumps(payload),
+            "idempotency_key": key,
+            "file_id": payload.get("file_id"),
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_after": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for kind, payload, key in jobs
+    ]
+    stmt = sqlite_insert(Job.__table__).on_conflict_do_nothing(index_elements=["idempotency_key"])
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        db.execute(stmt, rows)
+        if own_session:
+            db.commit()
+    finally:
+        if own_session:
+            db.close()
+
+def enqueue(kind: str, payload: dict = None, idempotency_key: str = None, db=None):
+    enqueue_many([(kind, payload or {}, idempotency_key)], db)
+
+def forget_file_jobs(db, file_ids: list):
+    """
+    Delete the jobs of files about to be deleted, in the caller's transaction.
+
+    SQLite gives a deleted file's ID to the next upload, and the idempotency
+    keys of the old file's jobs would otherwise keep the new file's from
+    being enqueued.
+    """
+    if file_ids:
+        db.execute(delete(Job).where(Job.file_id.in_(file_ids)))
+
+def claim_jobs(worker_id: str, limit: int):
+    """
+    Atomically mark up to `limit` due jobs as running for `worker_id`.
+
+    Returns:
+        list: (id, kind, payload, attempts, max_attempts) rows of the claimed jobs.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(Job.id)
+        .where(Job.status == "queued", Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(limit)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Job)
+        .where(Job.id.in_(due), Job.status == "queued")
+        .values(status="running", locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1, updated_at=now)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+    )
+    db = SessionLocal()
+    try:
+        rows = db.execute(stmt).all()
+        db.commit()
+        return rows
+    finally:
+        db.close()
+
+def complete_job(job_id: int):
+    db = SessionLocal()
+    db.execute(
+        update(Job).where(Job.id == job_id).values(
+            status="done", locked_by=None, locked_at=None, last_error=None, updated_at=datetime.utcnow()
+        )
+    )
+    db.commit()
+    db.close()
+
+def fail_job(job_id: int, error: str, attempts: int, max_attempts: int):
+    """Schedule a retry with exponential backoff, or mark the job failed after its last attempt."""
+    now = datetime.utcnow()
+    values = {"locked_by": None, "locked_at": None, "last_error": error[:MAX_ERROR_LENGTH], "updated_at": now}
+    if attempts >= max_attempts:
+        values["status"] = "failed"
+        logger.error(f"Job {job_id} failed permanently after {attempts} attempt(s): {error}")
+    else:
+        delay = min(_settings()["retry_backoff"] * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+        values.update(status="queued", run_after=now + timedelta(seconds=delay))
+        logger.warning(f"Job {job_id} attempt {attempts} failed, retrying in {delay}s: {error}")
+    db = SessionLocal()
+    db.execute(update(Job).where(Job.id == job_id).values(**values))
+    db.commit()
+    db.close()
+
+def heartbeat_jobs(worker_id: str, job_ids: list):
+    """Refresh the lock of `worker_id`'s running jobs, so long jobs of a live worker are never taken as stale."""
+    if not job_ids:
+        return
+    db = SessionLocal()
+    db.execute(
+        update(Job)
+        .where(Job.id.in_(job_ids), Job.status == "running", Job.locked_by == worker_id)
+        .values(locked_at=datetime.utcnow())
+    )
+    db.commit()
+    db.close()
+
+def requeue_stale_jobs() -> int:
+    """
+    Return running jobs whose worker vanished to the queue. A live worker
+    refreshes its jobs' locks with `heartbeat_jobs`, so a job is stale once its
+    lock is older than jobs.stale_after.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=_settings()["stale_after"])
+    db = SessionLocal()
+    result = db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.locked_at < cutoff)
+        .values(status="queued", locked_by=None, locked_at=None, updated_at=datetime.utcnow())
+    )
+    db.commit()
+    db.close()
+    if result.rowcount:
+        logger.warning(f"Requeued {result.rowcount} stale job(s).")
+    return result.rowcount
+
+def run_job(kind: str, payload: str):
+    """Execute one job; runs inside a worker process."""
+    from sharesphere import processing  # noqa: F401  (registers the post-upload handlers)
+
+    handler = HANDLERS.get(kind)
+    if handler is None:
+        raise ValueError(f"No handler registered for job kind '{kind}'.")
+    handler(json.loads(payload))
+
+def queue_depth():
+    """Return (kind, status, count) rows for the whole queue."""
+    db = SessionLocal()
+    rows = (
+        db.query(Job.kind, Job.status, func.count(Job.id))
+        .group_by(Job.kind, Job.status)
+        .order_by(Job.kind, Job.status)
+        .all()
+    )
+    db.close()
+    return rows
+
+def list_jobs(status: str, limit: int = 50):
+    db = SessionLocal()
+    rows = (
+        db.query(Job.id, Job.kind, Job.payload, Job.attempts, Job.last_error, Job.updated_at)
+        .filter(Job.status == status)
+        .order_by(Job.updated_at.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return rows
+
+def retry_failed_jobs(job_ids: list = None) -> int:
+    """Put failed jobs (all of them, or only `job_ids`) back in the queue with a fresh attempt budget."""
+    stmt = update(Job).where(Job.status == "failed")
+    if job_ids is not None:
+        stmt = stmt.where(Job.id.in_(job_ids))
+    db = SessionLocal()
+    result = db.execute(stmt.values(status="queued", attempts=0, run_after=datetime.utcnow(), updated_at=datetime.utcnow()))
+    db.commit()
+    db.close()
+    return result.rowcount
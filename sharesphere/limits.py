@@ -0,0 +1,320 @@
+# sharesphere/limits.py
+
+"""
+Admission control for file transfers: concurrent transfer slots and
+bandwidth limits, per user and for the whole app process.
+
+Every upload write and download read takes a slot with `transfer_slot`;
+previews shown on the page are not transfers and take none.
+A transfer that finds no slot free (globally or for its user) waits in a
+queue; slots are handed out round-robin between users, so one user's
+batch cannot starve the others. A transfer still waiting after
+`limits.queue_timeout_seconds` raises TransferQueueTimeout.
+
+Bytes go through `throttle`, a token bucket per user holding a slot. Its
+rate is the smaller of `limits.user_bytes_per_second` and an equal share
+of `limits.global_bytes_per_second` among the users transferring, so the
+process never exceeds the global rate and every active user gets the same
+share. Limits apply per app process (`sharesphere start --workers N` runs N).
+"""
+
+from .config import get_config_service
+from collections import OrderedDict, deque
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_CHUNK_SIZE = 256 * 1024
+
+# Limit settings, refreshed by the config service whenever config.yaml changes; 0 means unlimited
+limit_settings = {
+    "enabled": False,
+    "global_bytes_per_second": 0,
+    "user_bytes_per_second": 0,
+    "global_max_transfers": 0,
+    "user_max_transfers": 0,
+    "queue_timeout_seconds": 30,
+    "burst_seconds": 1.0,
+}
+
+class TransferQueueTimeout(Exception):
+    """A transfer waited longer than limits.queue_timeout_seconds for a slot."""
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations rather than blocking.
+
+    `reserve(n)` takes n tokens at once, going into debt if needed, and
+    returns how long the caller should wait before using them.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate: float, burst: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate, self.burst = rate, burst
+            self.tokens = min(self.tokens, burst)
+
+    def reserve(self, amount: int) -> float:
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class _Waiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+class TransferLimiter:
+    """Slots, fair queueing and per-user buckets for one process; use the module-level `limiter`."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._active = {}  # user ID -> slots held
+        self._total = 0
+        self._waiting = OrderedDict()  # user ID -> deque of _Waiter, in round-robin order
+        self._buckets = {}
+        self._names = {}
+        self._stats = {
+            "transfers": 0, "queued": 0, "timeouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+            "throttled_seconds": 0.0, "bytes": {"upload": 0, "download": 0},
+        }
+        self._user_stats = {}
+
+    # --- Slots ---
+
+    def _can_grant(self, user_id) -> bool:
+        global_max = self.settings["global_max_transfers"]
+        user_max = self.settings["user_max_transfers"]
+        return (not global_max or self._total < global_max) and (not user_max or self._active.get(user_id, 0) < user_max)
+
+    def _grant(self, user_id):
+        self._active[user_id] = self._active.get(user_id, 0) + 1
+        self._total += 1
+        if self._active[user_id] == 1:
+            self._rebalance()
+
+    def _dispatch(self):
+        """Grant free slots to waiting users in turn, one slot per user per round."""
+        progress = True
+        while self._waiting and progress:
+            progress = False
+            for user_id in list(self._waiting):
+                if not self._can_grant(user_id):
+                    continue
+                queue = self._waiting[user_id]
+                waiter = queue.popleft()
+                self._waiting.move_to_end(user_id)
+                if not queue:
+                    del self._waiting[user_id]
+                waiter.granted = True
+                self._grant(user_id)
+                waiter.event.set()
+                progress = True
+
+    def acquire(self, user_id, username: str = None, timeout: float = None) -> float:
+        """
+        Take a transfer slot for `user_id`, queueing if none is free.
+
+        Returns:
+            float: Seconds spent in the queue.
+
+        Raises:
+            TransferQueueTimeout: If no slot came free within `timeout`
+                (default limits.queue_timeout_seconds).
+        """
+        if username:
+            self._names[user_id] = username
+        with self._lock:
+            self._stats["transfers"] += 1
+            self._user(user_id)["transfers"] += 1
+            if not self._waiting and self._can_grant(user_id):
+                self._grant(user_id)
+                return 0.0
+            waiter = _Waiter(user_id)
+            self._waiting.setdefault(user_id, deque()).append(waiter)
+            self._stats["queued"] += 1
+            self._user(user_id)["queued"] += 1
+            self._dispatch()
+        started = time.monotonic()
+        timeout = self.settings["queue_timeout_seconds"] if timeout is None else timeout
+        waiter.event.wait(timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            if not waiter.granted:
+                queue = self._waiting.get(user_id)
+                if queue is not None:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiting[user_id]
+                self._stats["timeouts"] += 1
+                self._user(user_id)["timeouts"] += 1
+                raise TransferQueueTimeout(f"No transfer slot came free within {timeout:g} seconds.")
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+            self._user(user_id)["wait_seconds"] += waited
+        return waited
+
+    def release(self, user_id):
+        with self._lock:
+            self._active[user_id] -= 1
+            self._total -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+                self._rebalance()
+            self._dispatch()
+
+    # --- Bandwidth ---
+
+    def _user_rate(self) -> float:
+        user_rate = self.settings["user_bytes_per_second"] or 0
+        global_rate = self.settings["global_bytes_per_second"] or 0
+        if global_rate and self._active:
+            share = global_rate / len(self._active)
+            return min(user_rate, share) if user_rate else share
+        return user_rate
+
+    def _rebalance(self):
+        """Give every user holding a slot the same share of the global rate."""
+        rate = self._user_rate()
+        burst = max(rate * self.settings["burst_seconds"], THROTTLE_CHUNK_SIZE)
+        for user_id in self._active:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                self._buckets[user_id] = TokenBucket(rate, burst)
+            else:
+                bucket.set_rate(rate, burst)
+
+    def reserve(self, user_id, amount: int, direction: str) -> float:
+        """Account `amount` bytes moved by `user_id`; return how long to wait before moving them."""
+        with self._lock:
+            self._stats["bytes"][direction] += amount
+            self._user(user_id)["bytes"] += amount
+            bucket = self._buckets.get(user_id)
+        delay = bucket.reserve(amount) if bucket is not None else 0.0
+        if delay:
+            with self._lock:
+                self._stats["throttled_seconds"] += delay
+                self._user(user_id)["throttled_seconds"] += delay
+        return delay
+
+    # --- Metrics ---
+
+    def _user(self, user_id) -> dict:
+        stats = self._user_stats.get(user_id)
+        if stats is None:
+            stats = self._user_stats[user_id] = {"transfers": 0, "queued": 0, "timeouts": 0, "wait_seconds": 0.0,
+                                                 "throttled_seconds": 0.0, "bytes": 0}
+        return stats
+
+    def snapshot(self) -> dict:
+        """Return current and cumulative throttling and queueing figures for this process."""
+        with self._lock:
+            users = [
+                dict(stats, user_id=user_id, username=self._names.get(user_id), active=self._active.get(user_id, 0),
+                     waiting=len(self._waiting.get(user_id, ())))
+                for user_id, stats in self._user_stats.items()
+            ]
+            return dict(
+                self._stats,
+                bytes=dict(self._stats["bytes"]),
+                active=self._total,
+                waiting=sum(len(queue) for queue in self._waiting.values()),
+                user_rate=self._user_rate(),
+                users=sorted(users, key=lambda user: (-user["active"], -user["waiting"], -user["bytes"])),
+            )
+
+def _apply_limit_settings(config):
+    limits = config.get("limits", {}) or {}
+    for key in limit_settings:
+        if key in limits:
+            limit_settings[key] = limits[key]
+    with limiter._lock:
+        limiter._rebalance()
+        limiter._dispatch()
+
+limiter = TransferLimiter(limit_settings)
+get_config_service().subscribe("limits.limit_settings", _apply_limit_settings)
+
+def acquire_slot(user_id, username: str = None) -> bool:
+    """
+    Take a transfer slot for `user_id`, queueing if none is free.
+
+    Returns:
+        bool: Whether a slot was taken; pass the result to `release_slot`.
+    """
+    if not limit_settings["enabled"] or user_id is None:
+        return False
+    limiter.acquire(user_id, username)
+    return True
+
+def release_slot(user_id, held: bool = True):
+    if held:
+        limiter.release(user_id)
+
+class transfer_slot:
+    """Context manager holding a transfer slot of `user_id` for its duration."""
+
+    def __init__(self, user_id, username: str = None):
+        self.user_id = user_id
+        self.username = username
+        self.held = False
+
+    def __enter__(self):
+        self.held = acquire_slot(self.user_id, self.username)
+        return self
+
+    def __exit__(self, *exc_info):
+        release_slot(self.user_id, self.held)
+        self.held = False
+        return False
+
+def reserve(user_id, amount: int, direction: str) -> float:
+    """Account `amount` bytes moved by `user_id` in `direction` ("upload" or "download"); return the seconds to wait first."""
+    if not limit_settings["enabled"] or user_id is None:
+        return 0.0
+    return limiter.reserve(user_id, amount, direction)
+
+def throttle(user_id, amount: int, direction: str):
+    """Block until `user_id` may move `amount` more bytes in `direction`."""
+    delay = reserve(user_id, amount, direction)
+    if delay:
+        time.sleep(delay)
+
+def throttled(user_id, chunks, direction: str):
+    """Yield `chunks` (bytes-like) in pieces of at most THROTTLE_CHUNK_SIZE, paced by `throttle`."""
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for start in range(0, len(view), THROTTLE_CHUNK_SIZE):
+            piece = view[start:start + THROTTLE_CHUNK_SIZE]
+            throttle(user_id, len(piece), direction)
+            yield piece
+
+def read_file(user_id, file_path, username: str = None) -> bytes:
+    """Read a whole file for `user_id` within a transfer slot and the user's bandwidth share."""
+    from .file_manager import iter_file
+
+    with transfer_slot(user_id, username):
+        return b"".join(throttled(user_id, iter_file(file_path), "download"))
+
+def transfer_stats() -> dict:
+    return limiter.snapshot()
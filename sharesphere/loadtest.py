@@ -0,0 +1,347 @@
+# sharesphere/loadtest.py
+
+"""
+Per-page rerun latency load test (`sharesphere loadtest`).
+
+Every widget interaction reruns the whole of app.py, so the time a page takes
+to rerun is the latency a user feels on each click. For every dataset size
+the load test:
+
+1. creates a scratch workspace (config.yaml, database and upload folder) and
+   seeds it with users, groups, shared files, group requests and access
+   statistics proportional to the size;
+2. drives the app with `streamlit.testing.v1.AppTest`: several sessions run
+   concurrently in separate processes, each logging in and then switching
+   through every page;
+3. reruns each page once more in a single session under tracemalloc to
+   record its peak memory.
+
+Each dataset runs in a fresh interpreter, because the database engine and
+the configuration are process-wide. Results can be saved as a baseline;
+comparing a later run with it fails when a page's p95 got slower by more
+than the threshold.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+import json
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+APP_PATH = Path(__file__).parent / "app.py"
+LOGIN_PAGE = "Login"
+# Pages as labelled in the navigation sidebar. The admin panel renders all of
+# its tabs on every rerun, so its timing covers every tab.
+PAGES = [
+    "📤 Upload Files",
+    "📥 Download Files",
+    "🗑️ Trash",
+    "👥 Your Groups",
+    "🔔 Notifications",
+    "⚙️ User Settings",
+    "🛠️ Admin Panel",
+]
+DEFAULT_SIZES = (100, 1000)
+DEFAULT_SESSIONS = 4
+DEFAULT_ITERATIONS = 3
+# A page fails the baseline comparison when its p95 grows by more than this
+# fraction and by at least MIN_REGRESSION_MS, so millisecond noise on fast pages is ignored.
+REGRESSION_THRESHOLD = 0.25
+MIN_REGRESSION_MS = 20.0
+RERUN_TIMEOUT_SECONDS = 120
+
+LOADTEST_USER = "loadtest-admin"
+LOADTEST_PASSWORD = "loadtest-password"
+RESULT_MARKER = "LOADTEST-RESULT "
+
+def write_workspace(folder) -> Path:
+    """Create a workspace whose config.yaml points the database and all folders inside `folder`."""
+    from omegaconf import OmegaConf
+
+    folder = Path(folder).resolve()
+    folder.mkdir(parents=True, exist_ok=True)
+    config = OmegaConf.load(Path(__file__).parent / "config.yaml")
+    config.db.url = f"sqlite:///{folder / 'sharesphere.db'}"
+    config.upload.folder = str(folder / "uploads")
+    config.logging.folder = str(folder / "logs")
+    config.backup.folder = str(folder / "backups")
+    # Login time should measure the app, not the password hash cost
+    config.security.bcrypt_rounds = 4
+    OmegaConf.save(config, folder / "config.yaml")
+    return folder
+
+def seed_dataset(size: int, seed: int = 0):
+    """
+    Fill an empty database with `size` files and users, groups, shares,
+    group requests and access statistics in proportion.
+
+    The load-test admin owns a tenth of the files, belongs to every group and
+    has about a quarter of the other files shared with them.
+    """
+    from sqlalchemy import insert, update
+    from .activity import rollup_access_events
+    from .groups import rebuild_closure
+    from .stats import rebuild_stats
+    from .auth import hash_password
+    from .config import get_config
+    from .database import SessionLocal
+    from .models import AccessEvent, File, FileSharing, Group, GroupRequest, User, user_group_association
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    user_count = max(size // 20, 5)
+    group_count = max(size // 200, 2)
+    upload_folder = Path(get_config().upload.folder)
+    upload_folder.mkdir(parents=True, exist_ok=True)
+    password = hash_password(LOADTEST_PASSWORD)
+
+    db = SessionLocal()
+    try:
+        users = [{"username": LOADTEST_USER, "hashed_password": password, "is_admin": True, "created_at": now}]
+        users += [
+            {"username": f"user{i:05d}", "hashed_password": password, "is_admin": False, "created_at": now}
+            for i in range(1, user_count)
+        ]
+        db.execute(insert(User), users)
+        db.execute(insert(Group), [{"name": f"group{i:04d}", "created_at": now} for i in range(group_count)])
+        user_ids = [row.id for row in db.query(User.id).order_by(User.id)]
+        group_ids = [row.id for row in db.query(Group.id).order_by(Group.id)]
+        # Departments and teams: each group after the first sits under an earlier one, two per parent
+        if len(group_ids) > 1:
+            db.execute(update(Group), [{"id": group_id, "parent_id": group_ids[(i - 1) // 2]}
+                                       for i, group_id in enumerate(group_ids) if i])
+        rebuild_closure(db)
+        admin_id, other_ids = user_ids[0], user_ids[1:]
+
+        memberships = [{"user_id": admin_id, "group_id": group_id} for group_id in group_ids]
+        requests = []
+        for user_id in other_ids:
+            joined = rng.sample(group_ids, min(2, len(group_ids)))
+            memberships += [{"user_id": user_id, "group_id": group_id} for group_id in joined]
+            requests.append({"user_id": user_id, "group_id": rng.choice(group_ids), "status": "pending",
+                             "created_at": now - timedelta(minutes=rng.randrange(10000)), "resolved_at": None})
+            # Resolved history, some of it old enough for the archive
+            requested_at = now - timedelta(days=rng.randrange(1000))
+            requests.append({"user_id": user_id, "group_id": rng.choice(joined), "status": rng.choice(["approved", "rejected"]),
+                             "created_at": requested_at, "resolved_at": requested_at + timedelta(hours=1)})
+        db.execute(insert(user_group_association), memberships)
+        db.execute(insert(GroupRequest), requests)
+
+        files = []
+        for i in range(size):
+            owner_id = admin_id if i % 10 == 0 else rng.choice(other_ids)
+            path = upload_folder / f"u{owner_id}" / f"file{i:06d}.txt"
+            path.parent.mkdir(exist_ok=True)
+            content = f"load test file {i}\n".encode() * 8
+            path.write_bytes(content)
+            files.append({"filename": path.name, "filepath": str(path), "owner_id": owner_id,
+                          "uploaded_at": now - timedelta(minutes=i), "comment": f"Seeded file {i}",
+                          "size": len(content), "version": 1})
+        db.execute(insert(File), files)
+        file_rows = db.query(File.id, File.owner_id).order_by(File.id).all()
+
+        shares, events = [], []
+        for file_id, owner_id in file_rows:
+            recipients = set(rng.sample(other_ids, min(2, len(other_ids))))
+            if owner_id != admin_id and rng.random() < 0.25:
+                recipients.add(admin_id)
+            recipients.discard(owner_id)
+            shares += [{"file_id": file_id, "user_id": user_id, "is_shared": True} for user_id in recipients]
+            events.append({"event_type": "upload", "file_id": file_id, "user_id": owner_id,
+                           "occurred_at": now - timedelta(hours=rng.randrange(24 * 7))})
+            for _ in range(rng.randrange(4)):
+                events.append({"event_type": "download", "file_id": file_id, "user_id": rng.choice(user_ids),
+                               "occurred_at": now - timedelta(hours=rng.randrange(24 * 7))})
+        db.execute(insert(FileSharing), shares)
+        db.execute(insert(AccessEvent), events)
+        db.commit()
+    finally:
+        db.close()
+    while rollup_access_events():
+        pass
+    rebuild_stats()
+
+def _percentile(values, pct: float) -> float:
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def _timed_run(at):
+    started = time.perf_counter()
+    at.run(timeout=RERUN_TIMEOUT_SECONDS)
+    return (time.perf_counter() - started) * 1000
+
+def _login(at):
+    at.run(timeout=RERUN_TIMEOUT_SECONDS)
+    at.text_input[0].input(LOADTEST_USER)
+    at.text_input[1].input(LOADTEST_PASSWORD)
+    elapsed_ms = _timed_run(at.button[0].click())
+    if not at.session_state["authentication_status"]:
+        raise RuntimeError("Load-test login failed.")
+    return elapsed_ms
+
+def _exceptions(at) -> list:
+    return [exception.value for exception in at.exception]
+
+def _run_session(pages: list, iterations: int):
+    """Log in and switch through `pages` `iterations` times; return ({page: [ms]}, {page: [errors]})."""
+    from streamlit.testing.v1 import AppTest
+
+    timings = {page: [] for page in [LOGIN_PAGE] + pages}
+    errors = {page: set() for page in [LOGIN_PAGE] + pages}
+    at = AppTest.from_file(str(APP_PATH), default_timeout=RERUN_TIMEOUT_SECONDS)
+    timings[LOGIN_PAGE].append(_login(at))
+    errors[LOGIN_PAGE].update(_exceptions(at))
+    for _ in range(iterations):
+        for page in pages:
+            timings[page].append(_timed_run(at.sidebar.radio[0].set_value(page)))
+            errors[page].update(_exceptions(at))
+    return timings, {page: sorted(messages) for page, messages in errors.items()}
+
+def _peak_memory(pages: list) -> dict:
+    """Return the peak traced allocation in KiB of one rerun of each page, measured in a single session."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=RERUN_TIMEOUT_SECONDS)
+    peaks = {}
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        _login(at)
+        peaks[LOGIN_PAGE] = (tracemalloc.get_traced_memory()[1] - baseline) / 1024
+        for page in pages:
+            at.sidebar.radio[0].set_value(page)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            at.run(timeout=RERUN_TIMEOUT_SECONDS)
+            peaks[page] = (tracemalloc.get_traced_memory()[1] - baseline) / 1024
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def measure_pages(pages: list = None, sessions: int = DEFAULT_SESSIONS, iterations: int = DEFAULT_ITERATIONS) -> dict:
+    """
+    Time page reruns against the current database.
+
+    Returns:
+        dict: {page: {"runs", "p50_ms", "p95_ms", "max_ms", "peak_kib", "errors"}}
+    """
+    pages = pages or PAGES
+    timings = {page: [] for page in [LOGIN_PAGE] + pages}
+    errors = {page: set() for page in [LOGIN_PAGE] + pages}
+    # AppTest patches Streamlit globals while a script runs, so concurrent
+    # sessions each get a process of their own; they share the database.
+    with ProcessPoolExecutor(max_workers=sessions, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_run_session, pages, iterations) for _ in range(sessions)]
+        for future in futures:
+            session_timings, session_errors = future.result()
+            for page in timings:
+                timings[page] += session_timings[page]
+                errors[page].update(session_errors[page])
+    peaks = _peak_memory(pages)
+    return {
+        page: {
+            "runs": len(values),
+            "p50_ms": round(_percentile(values, 50), 1),
+            "p95_ms": round(_percentile(values, 95), 1),
+            "max_ms": round(max(values), 1),
+            "peak_kib": round(peaks[page], 1),
+            "errors": sorted(errors[page]),
+        }
+        for page, values in timings.items()
+    }
+
+def _run_child(size: int, sessions: int, iterations: int, pages: list):
+    """Entry point of the per-dataset interpreter; prints its results as one marked JSON line."""
+    from .database import init_db
+
+    init_db()
+    started = time.perf_counter()
+    seed_dataset(size)
+    seed_seconds = time.perf_counter() - started
+    results = measure_pages(pages, sessions, iterations)
+    print(RESULT_MARKER + json.dumps({"seed_seconds": round(seed_seconds, 2), "pages": results}), flush=True)
+
+def run_dataset(size: int, workspace, sessions: int = DEFAULT_SESSIONS, iterations: int = DEFAULT_ITERATIONS,
+                pages: list = None) -> dict:
+    """Seed a fresh workspace with `size` files and measure every page in a separate interpreter."""
+    folder = write_workspace(workspace)
+    package_parent = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, env.get("PYTHONPATH")]))
+    env.pop("SHARESPHERE_CONFIG_PATH", None)
+    code = (
+        "import sharesphere.loadtest as loadtest; "
+        f"loadtest._run_child({size!r}, {sessions!r}, {iterations!r}, {pages or PAGES!r})"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=folder, env=env, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"Load test for {size} files failed:\n{result.stderr[-4000:]}")
+
+def run_loadtest(sizes=DEFAULT_SIZES, sessions: int = DEFAULT_SESSIONS, iterations: int = DEFAULT_ITERATIONS,
+                 pages: list = None, workspace=None, echo=print) -> dict:
+    """
+    Run the load test for every dataset size.
+
+    Args:
+        workspace (str, optional): Folder for the scratch workspaces; a
+            temporary folder that is removed afterwards by default.
+
+    Returns:
+        dict: {"sessions", "iterations", "sizes": {size: {"seed_seconds", "pages"}}}
+    """
+    results = {"sessions": sessions, "iterations": iterations, "sizes": {}}
+    with tempfile.TemporaryDirectory(prefix="sharesphere-loadtest-") as scratch:
+        root = Path(workspace or scratch)
+        for size in sizes:
+            echo(f"Seeding {size} files and running {sessions} session(s) x {iterations} pass(es)...")
+            result = run_dataset(size, root / f"size-{size}", sessions, iterations, pages)
+            results["sizes"][str(size)] = result
+            echo(format_results(size, result))
+    return results
+
+def format_results(size: int, result: dict) -> str:
+    lines = [f"{size} files (seeded in {result['seed_seconds']:.1f} s)",
+             f"  {'page':<22}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'peak KiB':>11}"]
+    for page, stats in result["pages"].items():
+        lines.append(f"  {page:<22}{stats['runs']:>6}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                     f"{stats['max_ms']:>10.1f}{stats['peak_kib']:>11.1f}")
+        for error in stats["errors"]:
+            lines.append(f"    error: {error}")
+    return "\n".join(lines)
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """
+    Compare per-page p95 latencies with a saved baseline.
+
+    Pages that raised exceptions fail as well. Sizes or pages missing from
+    the baseline are not compared.
+
+    Returns:
+        list: Human-readable failures; empty when nothing regressed.
+    """
+    failures = []
+    for size, result in results["sizes"].items():
+        base_pages = baseline.get("sizes", {}).get(size, {}).get("pages", {})
+        for page, stats in result["pages"].items():
+            if stats["errors"]:
+                failures.append(f"{page} at {size} files raised: {'; '.join(stats['errors'])}")
+            base = base_pages.get(page)
+            if base is None:
+                continue
+            slower_ms = stats["p95_ms"] - base["p95_ms"]
+            if slower_ms > MIN_REGRESSION_MS and stats["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                failures.append(f"{page} at {size} files: p95 {stats['p95_ms']:.1f} ms, "
+                                f"baseline {base['p95_ms']:.1f} ms (+{slower_ms:.1f} ms).")
+    return failures
@@ -0,0 +1,488 @@
+# sharesphere/migration.py
+
+"""
+Streaming export and import of a whole instance (`sharesphere export` /
+`sharesphere import`), for moving ShareSphere between hosts.
+
+An archive is a single stream of frames, so it can be piped straight to
+another host (`sharesphere export - | ssh new sharesphere import -`):
+
+    magic, then frames of: type (1 byte), header length (uint32), JSON header,
+                           payload length (uint64), payload
+
+    H  archive header: format version, creation time, block size
+    E  start of an entry: {"name", "kind": "table" | "blob" | "archive"}
+    B  one block of the entry: zlib-compressed payload; header {"size", "crc32"} of the raw bytes
+    X  end of the entry: {"size", "sha256"} of all its raw bytes
+    M  manifest, last: every entry with its size and SHA-256, row counts per table
+
+Tables come first, as JSON lines read inside one SQLite read transaction, so
+the rows form a consistent snapshot. The upload folder (including version
+chunks and previews) follows as blobs. Paths in the `files` table that lie
+inside the upload folder are stored relative to it and re-rooted in the
+target's upload folder on import. Archive packs of the storage tier
+(tiering.py) come last, each cut at the end of the last file the snapshot
+places in it, and are written into the target's `tiering.folder`.
+
+Both directions keep memory flat: data moves in BLOCK_SIZE blocks and at
+most `threads * 2` blocks are compressed or decompressed at a time, on a
+thread pool (zlib releases the GIL, so blocks compress in parallel across
+cores). Import checks every block's CRC on the pool and every entry's
+SHA-256 as it is written, and only moves a blob into place once it verified.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SHARESPHERE-ARCHIVE\n"
+FORMAT_VERSION = 1
+BLOCK_SIZE = 4 * 1024 * 1024
+ROW_BATCH_SIZE = 1000
+# Folders of the upload folder that are not exported
+SKIP_FOLDERS = {"lost+found"}
+# Columns holding paths into the upload folder, per table
+PATH_COLUMNS = {"files": ("filepath", "preview_path"), "file_versions": ("filepath",)}
+UPLOAD_PREFIX = "upload:"
+
+_FRAME_HEAD = struct.Struct(">cI")
+_PAYLOAD_LENGTH = struct.Struct(">Q")
+
+class ArchiveError(Exception):
+    """The archive is malformed, truncated or fails verification."""
+
+def _write_frame(out, kind: bytes, header: dict, payload: bytes = b""):
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    out.write(_FRAME_HEAD.pack(kind, len(header_bytes)))
+    out.write(header_bytes)
+    out.write(_PAYLOAD_LENGTH.pack(len(payload)))
+    if payload:
+        out.write(payload)
+
+def _read_exact(stream, length: int) -> bytes:
+    data = stream.read(length)
+    while len(data) < length:
+        more = stream.read(length - len(data))
+        if not more:
+            raise ArchiveError("The archive is truncated.")
+        data += more
+    return data
+
+def _read_frames(stream):
+    """Yield (kind, header, payload) frames until the manifest."""
+    if _read_exact(stream, len(MAGIC)) != MAGIC:
+        raise ArchiveError("Not a ShareSphere archive.")
+    while True:
+        kind, header_length = _FRAME_HEAD.unpack(_read_exact(stream, _FRAME_HEAD.size))
+        header = json.loads(_read_exact(stream, header_length))
+        (payload_length,) = _PAYLOAD_LENGTH.unpack(_read_exact(stream, _PAYLOAD_LENGTH.size))
+        payload = _read_exact(stream, payload_length) if payload_length else b""
+        yield kind, header, payload
+        if kind == b"M":
+            return
+
+def _compress_block(data: bytes, level: int):
+    return {"size": len(data), "crc32": zlib.crc32(data)}, zlib.compress(data, level)
+
+def _decompress_block(header: dict, payload: bytes) -> bytes:
+    try:
+        data = zlib.decompress(payload)
+    except zlib.error as e:
+        raise ArchiveError(f"A block is corrupt: {e}")
+    if len(data) != header["size"] or zlib.crc32(data) != header["crc32"]:
+        raise ArchiveError("A block failed its CRC check.")
+    return data
+
+class _OrderedPipeline:
+    """
+    Run block work on a thread pool while keeping results in submission order,
+    with at most `limit` results pending so memory stays bounded.
+    """
+
+    def __init__(self, pool, limit: int, emit):
+        self.pool = pool
+        self.limit = limit
+        self.emit = emit
+        self.pending = deque()
+
+    def submit(self, function, *args):
+        self.pending.append(self.pool.submit(function, *args))
+        self._drain(self.limit)
+
+    def put(self, value):
+        """Queue a value that needs no work, in order with the submitted ones."""
+        self.pending.append(value)
+        self._drain(self.limit)
+
+    def _drain(self, keep: int):
+        while len(self.pending) > keep:
+            item = self.pending.popleft()
+            self.emit(item.result() if hasattr(item, "result") else item)
+
+    def flush(self):
+        self._drain(0)
+
+# === Export ===
+
+def _encode_paths(table: str, columns: list, row: tuple, upload_root: str) -> list:
+    row = list(row)
+    for name in PATH_COLUMNS.get(table, ()):
+        if name not in columns or not row[columns.index(name)]:
+            continue
+        index = columns.index(name)
+        relative = os.path.relpath(os.path.abspath(row[index]), upload_root)
+        if not relative.startswith(".."):
+            row[index] = UPLOAD_PREFIX + PurePosixPath(*Path(relative).parts).as_posix()
+    return row
+
+def _table_blocks(cursor, table: str, upload_root: str, counts: dict):
+    """Yield BLOCK_SIZE pieces of the table as JSON lines, reading rows in batches."""
+    cursor.execute(f'SELECT * FROM "{table}"')
+    columns = [column[0] for column in cursor.description]
+    buffer = bytearray(json.dumps({"columns": columns}).encode("utf-8") + b"\n")
+    counts[table] = 0
+    while True:
+        rows = cursor.fetchmany(ROW_BATCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            buffer += json.dumps(_encode_paths(table, columns, row, upload_root), separators=(",", ":")).encode("utf-8")
+            buffer += b"\n"
+        counts[table] += len(rows)
+        while len(buffer) >= BLOCK_SIZE:
+            yield bytes(buffer[:BLOCK_SIZE])
+            del buffer[:BLOCK_SIZE]
+    if buffer:
+        yield bytes(buffer)
+
+def _file_blocks(path):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            yield block
+
+def _pack_blocks(path, length: int):
+    """Yield the first `length` bytes of a pack; the archiver may still be appending to it."""
+    with open(path, "rb") as f:
+        while length:
+            block = f.read(min(BLOCK_SIZE, length))
+            if not block:
+                raise ArchiveError(f"Archive pack {path} is shorter than the database says.")
+            length -= len(block)
+            yield block
+
+def _upload_blobs(upload_root: str):
+    """Yield (archive name, path) for every file in the upload folder, in a stable order."""
+    for directory, folders, files in os.walk(upload_root):
+        if directory == upload_root:
+            folders[:] = [folder for folder in folders if folder not in SKIP_FOLDERS]
+        folders.sort()
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            if name.endswith(".part") or os.path.islink(path):
+                continue
+            relative = os.path.relpath(path, upload_root)
+            yield PurePosixPath(*Path(relative).parts).as_posix(), path
+
+def export_instance(out, threads: int = None, level: int = 6, echo=print) -> dict:
+    """
+    Write the database and upload folder of this instance to the binary stream `out`.
+
+    Returns:
+        dict: The manifest written at the end of the archive.
+    """
+    from .config import get_config
+    from .database import get_engine, init_db
+    from .tiering import archive_folder
+
+    init_db()
+    threads = threads or os.cpu_count() or 1
+    upload_root = os.path.abspath(get_config().upload.folder)
+    manifest = {"entries": [], "tables": {}}
+    out.write(MAGIC)
+    _write_frame(out, b"H", {"format": FORMAT_VERSION, "created_at": datetime.utcnow().isoformat(),
+                             "block_size": BLOCK_SIZE})
+
+    def emit(frame):
+        _write_frame(out, *frame)
+
+    def write_entry(pipeline, name: str, kind: str, blocks):
+        pipeline.put((b"E", {"name": name, "kind": kind}))
+        digest = hashlib.sha256()
+        size = 0
+        for block in blocks:
+            digest.update(block)
+            size += len(block)
+            pipeline.submit(lambda data: (b"B", *_compress_block(data, level)), block)
+        pipeline.put((b"X", {"size": size, "sha256": digest.hexdigest()}))
+        manifest["entries"].append({"name": name, "kind": kind, "size": size, "sha256": digest.hexdigest()})
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="export") as pool:
+        pipeline = _OrderedPipeline(pool, threads * 2, emit)
+        connection = get_engine().raw_connection()
+        try:
+            cursor = connection.cursor()
+            # One read transaction for every table: WAL keeps this snapshot while the app writes
+            cursor.execute("BEGIN")
+            tables = [row[0] for row in cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            ).fetchall()]
+            for table in tables:
+                write_entry(pipeline, table, "table", _table_blocks(cursor, table, upload_root, manifest["tables"]))
+                echo(f"Exported table {table}: {manifest['tables'][table]} row(s).")
+            packs = cursor.execute(
+                "SELECT pack, MAX(offset + length) FROM archived_files GROUP BY pack ORDER BY pack"
+            ).fetchall() if "archived_files" in tables else []
+            cursor.execute("COMMIT")
+        finally:
+            connection.close()
+
+        blob_count = blob_bytes = 0
+        for name, path in _upload_blobs(upload_root):
+            write_entry(pipeline, name, "blob", _file_blocks(path))
+            blob_count += 1
+            blob_bytes += manifest["entries"][-1]["size"]
+        for pack, length in packs:
+            write_entry(pipeline, pack, "archive", _pack_blocks(archive_folder() / pack, length))
+        pipeline.flush()
+    echo(f"Exported {blob_count} file(s), {blob_bytes} byte(s)" + (f", {len(packs)} archive pack(s)." if packs else "."))
+    _write_frame(out, b"M", manifest)
+    out.flush()
+    return manifest
+
+# === Import ===
+
+def _parse_remaps(remaps) -> list:
+    pairs = []
+    for remap in remaps or []:
+        old, separator, new = remap.partition("=")
+        if not separator or not old:
+            raise ValueError(f"Path remapping '{remap}' must look like OLD=NEW.")
+        pairs.append((old, new))
+    return pairs
+
+def _decode_path(value, upload_root: str, remaps: list):
+    if not value:
+        return value
+    if value.startswith(UPLOAD_PREFIX):
+        return str(Path(upload_root, *PurePosixPath(value[len(UPLOAD_PREFIX):]).parts))
+    for old, new in remaps:
+        if value.startswith(old):
+            return new + value[len(old):]
+    return value
+
+class _TableLoader:
+    """Bulk-loads the JSON lines of one table entry with executemany in batches."""
+
+    def __init__(self, cursor, table: str, target_columns: set, upload_root: str, remaps: list):
+        self.cursor = cursor
+        self.table = table
+        self.target_columns = target_columns
+        self.upload_root = upload_root
+        self.remaps = remaps
+        self.buffer = bytearray()
+        self.columns = None
+        self.batch = []
+        self.rows = 0
+
+    def write(self, data: bytes):
+        self.buffer += data
+        *lines, rest = self.buffer.split(b"\n")
+        self.buffer = bytearray(rest)
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line: bytes):
+        if self.columns is None:
+            source_columns = json.loads(line)["columns"]
+            self.keep = [i for i, name in enumerate(source_columns) if name in self.target_columns]
+            dropped = [name for name in source_columns if name not in self.target_columns]
+            if dropped:
+                logger.warning(f"Import: table {self.table} has no column(s) {dropped}; their values are dropped.")
+            self.columns = [source_columns[i] for i in self.keep]
+            self.path_indexes = [self.columns.index(name) for name in PATH_COLUMNS.get(self.table, ()) if name in self.columns]
+            names = ", ".join(f'"{name}"' for name in self.columns)
+            self.statement = f'INSERT INTO "{self.table}" ({names}) VALUES ({", ".join("?" * len(self.columns))})'
+            return
+        values = json.loads(line)
+        row = [values[i] for i in self.keep]
+        for index in self.path_indexes:
+            row[index] = _decode_path(row[index], self.upload_root, self.remaps)
+        self.batch.append(row)
+        if len(self.batch) >= ROW_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            self.cursor.executemany(self.statement, self.batch)
+            self.rows += len(self.batch)
+            self.batch = []
+
+    def close(self):
+        if self.buffer:
+            self._line(bytes(self.buffer))
+            self.buffer = bytearray()
+        self._flush()
+
+class _BlobWriter:
+    """Writes one blob to a temporary file next to its destination."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+    def commit(self):
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def _blob_path(upload_root: str, name: str) -> Path:
+    parts = PurePosixPath(name).parts
+    if not parts or PurePosixPath(name).is_absolute() or ".." in parts:
+        raise ArchiveError(f"Refusing to write blob '{name}' outside the upload folder.")
+    return Path(upload_root, *parts)
+
+def _pack_path(name: str) -> Path:
+    from .tiering import archive_folder
+
+    if not name or PurePosixPath(name).name != name or name in (".", ".."):
+        raise ArchiveError(f"Refusing to write archive pack '{name}' outside the archive folder.")
+    return archive_folder() / name
+
+def import_instance(stream, threads: int = None, remaps: list = None, echo=print) -> dict:
+    """
+    Load an archive written by `export_instance` into this instance.
+
+    Every table of the target database must be empty. Rows are bulk-loaded
+    in one transaction that commits only after every entry verified.
+
+    Args:
+        remaps (list, optional): "OLD=NEW" prefixes applied to paths outside
+            the exported upload folder.
+
+    Returns:
+        dict: The archive's manifest.
+    """
+    from .config import get_config
+    from .database import get_engine, init_db
+
+    init_db()
+    remaps = _parse_remaps(remaps)
+    threads = threads or os.cpu_count() or 1
+    upload_root = os.path.abspath(get_config().upload.folder)
+    os.makedirs(upload_root, exist_ok=True)
+
+    connection = get_engine().raw_connection()
+    cursor = connection.cursor()
+    target_columns = {}
+    for (table,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall():
+        target_columns[table] = {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")').fetchall()}
+    not_empty = [table for table in sorted(target_columns) if cursor.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone()]
+    if not_empty:
+        connection.close()
+        raise ValueError(f"The target database already has rows in {', '.join(not_empty)}; import needs an empty instance.")
+
+    state = {"entry": None, "sink": None, "digest": None, "size": 0, "seen": [], "blobs": []}
+
+    def open_entry(header):
+        name, kind = header["name"], header["kind"]
+        if kind == "table":
+            if name not in target_columns:
+                logger.warning(f"Import: skipping table {name}, which this version does not have.")
+                sink = None
+            else:
+                sink = _TableLoader(cursor, name, target_columns[name], upload_root, remaps)
+        elif kind == "blob":
+            sink = _BlobWriter(_blob_path(upload_root, name))
+        elif kind == "archive":
+            sink = _BlobWriter(_pack_path(name))
+        else:
+            raise ArchiveError(f"Unknown entry kind '{kind}'.")
+        state.update(entry=header, sink=sink, digest=hashlib.sha256(), size=0)
+
+    def close_entry(header):
+        entry, sink = state["entry"], state["sink"]
+        if entry is None:
+            raise ArchiveError("Entry end without a start.")
+        if header["size"] != state["size"] or header["sha256"] != state["digest"].hexdigest():
+            if isinstance(sink, _BlobWriter):
+                sink.discard()
+            raise ArchiveError(f"Entry '{entry['name']}' failed its SHA-256 check.")
+        if sink is not None:
+            sink.close()
+            if isinstance(sink, _BlobWriter):
+                state["blobs"].append(sink)
+            else:
+                echo(f"Imported table {entry['name']}: {sink.rows} row(s).")
+        state["seen"].append({"name": entry["name"], "kind": entry["kind"], "size": state["size"], "sha256": header["sha256"]})
+        state.update(entry=None, sink=None)
+
+    def emit(item):
+        kind, value = item
+        if kind == b"E":
+            open_entry(value)
+        elif kind == b"B":
+            if state["entry"] is None:
+                raise ArchiveError("Block outside an entry.")
+            state["digest"].update(value)
+            state["size"] += len(value)
+            if state["sink"] is not None:
+                state["sink"].write(value)
+        elif kind == b"X":
+            close_entry(value)
+
+    manifest = None
+    try:
+        cursor.execute("BEGIN")
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="import") as pool:
+            pipeline = _OrderedPipeline(pool, threads * 2, emit)
+            for kind, header, payload in _read_frames(stream):
+                if kind == b"H":
+                    if header.get("format") != FORMAT_VERSION:
+                        raise ArchiveError(f"Unsupported archive format {header.get('format')}.")
+                elif kind == b"B":
+                    pipeline.submit(lambda h, p: (b"B", _decompress_block(h, p)), header, payload)
+                elif kind in (b"E", b"X"):
+                    pipeline.put((kind, header))
+                elif kind == b"M":
+                    pipeline.flush()
+                    manifest = header
+                else:
+                    raise ArchiveError(f"Unknown frame type {kind!r}.")
+        if manifest is None or manifest["entries"] != state["seen"]:
+            raise ArchiveError("The archive's manifest does not match its entries.")
+        cursor.execute("COMMIT")
+    except BaseException:
+        connection.rollback()
+        if state["sink"] is not None and isinstance(state["sink"], _BlobWriter):
+            state["sink"].discard()
+        for blob in state["blobs"]:
+            blob.discard()
+        raise
+    finally:
+        connection.close()
+
+    for blob in state["blobs"]:
+        blob.commit()
+    echo(f"Imported {len(state['blobs'])} file(s) into {upload_root}.")
+    return manifest
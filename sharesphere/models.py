@@ -1,6 +1,6 @@
 # sharesphere/models.py
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Table
+from sqlalchemy import Column, Integer, String, Text, DateTime, Date, ForeignKey, Boolean, Table, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -10,7 +10,10 @@ user_group_association = Table(
     'user_group_association',
     Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id')),
-    Column('group_id', Integer, ForeignKey('groups.id'))
+    Column('group_id', Integer, ForeignKey('groups.id')),
+    # Membership is resolved in both directions through group_closure (see sharesphere/groups.py)
+    Index('ix_user_group_association_user_group', 'user_id', 'group_id'),
+    Index('ix_user_group_association_group_user', 'group_id', 'user_id'),
 )
 
 class User(Base):
@@ -34,42 +37,286 @@ class Group(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Members of a group are also members of its parent, and so on up; see GroupClosure
+    parent_id = Column(Integer, ForeignKey("groups.id"), nullable=True, index=True)
     
     members = relationship("User", secondary=user_group_association, back_populates="groups")
     group_requests = relationship("GroupRequest", back_populates="group")
 
+class GroupClosure(Base):
+    """Every (ancestor, descendant) pair of the group hierarchy, including each group with itself at depth 0."""
+    __tablename__ = "group_closure"
+    __table_args__ = (
+        Index("ix_group_closure_descendant_ancestor", "descendant_id", "ancestor_id"),
+    )
+
+    ancestor_id = Column(Integer, ForeignKey("groups.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("groups.id"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
 class File(Base):
     __tablename__ = "files"
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
-    filepath = Column(String, nullable=False)
-    owner_id = Column(Integer, ForeignKey("users.id"))
-    uploaded_at = Column(DateTime, default=datetime.utcnow)
+    filepath = Column(String, nullable=False, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
+    uploaded_at = Column(DateTime, default=datetime.utcnow, index=True)
     comment = Column(String, nullable=True)  # Add comment field
+    size = Column(Integer, nullable=True)
+    # Filled in by background jobs after upload (see sharesphere/processing.py)
+    checksum = Column(String, nullable=True)  # SHA-256 hex digest
+    mime_type = Column(String, nullable=True)
+    content_warning = Column(String, nullable=True)  # Set when the content does not match the extension
+    preview_path = Column(String, nullable=True)
+    file_metadata = Column(Text, nullable=True)  # JSON
+    # Soft delete: set when the file is moved to the trash, purged after trash.retention_days
+    deleted_at = Column(DateTime, nullable=True, index=True)
+    deleted_by = Column(Integer, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)  # Removed by the expiry sweeper after this time
+    version = Column(Integer, default=1)  # Number of the version held in `filepath`; NULL on old rows means 1
+    # Storage tiering (see sharesphere/tiering.py)
+    last_accessed_at = Column(DateTime, nullable=True)  # Last download or preview; NULL means never
+    archived_at = Column(DateTime, nullable=True, index=True)  # Set while the content lives only in an archive pack
     
     owner = relationship("User", back_populates="files")
     shared_with = relationship("FileSharing", back_populates="file")
 
 class FileSharing(Base):
     __tablename__ = "file_sharing"
+    __table_args__ = (
+        # Serves the per-user "shared with me and not expired" lookup from the index alone
+        Index("ix_file_sharing_user_expires", "user_id", "expires_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(Integer, ForeignKey("files.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     is_shared = Column(Boolean, default=False)  # True means shared with the user
+    expires_at = Column(DateTime, nullable=True, index=True)  # Access ends at this time; NULL means never
     
     file = relationship("File", back_populates="shared_with")
     user = relationship("User", back_populates="shared_files")
 
 class GroupRequest(Base):
     __tablename__ = "group_requests"
+    __table_args__ = (
+        # The pending queue pages by status and age; resolved rows move to group_request_archive
+        Index("ix_group_requests_status_created", "status", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     group_id = Column(Integer, ForeignKey("groups.id"))
     status = Column(String, default="pending")  # pending, approved, rejected
     created_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime, nullable=True)  # When it was approved or rejected; NULL on older rows
     
     user = relationship("User", back_populates="group_requests")
-    group = relationship("Group", back_populates="group_requests")
\ No newline at end of file
+    group = relationship("Group", back_populates="group_requests")
+
+class ArchivedGroupRequest(Base):
+    """Resolved group request moved out of group_requests by `admin.archive_group_requests`."""
+    __tablename__ = "group_request_archive"
+
+    # Its own ID: SQLite hands out an archived request's ID again once it is the highest
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, index=True)
+    group_id = Column(Integer)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime, index=True)
+    resolved_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class Notification(Base):
+    __tablename__ = "notifications"
+    __table_args__ = (
+        # One row per user, event kind, file and day; repeated events bump `count`
+        UniqueConstraint("user_id", "kind", "file_id", "day", name="uq_notifications_coalesce"),
+        Index("ix_notifications_user_unread", "user_id", "is_read"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)  # download
+    file_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+    filename = Column(String, nullable=True)
+    last_actor = Column(String, nullable=True)
+    count = Column(Integer, default=1, nullable=False)
+    is_read = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class AccessEvent(Base):
+    """Append-only record of a file being uploaded, downloaded, previewed or deleted."""
+    __tablename__ = "access_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)  # upload, download, preview, delete
+    file_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    occurred_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AccessStat(Base):
+    """Hourly and daily event counts per file, per user and instance-wide, rolled up from AccessEvent."""
+    __tablename__ = "access_stats"
+    __table_args__ = (
+        UniqueConstraint("period", "scope", "subject_id", "bucket", "event_type", name="uq_access_stats_bucket"),
+        Index("ix_access_stats_period_scope_bucket", "period", "scope", "bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    period = Column(String, nullable=False)  # hour, day
+    scope = Column(String, nullable=False)  # file, user, all
+    subject_id = Column(Integer, nullable=False)  # file or user ID, 0 for scope "all"
+    bucket = Column(DateTime, nullable=False)  # start of the hour or day
+    event_type = Column(String, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+
+class RollupState(Base):
+    """High-water mark of raw rows already folded into a rollup table."""
+    __tablename__ = "rollup_state"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ApiToken(Base):
+    """Bearer token for the HTTP API. Only a SHA-256 hash of the token is stored."""
+    __tablename__ = "api_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    name = Column(String, nullable=True)
+    token_hash = Column(String, unique=True, index=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    """Durable background job; claimed and run by `sharesphere worker`."""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    payload = Column(Text, nullable=False, default="{}")  # JSON
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed
+    idempotency_key = Column(String, unique=True, nullable=True)
+    # File the job works on; its jobs are deleted with it, since SQLite hands a removed file's ID to the next upload
+    file_id = Column(Integer, nullable=True, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class FileVersion(Base):
+    """One version of a File; its bytes are stored as content-defined chunks (see sharesphere/versioning.py)."""
+    __tablename__ = "file_versions"
+    __table_args__ = (
+        UniqueConstraint("file_id", "version", name="uq_file_versions_file_version"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(Integer, ForeignKey("files.id"), nullable=False, index=True)
+    version = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=True)
+    checksum = Column(String, nullable=True)  # SHA-256 of the whole version, set once chunked
+    comment = Column(String, nullable=True)
+    uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    chunked_at = Column(DateTime, nullable=True)  # NULL until the chunks are stored
+    filepath = Column(String, nullable=True)  # Bytes of a superseded version waiting to be chunked
+
+class Chunk(Base):
+    """A content-addressed chunk shared by any number of versions."""
+    __tablename__ = "chunks"
+
+    hash = Column(String, primary_key=True)  # SHA-256 hex digest of the chunk
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+
+class VersionChunk(Base):
+    """Position of a chunk within a version."""
+    __tablename__ = "version_chunks"
+
+    version_id = Column(Integer, ForeignKey("file_versions.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    chunk_hash = Column(String, ForeignKey("chunks.hash"), nullable=False, index=True)
+
+class ArchivedFile(Base):
+    """Where the content of an archived file sits in the archive tier."""
+    __tablename__ = "archived_files"
+
+    file_id = Column(Integer, ForeignKey("files.id"), primary_key=True)
+    pack = Column(String, nullable=False, index=True)  # Pack file name inside tiering.folder
+    offset = Column(Integer, nullable=False)
+    length = Column(Integer, nullable=False)  # Compressed bytes in the pack
+    size = Column(Integer, nullable=False)  # Original size
+    checksum = Column(String, nullable=False)  # SHA-256 of the original content
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class IngestRecord(Base):
+    """A file brought in by `sharesphere ingest`, so an interrupted or repeated ingest skips it (see sharesphere/ingest.py)."""
+    __tablename__ = "ingest_records"
+    __table_args__ = (
+        UniqueConstraint("owner_id", "source_path", name="uq_ingest_records_owner_source"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    source_path = Column(String, nullable=False)  # Absolute path of the ingested file
+    size = Column(Integer, nullable=False)
+    mtime_ns = Column(Integer, nullable=False)
+    checksum = Column(String, nullable=False)  # SHA-256 of the content ingested
+    file_id = Column(Integer, nullable=True, index=True)  # May name a file deleted since; it is not ingested again
+    ingested_at = Column(DateTime, default=datetime.utcnow)
+
+# === Dashboard summaries (see sharesphere/stats.py) ===
+
+class UserStorageStat(Base):
+    """Running totals of one user's files, kept up to date with every change to them."""
+    __tablename__ = "user_storage_stats"
+
+    user_id = Column(Integer, primary_key=True)
+    files = Column(Integer, nullable=False, default=0)  # Live files (not in the trash)
+    bytes = Column(Integer, nullable=False, default=0, index=True)  # Size of the current versions of live files
+    trashed_files = Column(Integer, nullable=False, default=0)
+    trashed_bytes = Column(Integer, nullable=False, default=0)
+    shares = Column(Integer, nullable=False, default=0)  # Sharing rows on the user's files
+
+class GroupStorageStat(Base):
+    """Running totals over the members of one group, including its subgroups' members; a user in several groups counts in each."""
+    __tablename__ = "group_storage_stats"
+
+    group_id = Column(Integer, primary_key=True)
+    members = Column(Integer, nullable=False, default=0)
+    files = Column(Integer, nullable=False, default=0)
+    bytes = Column(Integer, nullable=False, default=0, index=True)
+
+class DailyUploadStat(Base):
+    """Uploads (new files and new versions) per UTC day."""
+    __tablename__ = "upload_stats"
+
+    day = Column(Date, primary_key=True)
+    uploads = Column(Integer, nullable=False, default=0)
+    bytes = Column(Integer, nullable=False, default=0)
+
+class DashboardTotal(Base):
+    """Instance-wide totals, a single row with id 1."""
+    __tablename__ = "dashboard_totals"
+
+    id = Column(Integer, primary_key=True)
+    users = Column(Integer, nullable=False, default=0)
+    groups = Column(Integer, nullable=False, default=0)
+    files = Column(Integer, nullable=False, default=0)
+    bytes = Column(Integer, nullable=False, default=0)
+    trashed_files = Column(Integer, nullable=False, default=0)
+    trashed_bytes = Column(Integer, nullable=False, default=0)
+    shares = Column(Integer, nullable=False, default=0)
+    rebuilt_at = Column(DateTime, nullable=True)  # Last `sharesphere rebuild-stats`
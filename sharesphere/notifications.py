@@ -0,0 +1,117 @@
+# sharesphere/notifications.py
+
+from .background import BatchWriter
+from .database import SessionLocal
+from .models import Notification
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = 2.0
+MAX_BATCH = 500
+
+def _write_notifications(events):
+    """
+    Coalesce buffered events per (user, kind, file, day) and upsert them in
+    one transaction, adding to the count of any notification already stored.
+    """
+    coalesced = {}
+    for event in events:
+        key = (event["user_id"], event["kind"], event["file_id"], event["at"].date())
+        row = coalesced.get(key)
+        if row is None:
+            coalesced[key] = {
+                "user_id": event["user_id"],
+                "kind": event["kind"],
+                "file_id": event["file_id"],
+                "day": event["at"].date(),
+                "filename": event["filename"],
+                "last_actor": event["actor"],
+                "count": 1,
+                "is_read": False,
+                "created_at": event["at"],
+                "updated_at": event["at"],
+            }
+        else:
+            row["count"] += 1
+            row["last_actor"] = event["actor"]
+            row["updated_at"] = event["at"]
+
+    stmt = sqlite_insert(Notification.__table__).values(list(coalesced.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "kind", "file_id", "day"],
+        set_={
+            "count": Notification.__table__.c.count + stmt.excluded.count,
+            "filename": stmt.excluded.filename,
+            "last_actor": stmt.excluded.last_actor,
+            "is_read": False,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+        logger.debug(f"Stored {len(events)} notification event(s) as {len(coalesced)} row(s).")
+    finally:
+        db.close()
+
+_writer = BatchWriter("notification-writer", _write_notifications, FLUSH_INTERVAL_SECONDS, MAX_BATCH)
+
+def notify_download(owner_id: int, downloader_id: int, downloader_name: str, file_id: int, filename: str):
+    """Queue a 'your file was downloaded' notification for the file owner. Does no database I/O."""
+    if owner_id is None or owner_id == downloader_id:
+        return
+    _writer.put({
+        "user_id": owner_id,
+        "kind": "download",
+        "file_id": file_id,
+        "filename": filename,
+        "actor": downloader_name,
+        "at": datetime.utcnow(),
+    })
+
+def flush_notifications():
+    _writer.flush()
+
+def unread_count(user_id: int) -> int:
+    db = SessionLocal()
+    total = db.query(func.count(Notification.id)).filter(
+        Notification.user_id == user_id, Notification.is_read == False
+    ).scalar()
+    db.close()
+    return total
+
+def list_notifications(user_id: int, limit: int = 50):
+    db = SessionLocal()
+    notifications = (
+        db.query(Notification)
+        .filter(Notification.user_id == user_id)
+        .order_by(Notification.updated_at.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return notifications
+
+def mark_all_read(user_id: int):
+    db = SessionLocal()
+    db.query(Notification).filter(
+        Notification.user_id == user_id, Notification.is_read == False
+    ).update({Notification.is_read: True}, synchronize_session=False)
+    db.commit()
+    db.close()
+
+def format_notification(notification) -> str:
+    if notification.kind == "download":
+        if notification.count == 1:
+            return f"📣 Your file '{notification.filename}' was downloaded by {notification.last_actor}."
+        when = "today" if notification.day == datetime.utcnow().date() else f"on {notification.day:%Y-%m-%d}"
+        return (
+            f"📣 Your file '{notification.filename}' was downloaded {notification.count} times {when} "
+            f"(most recently by {notification.last_actor})."
+        )
+    return f"📣 {notification.kind}: {notification.filename}"
@@ -0,0 +1,180 @@
+# sharesphere/processing.py
+
+"""
+Post-upload processing steps, run by `sharesphere worker` as background jobs.
+
+Every handler takes a payload of the form {"file_id": ...}, recomputes its
+result from the bytes on disk and overwrites the stored value, so running a
+job twice is harmless.
+"""
+
+from .database import SessionLocal
+from .encryption import open_file
+from .file_manager import iter_file, upload_settings, write_stream
+from .jobs import job_handler
+from .models import File
+from .versioning import store_version_chunks
+from . import stats
+from pathlib import Path
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+
+logger = logging.getLogger(__name__)
+
+SNIFF_BYTES = 2048
+PREVIEW_SIZE = (256, 256)
+PREVIEW_FOLDER = ".previews"
+
+# Leading bytes of the binary formats ShareSphere accepts, and what they are.
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"MZ", "application/x-msdownload"),
+    (b"\x7fELF", "application/x-executable"),
+]
+
+# Content types each extension may legitimately contain.
+EXTENSION_TYPES = {
+    "png": {"image/png"},
+    "jpg": {"image/jpeg"},
+    "jpeg": {"image/jpeg"},
+    "gif": {"image/gif"},
+    "pdf": {"application/pdf"},
+    "txt": {"text/plain"},
+    "docx": {"application/zip"},
+    "xlsx": {"application/zip"},
+    "pptx": {"application/zip"},
+}
+
+def sniff_type(head: bytes) -> str:
+    """Guess the content type of a file from its first bytes."""
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character may be cut off at the end of the sample
+        if e.start < len(head) - 3:
+            return "application/octet-stream"
+    return "text/plain"
+
+def _load_file(file_id: int):
+    db = SessionLocal()
+    file = db.query(File).filter(File.id == file_id).first()
+    db.close()
+    if file is None:
+        logger.info(f"Skipping job for file ID {file_id}: the file no longer exists.")
+    elif file.archived_at is not None:
+        logger.info(f"Skipping job for file ID {file_id}: the file has been archived.")
+        return None
+    return file
+
+def _update_file(file_id: int, **values):
+    db = SessionLocal()
+    db.query(File).filter(File.id == file_id).update(values)
+    db.commit()
+    db.close()
+
+@job_handler("sniff_type")
+def sniff_file_type(payload: dict):
+    """Compare the content of a file with its extension and flag mismatches."""
+    file = _load_file(payload["file_id"])
+    if file is None:
+        return
+    with open_file(file.filepath) as f:
+        detected = sniff_type(f.read(SNIFF_BYTES))
+    extension = Path(file.filename).suffix.lower().lstrip(".")
+    allowed = upload_settings["allowed_extensions"]
+    warning = None
+    if allowed is not None and extension not in allowed:
+        warning = f"Extension '.{extension}' is no longer allowed."
+    elif extension in EXTENSION_TYPES and detected not in EXTENSION_TYPES[extension]:
+        warning = f"Content looks like {detected}, not a .{extension} file."
+    if warning:
+        logger.warning(f"File ID {file.id} ('{file.filename}'): {warning}")
+    _update_file(file.id, content_warning=warning)
+
+@job_handler("checksum")
+def checksum_file(payload: dict):
+    """Store the SHA-256 digest and size of a file."""
+    file = _load_file(payload["file_id"])
+    if file is None:
+        return
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter_file(file.filepath):
+        digest.update(chunk)
+        size += len(chunk)
+    db = SessionLocal()
+    row = db.query(File.owner_id, File.size, File.deleted_at).filter(File.id == file.id).first()
+    if row is not None:
+        db.query(File).filter(File.id == file.id).update({"checksum": digest.hexdigest(), "size": size})
+        if row.size != size:
+            field = "trashed_bytes" if row.deleted_at else "bytes"
+            stats.apply_file_deltas(db, {row.owner_id: {field: size - (row.size or 0)}})
+        db.commit()
+    db.close()
+
+def _image_size(file_path):
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with open_file(file_path) as f, Image.open(f) as image:
+            return image.size
+    except Image.UnidentifiedImageError:
+        return None
+
+@job_handler("metadata")
+def extract_metadata(payload: dict):
+    """Store the MIME type of a file and, for images, their dimensions."""
+    file = _load_file(payload["file_id"])
+    if file is None:
+        return
+    mime_type = mimetypes.guess_type(file.filename)[0] or "application/octet-stream"
+    metadata = {}
+    if mime_type.startswith("image/"):
+        dimensions = _image_size(file.filepath)
+        if dimensions:
+            metadata["width"], metadata["height"] = dimensions
+    _update_file(file.id, mime_type=mime_type, file_metadata=json.dumps(metadata))
+
+@job_handler("preview")
+def generate_preview(payload: dict):
+    """Write a thumbnail for image files. Requires Pillow; other files are skipped."""
+    file = _load_file(payload["file_id"])
+    if file is None or (mimetypes.guess_type(file.filename)[0] or "").split("/")[0] != "image":
+        return
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.debug("Pillow is not installed; skipping preview generation.")
+        return
+    preview_folder = Path(upload_settings["folder"]) / PREVIEW_FOLDER
+    preview_folder.mkdir(parents=True, exist_ok=True)
+    preview_path = preview_folder / f"{file.id}.png"
+    thumbnail = io.BytesIO()
+    try:
+        with open_file(file.filepath) as f, Image.open(f) as image:
+            image.thumbnail(PREVIEW_SIZE)
+            image.save(thumbnail, format="PNG")
+    except Image.UnidentifiedImageError:
+        logger.warning(f"File ID {file.id} ('{file.filename}') is not a readable image; no preview generated.")
+        return
+    # Written like an upload, so the thumbnail is encrypted too when encryption is enabled
+    write_stream(preview_path, [thumbnail.getvalue()], replace=True)
+    _update_file(file.id, preview_path=str(preview_path))
+
+@job_handler("chunk_version")
+def chunk_version(payload: dict):
+    """Store a new version in the chunk store so it can be restored later."""
+    store_version_chunks(payload["version_id"])
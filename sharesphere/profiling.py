@@ -0,0 +1,246 @@
+# sharesphere/profiling.py
+
+"""
+Sampling profiler for Streamlit reruns (`sharesphere start --profile`, or
+`profiling.enabled`, which the admin panel toggles at runtime).
+
+While profiling is on, `profile_rerun` wraps each rerun of the app script.
+One sampler thread per process reads the stacks of the threads that are
+running a rerun every `profiling.interval_ms`, using sys._current_frames().
+The profiled code is never traced, so the overhead is the sampler's own work
+and does not grow with the number of calls. With `profiling.tracemalloc`,
+allocations are traced too. A rerun then also records its peak traced memory
+and the allocations it left behind.
+
+For each page, the `profiling.keep` slowest reruns are saved under
+`profiling.folder/<page>/`. Each rerun has a JSON summary, its stacks in
+collapsed format (one "frame;frame;... count" line per stack, as read by
+flamegraph.pl, speedscope and inferno), and a tracemalloc snapshot that
+`tracemalloc.Snapshot.load` can open.
+"""
+
+from .config import get_config_service
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENV = "SHARESPHERE_PROFILE"
+TOP_ALLOCATIONS = 25
+
+# Profiling settings, refreshed by the config service whenever config.yaml changes
+profiler_settings = {
+    "enabled": False,
+    "interval_ms": 10,
+    "folder": "profiles",
+    "keep": 20,
+    "tracemalloc": True,
+    "tracemalloc_frames": 1,
+}
+_started_tracemalloc = False  # Only tracing started here is stopped here; PYTHONTRACEMALLOC is left alone
+
+def _apply_profiler_settings(config):
+    global _started_tracemalloc
+    settings = config.get("profiling", {}) or {}
+    for key in profiler_settings:
+        if key in settings:
+            profiler_settings[key] = settings[key]
+    # Allocation tracing slows every allocation, so it stops as soon as profiling is switched off
+    if _started_tracemalloc and not (profiling_enabled() and profiler_settings["tracemalloc"]):
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+def forced() -> bool:
+    """True if the process was started with `sharesphere start --profile`."""
+    return os.getenv(PROFILE_ENV) == "1"
+
+def profiling_enabled() -> bool:
+    return forced() or bool(profiler_settings["enabled"])
+
+get_config_service().subscribe("profiling.profiler_settings", _apply_profiler_settings)
+
+def _frame_name(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(";", ":").replace(" ", "_")
+
+class _Recording:
+    def __init__(self, root):
+        self.root = root
+        self.stacks = Counter()
+
+class Sampler:
+    """Samples the stacks of registered threads from a background thread; use the module-level `sampler`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recordings = {}  # thread ID -> _Recording
+        self._thread = None
+
+    def add(self, thread_id: int, root) -> _Recording:
+        """Start sampling `thread_id`, keeping frames from `root` (a frame of that thread) inwards."""
+        recording = _Recording(root)
+        with self._lock:
+            self._recordings[thread_id] = recording
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+                self._thread.start()
+        return recording
+
+    def remove(self, thread_id: int):
+        with self._lock:
+            self._recordings.pop(thread_id, None)
+
+    def _sample(self, recordings: dict):
+        frames = sys._current_frames()
+        for thread_id, recording in recordings.items():
+            frame = frames.get(thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                if frame is recording.root:
+                    break
+                frame = frame.f_back
+            if names:
+                recording.stacks[";".join(reversed(names))] += 1
+
+    def _run(self):
+        while True:
+            time.sleep(max(float(profiler_settings["interval_ms"]), 1.0) / 1000)
+            with self._lock:
+                recordings = dict(self._recordings)
+                if not recordings:
+                    self._thread = None
+                    return
+            self._sample(recordings)
+
+sampler = Sampler()
+
+# === Saved profiles ===
+
+def profiles_folder() -> Path:
+    return Path(profiler_settings["folder"])
+
+def _slug(page: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "-", page).strip("-").lower() or "page"
+
+def _allocations(snapshot) -> list:
+    """Return the top allocations a rerun left behind, as (location, KiB, count) lists."""
+    return [
+        [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", round(stat.size / 1024, 1), stat.count]
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+    ]
+
+def _is_kept(duration_ms: float, existing: list) -> bool:
+    """Whether a rerun taking `duration_ms` is among the slowest `keep` next to the saved `existing` ones."""
+    keep = int(profiler_settings["keep"])
+    return len(existing) < keep or duration_ms > existing[keep - 1]["duration_ms"]
+
+def _save(page: str, summary: dict, stacks: Counter, snapshot, existing: list):
+    folder = profiles_folder() / _slug(page)
+    keep = int(profiler_settings["keep"])
+    folder.mkdir(parents=True, exist_ok=True)
+    name = f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{os.getpid()}"
+    summary["id"] = f"{_slug(page)}/{name}"
+    with open(folder / f"{name}.collapsed", "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    if snapshot is not None:
+        snapshot.dump(str(folder / f"{name}.tracemalloc"))
+    with open(folder / f"{name}.json", "w") as f:
+        json.dump(summary, f)
+    for stale in sorted(existing + [summary], key=lambda profile: -profile["duration_ms"])[keep:]:
+        remove_profile(stale["id"])
+
+def list_profiles(page: str = None, limit: int = None) -> list:
+    """Return saved rerun summaries, slowest first; only `page`'s if given."""
+    folders = [profiles_folder() / _slug(page)] if page else [path for path in profiles_folder().glob("*") if path.is_dir()]
+    profiles = []
+    for folder in folders:
+        for path in folder.glob("*.json"):
+            try:
+                with open(path) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Being written or pruned by another process
+    profiles.sort(key=lambda profile: -profile["duration_ms"])
+    return profiles[:limit] if limit else profiles
+
+def profile_path(profile_id: str, suffix: str) -> Path:
+    """Return the file of a saved rerun with `suffix` (".collapsed", ".tracemalloc" or ".json")."""
+    folder, name = profile_id.split("/", 1)
+    return profiles_folder() / _slug(folder) / f"{Path(name).name}{suffix}"
+
+def remove_profile(profile_id: str):
+    for suffix in (".json", ".collapsed", ".tracemalloc"):
+        try:
+            profile_path(profile_id, suffix).unlink()
+        except FileNotFoundError:
+            pass
+
+def clear_profiles() -> int:
+    profiles = list_profiles()
+    for profile in profiles:
+        remove_profile(profile["id"])
+    return len(profiles)
+
+# === Rerun wrapper ===
+
+@contextmanager
+def profile_rerun(page):
+    """
+    Profile the code in the `with` block as one rerun, if profiling is enabled.
+
+    Args:
+        page: Page name, or a callable returning it once the rerun finished
+            (the page is often only known after the navigation widget ran).
+    """
+    global _started_tracemalloc
+    if not profiling_enabled():
+        yield
+        return
+    use_tracemalloc = bool(profiler_settings["tracemalloc"])
+    if use_tracemalloc:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(int(profiler_settings["tracemalloc_frames"]))
+            _started_tracemalloc = True
+        # Forgetting older allocations leaves the end snapshot with only what this rerun kept alive,
+        # far cheaper than diffing two snapshots of the whole heap. Reruns of other sessions overlapping
+        # this one share the traces and the peak, so treat both as approximate under concurrent use.
+        tracemalloc.clear_traces()
+    thread_id = threading.get_ident()
+    recording = sampler.add(thread_id, sys._getframe(2))
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        sampler.remove(thread_id)
+        try:
+            page_name = page() if callable(page) else page
+            existing = list_profiles(page_name)
+            # Only the slowest reruns are kept, so most fast reruns never snapshot the heap or touch the disk
+            if _is_kept(duration_ms, existing):
+                summary = {
+                    "page": page_name, "started_at": started_at.isoformat(timespec="seconds"), "pid": os.getpid(),
+                    "duration_ms": round(duration_ms, 1), "samples": sum(recording.stacks.values()),
+                    "interval_ms": profiler_settings["interval_ms"],
+                }
+                snapshot = None
+                if use_tracemalloc and tracemalloc.is_tracing():
+                    summary["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+                    snapshot = tracemalloc.take_snapshot()
+                    summary["allocations"] = _allocations(snapshot)
+                _save(page_name, summary, recording.stacks, snapshot, existing)
+        except Exception as e:
+            logger.error(f"Could not save the profile of a rerun: {e}")
@@ -0,0 +1,547 @@
+# sharesphere/querybudget.py
+
+"""
+SQL statement budgets for the public functions of file_manager, auth and
+admin (`sharesphere query-budget`).
+
+Each budgeted operation is run against seeded datasets of several sizes,
+and operations on several items (uploads, recipients, requests) at each of
+BATCH_SIZES, while a SQLAlchemy `before_cursor_execute` listener counts the
+statements it issues. An operation fails when it exceeds its budget or when
+its count changes with the size of the data or of the batch, which is how a
+query per row or per item (N+1) or a lazy load of a whole collection shows up.
+
+Budgets are registered with `@query_budget(name, budget)` on a setup
+function that receives the Fixture and returns the call to measure; setups
+size their batches with `fixture.batch`. Work done in the setup function is
+not counted. Public functions that never
+touch the database are listed in NO_DATABASE, and `uncovered_functions`
+reports any public function that is in neither place.
+"""
+
+from .loadtest import LOADTEST_PASSWORD, LOADTEST_USER, seed_dataset, write_workspace
+from datetime import datetime, timedelta
+from pathlib import Path
+import inspect
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+DEFAULT_SIZES = (20, 200)
+# Items per batch operation; each dataset is measured at every one of these
+BATCH_SIZES = (2, 5)
+MODULES = ("sharesphere.file_manager", "sharesphere.auth", "sharesphere.admin")
+# Public functions that do not run SQL, keyed by module.
+NO_DATABASE = {
+    "sharesphere.file_manager": {"check_upload_allowed", "safe_filename", "upload_path", "name_candidates", "write_stream", "write_upload",
+                                 "iter_file", "file_size", "trash_retention_days", "discard_uploads"},
+    "sharesphere.auth": {"bcrypt_rounds", "hash_password", "hash_cost"},
+    "sharesphere.admin": {"get_system_logs", "update_config", "group_request_retention_days"},
+}
+RESULT_MARKER = "QUERY-BUDGET-RESULT "
+
+# name -> (budget, setup function)
+BUDGETS = {}
+
+def query_budget(name: str, budget: int):
+    """Register `setup(fixture) -> callable` as the measured operation `name` with at most `budget` statements."""
+    def decorator(setup):
+        BUDGETS[name] = (budget, setup)
+        return setup
+    return decorator
+
+class QueryCounter:
+    """Context manager recording every SQL statement the engine executes, from any thread."""
+
+    def __init__(self, engine=None):
+        from .database import get_engine
+
+        self.engine = engine or get_engine()
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        from sqlalchemy import event
+
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        from sqlalchemy import event
+
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+class _UploadedFile(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile."""
+
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+class Fixture:
+    """
+    IDs from the seeded dataset and helpers that create fresh objects for
+    operations that change data. Batch operations work on `batch` items,
+    and `other_user_ids` holds `batch` users besides the fixture's own.
+    """
+
+    def __init__(self, batch: int = BATCH_SIZES[0]):
+        from sqlalchemy import insert
+        from .database import SessionLocal
+        from .models import File, Group, GroupRequest, User
+
+        self.batch = batch
+        db = SessionLocal()
+        users = db.query(User.id, User.username).order_by(User.id).all()
+        if len(users) < batch + 2:
+            # Small datasets have fewer users than the larger batches need
+            db.execute(insert(User), [
+                {"username": f"budget-extra-{i}", "hashed_password": "", "is_admin": False}
+                for i in range(len(users), batch + 2)
+            ])
+            db.commit()
+            users = db.query(User.id, User.username).order_by(User.id).all()
+        self.admin_id = users[0].id
+        self.user_id, self.username = users[1].id, users[1].username
+        self.other_user_ids = [user.id for user in users[2:2 + batch]]
+        groups = db.query(Group.id, Group.name).order_by(Group.id).all()
+        self.group_ids = [group.id for group in groups]
+        self.group_names = [group.name for group in groups]
+        self.pending_request_ids = [
+            row.id for row in db.query(GroupRequest.id).filter(GroupRequest.status == "pending").order_by(GroupRequest.id)
+        ]
+        self.file_id = db.query(File.id).filter(File.owner_id == self.user_id).order_by(File.id).first().id
+        db.close()
+        self._counter = 0
+
+    def unique(self, prefix: str) -> str:
+        self._counter += 1
+        return f"{prefix}-{self.batch}-{self._counter}"
+
+    def write_upload(self, name: str = None, owner: str = None) -> tuple:
+        from .file_manager import upload_path, write_stream
+
+        name = name or self.unique("budget") + ".txt"
+        path = write_stream(upload_path(owner or self.username, name), [b"query budget\n" * 16])
+        return name, path
+
+    def new_group_requests(self, count: int, group_id: int = None) -> list:
+        from .database import SessionLocal
+        from .models import GroupRequest
+
+        db = SessionLocal()
+        requests = [GroupRequest(user_id=self.other_user_ids[i % len(self.other_user_ids)], group_id=group_id or self.group_ids[-1])
+                    for i in range(count)]
+        db.add_all(requests)
+        db.commit()
+        request_ids = [request.id for request in requests]
+        db.close()
+        return request_ids
+
+    def new_file(self, owner_id: int = None, owner: str = None, **options) -> int:
+        from .file_manager import register_file
+
+        name, path = self.write_upload(owner=owner)
+        return register_file(owner_id or self.user_id, name, path, "Budget fixture", **options)
+
+# === auth ===
+
+@query_budget("auth.get_user_by_username", 1)
+def _get_user_by_username(fixture):
+    from .auth import get_user_by_username
+    return lambda: get_user_by_username(LOADTEST_USER)
+
+@query_budget("auth.create_user", 3)
+def _create_user(fixture):
+    from .auth import create_user
+    return lambda: create_user(fixture.unique("budget-user"), "password")
+
+@query_budget("auth.authenticate_user", 1)
+def _authenticate_user(fixture):
+    from .auth import authenticate_user
+    return lambda: authenticate_user(LOADTEST_USER, LOADTEST_PASSWORD)
+
+@query_budget("auth.update_user_password", 2)
+def _update_user_password(fixture):
+    from .auth import update_user_password
+    return lambda: update_user_password(fixture.user_id, LOADTEST_PASSWORD)
+
+@query_budget("auth.create_api_token", 1)
+def _create_api_token(fixture):
+    from .auth import create_api_token
+    return lambda: create_api_token(fixture.user_id, "budget")
+
+@query_budget("auth.get_user_by_api_token", 1)
+def _get_user_by_api_token(fixture):
+    from .auth import create_api_token, get_user_by_api_token
+    token = create_api_token(fixture.user_id, "budget")
+    return lambda: get_user_by_api_token(token)
+
+@query_budget("auth.list_api_tokens", 1)
+def _list_api_tokens(fixture):
+    from .auth import list_api_tokens
+    return lambda: list_api_tokens(fixture.user_id)
+
+@query_budget("auth.revoke_api_token", 1)
+def _revoke_api_token(fixture):
+    from .auth import create_api_token, list_api_tokens, revoke_api_token
+    create_api_token(fixture.user_id, "budget")
+    token_id = list_api_tokens(fixture.user_id)[-1].id
+    return lambda: revoke_api_token(token_id, fixture.user_id)
+
+# === admin ===
+
+@query_budget("admin.list_users", 1)
+def _list_users(fixture):
+    from .admin import list_users
+    return list_users
+
+@query_budget("admin.count_users", 1)
+def _count_users(fixture):
+    from .admin import count_users
+    return count_users
+
+@query_budget("admin.list_users_page", 1)
+def _list_users_page(fixture):
+    from .admin import list_users_page
+    return list_users_page
+
+@query_budget("admin.count_files", 1)
+def _count_files(fixture):
+    from .admin import count_files
+    return lambda: count_files(owner=fixture.username)
+
+@query_budget("admin.list_files_page", 1)
+def _list_files_page(fixture):
+    from .admin import list_files_page
+    return lambda: list_files_page(owner=fixture.username)
+
+@query_budget("admin.search_files", 1)
+def _search_files(fixture):
+    from .admin import search_files
+    return lambda: search_files("file")
+
+@query_budget("admin.create_new_user", 8)
+def _create_new_user(fixture):
+    from .admin import create_new_user
+    return lambda: create_new_user(fixture.unique("budget-user"), "password", False, fixture.group_names[:2])
+
+@query_budget("admin.delete_user", 26)
+def _delete_user(fixture):
+    from .admin import delete_user
+    from .auth import create_user
+    username = fixture.unique("budget-user")
+    user = create_user(username, "password")
+    for _ in range(fixture.batch):
+        fixture.new_file(user.id, username, shared_users=fixture.other_user_ids)
+    return lambda: delete_user(user.id)
+
+@query_budget("admin.reset_user_password", 2)
+def _reset_user_password(fixture):
+    from .admin import reset_user_password
+    return lambda: reset_user_password(fixture.user_id, LOADTEST_PASSWORD)
+
+@query_budget("admin.list_groups", 1)
+def _list_groups(fixture):
+    from .admin import list_groups
+    return list_groups
+
+@query_budget("admin.list_user_groups", 1)
+def _list_user_groups(fixture):
+    from .admin import list_user_groups
+    return lambda: list_user_groups(fixture.admin_id)
+
+@query_budget("admin.list_group_members", 1)
+def _list_group_members(fixture):
+    from .admin import list_group_members
+    return lambda: list_group_members(fixture.group_ids[0])
+
+@query_budget("admin.count_groups", 1)
+def _count_groups(fixture):
+    from .admin import count_groups
+    return count_groups
+
+@query_budget("admin.list_groups_page", 1)
+def _list_groups_page(fixture):
+    from .admin import list_groups_page
+    return list_groups_page
+
+@query_budget("admin.create_new_group", 6)
+def _create_new_group(fixture):
+    from .admin import create_new_group
+    return lambda: create_new_group(fixture.unique("budget-group"))
+
+@query_budget("admin.set_group_parent", 9)
+def _set_group_parent(fixture):
+    from .admin import create_new_group, set_group_parent
+    group = create_new_group(fixture.unique("budget-group"), fixture.group_ids[0])
+    return lambda: set_group_parent(group.id, fixture.group_ids[-1])
+
+@query_budget("admin.list_group_requests", 1)
+def _list_group_requests(fixture):
+    from .admin import list_group_requests
+    return list_group_requests
+
+@query_budget("admin.count_group_requests", 1)
+def _count_group_requests(fixture):
+    from .admin import count_group_requests
+    return lambda: count_group_requests("pending")
+
+@query_budget("admin.list_group_requests_page", 1)
+def _list_group_requests_page(fixture):
+    from .admin import list_group_requests_page
+    return lambda: list_group_requests_page(status="pending")
+
+@query_budget("admin.approve_group_request", 2)
+def _approve_group_request(fixture):
+    from .admin import approve_group_request
+    return lambda: approve_group_request(fixture.pending_request_ids.pop())
+
+@query_budget("admin.reject_group_request", 1)
+def _reject_group_request(fixture):
+    from .admin import reject_group_request
+    return lambda: reject_group_request(fixture.pending_request_ids.pop())
+
+@query_budget("admin.approve_group_requests", 5)
+def _approve_group_requests(fixture):
+    from .admin import approve_group_requests, create_new_group
+    # A subgroup nobody is in yet, so every approval adds a membership that reaches its parent too
+    group = create_new_group(f"budget-{len(fixture.group_ids)}", fixture.group_ids[0])
+    request_ids = fixture.new_group_requests(fixture.batch, group.id)
+    return lambda: approve_group_requests(request_ids)
+
+@query_budget("admin.reject_group_requests", 1)
+def _reject_group_requests(fixture):
+    from .admin import reject_group_requests
+    request_ids = fixture.new_group_requests(fixture.batch)
+    return lambda: reject_group_requests(request_ids)
+
+@query_budget("admin.archive_group_requests", 4)
+def _archive_group_requests(fixture):
+    from .admin import archive_group_requests
+    return lambda: archive_group_requests(retention_days=0)
+
+# === file_manager ===
+
+@query_budget("file_manager.register_files", 11)
+def _register_files(fixture):
+    from .file_manager import register_files
+    uploads = [fixture.write_upload() for _ in range(fixture.batch)]
+    return lambda: register_files(fixture.user_id, uploads, "Budget", False, fixture.other_user_ids, fixture.group_ids[:2])
+
+@query_budget("file_manager.register_files:new_versions", 16)
+def _register_new_versions(fixture):
+    from .file_manager import register_files
+    names = [fixture.write_upload()[0] for _ in range(fixture.batch)]
+    register_files(fixture.user_id, [(name, path) for name, path in
+                                     (fixture.write_upload(name) for name in names)], "Budget")
+    # Half the outgoing versions already chunked, so both ways of handing over a working copy are taken
+    chunk_current_versions(fixture.user_id, names[:len(names) // 2])
+    uploads = [fixture.write_upload(name) for name in names]
+    return lambda: register_files(fixture.user_id, uploads, "Budget", False, fixture.other_user_ids, fixture.group_ids[:2])
+
+@query_budget("file_manager.register_file", 11)
+def _register_file(fixture):
+    from .file_manager import register_file
+    name, path = fixture.write_upload()
+    return lambda: register_file(fixture.user_id, name, path, "Budget", False, fixture.other_user_ids, fixture.group_ids[:2])
+
+@query_budget("file_manager.upload_file", 10)
+def _upload_file(fixture):
+    from .file_manager import upload_file
+    upload = _UploadedFile(fixture.unique("budget") + ".txt", b"query budget\n")
+    return lambda: upload_file(fixture.user_id, fixture.username, upload, "Budget", False, [], fixture.group_ids[:2])
+
+@query_budget("file_manager.upload_files", 10)
+def _upload_files(fixture):
+    from .file_manager import upload_files
+    uploads = [_UploadedFile(fixture.unique("budget") + ".txt", b"query budget\n") for _ in range(fixture.batch)]
+    return lambda: upload_files(fixture.user_id, fixture.username, uploads, "Budget", False, fixture.other_user_ids, [])
+
+@query_budget("file_manager.share_file", 7)
+def _share_file(fixture):
+    from .file_manager import share_file
+    file_id = fixture.new_file()
+    return lambda: share_file(file_id, fixture.user_id, fixture.other_user_ids, fixture.group_ids[:2])
+
+@query_budget("file_manager.count_accessible_files", 1)
+def _count_accessible_files(fixture):
+    from .file_manager import count_accessible_files
+    return lambda: count_accessible_files(fixture.admin_id)
+
+@query_budget("file_manager.list_accessible_files", 1)
+def _list_accessible_files(fixture):
+    from .file_manager import list_accessible_files
+    return lambda: list_accessible_files(fixture.admin_id)
+
+@query_budget("file_manager.get_accessible_file", 1)
+def _get_accessible_file(fixture):
+    from .file_manager import get_accessible_file
+    return lambda: get_accessible_file(fixture.file_id, fixture.user_id)
+
+@query_budget("file_manager.get_shared_files", 2)
+def _get_shared_files(fixture):
+    from .file_manager import get_shared_files
+    return lambda: get_shared_files(fixture.admin_id)
+
+@query_budget("file_manager.delete_file", 5)
+def _delete_file(fixture):
+    from .file_manager import delete_file
+    file_id = fixture.new_file()
+    return lambda: delete_file(file_id, fixture.user_id)
+
+@query_budget("file_manager.restore_file", 5)
+def _restore_file(fixture):
+    from .file_manager import delete_file, restore_file
+    file_id = fixture.new_file()
+    delete_file(file_id, fixture.user_id)
+    return lambda: restore_file(file_id, fixture.user_id)
+
+@query_budget("file_manager.list_trash", 1)
+def _list_trash(fixture):
+    from .file_manager import list_trash
+    return lambda: list_trash(fixture.user_id)
+
+@query_budget("file_manager.restore_version", 12)
+def _restore_version(fixture):
+    from .file_manager import register_file, restore_version
+    from .versioning import ensure_chunked
+    name, path = fixture.write_upload()
+    file_id = register_file(fixture.user_id, name, path, "Budget")
+    ensure_chunked(file_id)
+    _, new_path = fixture.write_upload(name)
+    register_file(fixture.user_id, name, new_path, "Budget")
+    return lambda: restore_version(file_id, 1, fixture.user_id)
+
+@query_budget("file_manager.purge_deleted_files", 16)
+def _purge_deleted_files(fixture):
+    from .file_manager import delete_file, purge_deleted_files
+    for _ in range(fixture.batch):
+        delete_file(fixture.new_file(shared_users=fixture.other_user_ids), fixture.user_id)
+    return lambda: purge_deleted_files(retention_days=0)
+
+@query_budget("file_manager.sweep_expired", 21)
+def _sweep_expired(fixture):
+    from .database import SessionLocal
+    from .file_manager import sweep_expired
+    from .models import File, FileSharing
+    file_ids = [fixture.new_file(shared_users=fixture.other_user_ids) for _ in range(fixture.batch + 1)]
+    past = datetime.utcnow() - timedelta(minutes=1)
+    db = SessionLocal()
+    db.query(File).filter(File.id.in_(file_ids[:-1])).update({"expires_at": past}, synchronize_session=False)
+    db.query(FileSharing).filter(FileSharing.file_id == file_ids[-1]).update({"expires_at": past}, synchronize_session=False)
+    db.commit()
+    db.close()
+    return sweep_expired
+
+def uncovered_functions() -> list:
+    """Return "module.function" for public functions with neither a budget nor a NO_DATABASE entry."""
+    import importlib
+
+    missing = []
+    for module_name in MODULES:
+        module = importlib.import_module(module_name)
+        short_name = module_name.rsplit(".", 1)[1]
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if name.startswith("_") or function.__module__ != module_name:
+                continue
+            if f"{short_name}.{name}" not in BUDGETS and name not in NO_DATABASE.get(module_name, set()):
+                missing.append(f"{short_name}.{name}")
+    return missing
+
+def chunk_current_versions(owner_id: int, filenames: list):
+    """Store the current versions of some of a user's files, as the chunk_version job would."""
+    from .database import SessionLocal
+    from .models import File
+    from .versioning import ensure_chunked
+
+    db = SessionLocal()
+    file_ids = [file_id for (file_id,) in db.query(File.id).filter(File.owner_id == owner_id, File.filename.in_(filenames))]
+    db.close()
+    for file_id in file_ids:
+        ensure_chunked(file_id)
+
+def measure_budgets(names: list = None, batch: int = BATCH_SIZES[0]) -> dict:
+    """Run the budgeted operations against the current database and return {name: statement count}."""
+    from .database import get_engine
+
+    engine = get_engine()
+    fixture = Fixture(batch)
+    counts = {}
+    for name in names or BUDGETS:
+        _, setup = BUDGETS[name]
+        operation = setup(fixture)
+        with QueryCounter(engine) as counter:
+            operation()
+        counts[name] = counter.count
+    return counts
+
+def _run_child(size: int):
+    """Entry point of the per-dataset interpreter; prints the counts as one marked JSON line."""
+    from .database import init_db
+
+    init_db()
+    seed_dataset(size)
+    counts = {batch: measure_budgets(batch=batch) for batch in BATCH_SIZES}
+    print(RESULT_MARKER + json.dumps(counts), flush=True)
+
+def run_dataset(size: int, workspace) -> dict:
+    """
+    Seed a fresh workspace with `size` files and measure every budget at each
+    of BATCH_SIZES in a separate interpreter.
+
+    Returns:
+        dict: {batch size: {name: statement count}}.
+    """
+    folder = write_workspace(workspace)
+    package_parent = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent, env.get("PYTHONPATH")]))
+    env.pop("SHARESPHERE_CONFIG_PATH", None)
+    code = f"import sharesphere.querybudget as querybudget; querybudget._run_child({size!r})"
+    result = subprocess.run([sys.executable, "-c", code], cwd=folder, env=env, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return {int(batch): counts for batch, counts in json.loads(line[len(RESULT_MARKER):]).items()}
+    raise RuntimeError(f"Query budget run for {size} files failed:\n{result.stderr[-4000:]}")
+
+def check_query_budgets(sizes=DEFAULT_SIZES, workspace=None, echo=print) -> list:
+    """
+    Measure every budget at each dataset size and batch size.
+
+    Returns:
+        list: Human-readable failures; empty when every operation is within
+        budget, issues the same number of statements at every dataset and
+        batch size, and every public function is covered.
+    """
+    failures = [f"{name} has no query budget and is not listed in NO_DATABASE." for name in uncovered_functions()]
+    counts = {}
+    with tempfile.TemporaryDirectory(prefix="sharesphere-querybudget-") as scratch:
+        root = Path(workspace or scratch)
+        for size in sizes:
+            counts[size] = run_dataset(size, root / f"size-{size}")
+    runs = [(size, batch) for size in sizes for batch in BATCH_SIZES]
+    echo(f"{'operation':<44}{'budget':>8}" + "".join(f"{f'{size} files x{batch}':>16}" for size, batch in runs))
+    for name, (budget, _) in BUDGETS.items():
+        per_run = [counts[size][batch][name] for size, batch in runs]
+        echo(f"{name:<44}{budget:>8}" + "".join(f"{count:>16}" for count in per_run))
+        if max(per_run) > budget:
+            failures.append(f"{name} issued {max(per_run)} statement(s); budget is {budget}.")
+        if len(set(per_run)) > 1:
+            failures.append(f"{name} issued {', '.join(map(str, per_run))} statements at "
+                            f"{', '.join(f'{size} files x{batch}' for size, batch in runs)}; "
+                            f"the count grows with the data or the batch.")
+    return failures
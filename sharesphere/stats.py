@@ -0,0 +1,308 @@
+# sharesphere/stats.py
+
+"""
+Summary tables behind the admin dashboard: storage per user and per group,
+uploads per day and instance-wide totals.
+
+The tables are kept current incrementally. Code that adds, trashes, restores
+or removes files, shares, users, groups or memberships calls the helpers
+below inside its own transaction, so a summary changes exactly when the
+rows it describes do. Reading the dashboard touches a handful of rows
+however large the instance is. `sharesphere rebuild-stats` recomputes
+everything from the source tables, for upgrades and as a repair.
+"""
+
+from .database import SessionLocal
+from .groups import ancestor_ids, user_group_ids
+from .models import (DailyUploadStat, DashboardTotal, File, FileSharing, FileVersion, Group, GroupClosure, GroupStorageStat,
+                     User, UserStorageStat, user_group_association)
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+FILE_FIELDS = ("files", "bytes", "trashed_files", "trashed_bytes", "shares")
+TOTAL_FIELDS = ("users", "groups") + FILE_FIELDS
+
+def _add(table, key: dict, deltas: dict):
+    """INSERT ... ON CONFLICT DO UPDATE that adds `deltas` to the row identified by `key`."""
+    stmt = sqlite_insert(table.__table__).values(**key, **deltas)
+    return stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={field: getattr(table.__table__.c, field) + getattr(stmt.excluded, field) for field in deltas},
+    )
+
+def adjust_totals(db, **deltas):
+    """Add `deltas` (keyword per TOTAL_FIELDS) to the instance-wide totals."""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if deltas:
+        db.execute(_add(DashboardTotal, {"id": 1}, deltas))
+
+def apply_file_deltas(db, deltas: dict):
+    """
+    Apply changes to users' file totals, their groups' totals and the instance totals.
+
+    Args:
+        deltas (dict): owner ID -> {field: change} for fields in FILE_FIELDS.
+    """
+    totals = Counter()
+    for owner_id, changes in deltas.items():
+        changes = {field: value for field, value in changes.items() if value}
+        if not changes or owner_id is None:
+            continue
+        db.execute(_add(UserStorageStat, {"user_id": owner_id}, changes))
+        totals.update(changes)
+        group_changes = {field: changes[field] for field in ("files", "bytes") if field in changes}
+        if group_changes:
+            db.execute(
+                update(GroupStorageStat)
+                .where(GroupStorageStat.group_id.in_(user_group_ids(owner_id)))
+                .values({field: getattr(GroupStorageStat, field) + value for field, value in group_changes.items()})
+            )
+    adjust_totals(db, **totals)
+
+def forget_files(db, file_ids: list):
+    """Take the File rows `file_ids`, and their shares, out of the summaries before they are deleted."""
+    if not file_ids:
+        return
+    deltas = defaultdict(Counter)
+    rows = db.query(File.owner_id, File.deleted_at.isnot(None).label("trashed"), func.count(File.id),
+                    func.coalesce(func.sum(File.size), 0)).filter(File.id.in_(file_ids)).group_by(File.owner_id, "trashed")
+    for owner_id, trashed, count, size in rows:
+        deltas[owner_id]["trashed_files" if trashed else "files"] -= count
+        deltas[owner_id]["trashed_bytes" if trashed else "bytes"] -= size
+    shares = db.query(File.owner_id, func.count(FileSharing.id)).join(FileSharing, FileSharing.file_id == File.id).filter(
+        File.id.in_(file_ids)
+    ).group_by(File.owner_id)
+    for owner_id, count in shares:
+        deltas[owner_id]["shares"] -= count
+    apply_file_deltas(db, deltas)
+
+def forget_shares(db, file_ids: list):
+    """Count one removed sharing row for each entry of `file_ids` (the shared files' IDs)."""
+    if not file_ids:
+        return
+    per_file = Counter(file_ids)
+    deltas = defaultdict(Counter)
+    for file_id, owner_id in db.query(File.id, File.owner_id).filter(File.id.in_(list(per_file))):
+        deltas[owner_id]["shares"] -= per_file[file_id]
+    apply_file_deltas(db, deltas)
+
+def record_uploads(db, uploads: int, size: int, day=None):
+    """Count `uploads` new files or versions totalling `size` bytes on `day` (default today, UTC)."""
+    if uploads:
+        db.execute(_add(DailyUploadStat, {"day": day or datetime.utcnow().date()}, {"uploads": uploads, "bytes": size}))
+
+def _user_totals(db, user_ids) -> dict:
+    return {
+        row.user_id: row for row in db.query(UserStorageStat.user_id, UserStorageStat.files, UserStorageStat.bytes)
+        .filter(UserStorageStat.user_id.in_(list(user_ids)))
+    }
+
+def refresh_groups(db, group_ids):
+    """
+    Recompute the totals of `group_ids` from their members, direct or through
+    a subgroup, with one aggregate query.
+
+    Used where a change of memberships or of the hierarchy may overlap
+    existing memberships (a user can reach a group through several subgroups),
+    which rules out adding deltas.
+    """
+    group_ids = list(group_ids)
+    if not group_ids:
+        return
+    members = (
+        select(GroupClosure.ancestor_id.label("group_id"), user_group_association.c.user_id)
+        .join(user_group_association, user_group_association.c.group_id == GroupClosure.descendant_id)
+        .where(GroupClosure.ancestor_id.in_(group_ids))
+        .distinct()
+        .subquery()
+    )
+    totals = {
+        row.group_id: row for row in db.query(
+            members.c.group_id, func.count(members.c.user_id).label("members"),
+            func.coalesce(func.sum(UserStorageStat.files), 0).label("files"),
+            func.coalesce(func.sum(UserStorageStat.bytes), 0).label("bytes"),
+        ).outerjoin(UserStorageStat, UserStorageStat.user_id == members.c.user_id).group_by(members.c.group_id)
+    }
+    rows = []
+    for group_id in group_ids:
+        row = totals.get(group_id)
+        rows.append({"group_id": group_id, "members": row.members if row else 0,
+                     "files": row.files if row else 0, "bytes": row.bytes if row else 0})
+    stmt = sqlite_insert(GroupStorageStat.__table__)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["group_id"],
+        set_={field: getattr(stmt.excluded, field) for field in ("members", "files", "bytes")},
+    ), rows)
+
+def add_memberships(db, pairs: list):
+    """Count new (user ID, group ID) memberships, already inserted, in their groups' and ancestors' totals."""
+    group_ids = {group_id for _, group_id in pairs}
+    if group_ids:
+        refresh_groups(db, [group_id for (group_id,) in db.execute(ancestor_ids(group_ids))])
+
+def add_group(db, group_id: int):
+    """Count a new, empty group."""
+    db.execute(_add(GroupStorageStat, {"group_id": group_id}, {"members": 0, "files": 0, "bytes": 0}))
+    adjust_totals(db, groups=1)
+
+def forget_user(db, user_id: int):
+    """Drop a user's summary row and memberships before the user is deleted; call `forget_files` for their files first."""
+    # The user counts exactly once in each group reached, so subtracting is exact here
+    user = _user_totals(db, [user_id]).get(user_id)
+    db.execute(
+        update(GroupStorageStat)
+        .where(GroupStorageStat.group_id.in_(user_group_ids(user_id)))
+        .values(members=GroupStorageStat.members - 1, files=GroupStorageStat.files - (user.files if user else 0),
+                bytes=GroupStorageStat.bytes - (user.bytes if user else 0))
+    )
+    db.execute(delete(UserStorageStat).where(UserStorageStat.user_id == user_id))
+    adjust_totals(db, users=-1)
+
+# === Rebuild ===
+
+def _totals_row(db) -> dict:
+    row = db.get(DashboardTotal, 1)
+    return {field: getattr(row, field) if row else 0 for field in TOTAL_FIELDS}
+
+def rebuild_stats() -> tuple:
+    """
+    Recompute the summary tables from files, file_sharing, users, groups and
+    memberships, in one transaction. Upload history is kept, and days
+    missing from it are backfilled from file_versions.
+
+    Returns:
+        tuple: (totals before, totals after) as dicts, to show any drift.
+    """
+    db = SessionLocal()
+    try:
+        # Writing first takes SQLite's write lock, so the counts below cannot miss a concurrent change
+        for table in (UserStorageStat, GroupStorageStat):
+            db.execute(delete(table))
+        before = _totals_row(db)
+        users = defaultdict(Counter)
+        trashed = File.deleted_at.isnot(None).label("trashed")
+        for owner_id, is_trashed, count, size in db.query(
+            File.owner_id, trashed, func.count(File.id), func.coalesce(func.sum(File.size), 0)
+        ).group_by(File.owner_id, trashed):
+            users[owner_id]["trashed_files" if is_trashed else "files"] += count
+            users[owner_id]["trashed_bytes" if is_trashed else "bytes"] += size
+        for owner_id, count in db.query(File.owner_id, func.count(FileSharing.id)).join(
+            FileSharing, FileSharing.file_id == File.id
+        ).group_by(File.owner_id):
+            users[owner_id]["shares"] += count
+
+        groups = {group_id: Counter() for (group_id,) in db.query(Group.id)}
+        members = db.query(user_group_association.c.user_id, GroupClosure.ancestor_id).join(
+            GroupClosure, GroupClosure.descendant_id == user_group_association.c.group_id
+        ).distinct()
+        for user_id, group_id in members:
+            if group_id in groups:
+                counts = users.get(user_id, {})
+                groups[group_id].update({"members": 1, "files": counts.get("files", 0), "bytes": counts.get("bytes", 0)})
+
+        # Recorded days also count uploads whose files are gone since, so only days without a row are backfilled
+        recorded = {str(day) for (day,) in db.query(DailyUploadStat.day)}
+        uploads = Counter()
+        upload_bytes = Counter()
+        day = func.date(FileVersion.created_at)
+        for upload_day, count, size in db.query(day, func.count(FileVersion.id), func.coalesce(func.sum(FileVersion.size), 0)).group_by(day):
+            uploads[upload_day] += count
+            upload_bytes[upload_day] += size
+        # Files from before version history was kept have no FileVersion row
+        unversioned = ~select(FileVersion.id).where(FileVersion.file_id == File.id).exists()
+        day = func.date(File.uploaded_at)
+        for upload_day, count, size in db.query(day, func.count(File.id), func.coalesce(func.sum(File.size), 0)).filter(unversioned).group_by(day):
+            uploads[upload_day] += count
+            upload_bytes[upload_day] += size
+
+        db.execute(delete(DashboardTotal))
+        user_rows = [dict({field: 0 for field in FILE_FIELDS}, user_id=user_id, **counts)
+                     for user_id, counts in users.items() if user_id is not None]
+        if user_rows:
+            db.execute(insert(UserStorageStat), user_rows)
+        group_rows = [dict({"members": 0, "files": 0, "bytes": 0}, group_id=group_id, **counts) for group_id, counts in groups.items()]
+        if group_rows:
+            db.execute(insert(GroupStorageStat), group_rows)
+        upload_rows = [{"day": datetime.strptime(upload_day, "%Y-%m-%d").date(), "uploads": uploads[upload_day],
+                        "bytes": upload_bytes[upload_day]} for upload_day in uploads if upload_day and upload_day not in recorded]
+        if upload_rows:
+            db.execute(insert(DailyUploadStat), upload_rows)
+        totals = Counter()
+        for counts in users.values():
+            totals.update(counts)
+        after = {field: totals[field] for field in FILE_FIELDS}
+        after["users"] = db.query(func.count(User.id)).scalar()
+        after["groups"] = len(groups)
+        db.execute(insert(DashboardTotal), [dict(after, id=1, rebuilt_at=datetime.utcnow())])
+        db.commit()
+    finally:
+        db.close()
+    logger.info(f"Rebuilt dashboard statistics: {after}.")
+    return before, after
+
+def stats_built() -> bool:
+    db = SessionLocal()
+    rebuilt_at = db.query(DashboardTotal.rebuilt_at).filter(DashboardTotal.id == 1).scalar()
+    db.close()
+    return rebuilt_at is not None
+
+def ensure_stats():
+    """Build the summaries if they never were (a new or upgraded instance)."""
+    if not stats_built():
+        rebuild_stats()
+
+# === Dashboard queries ===
+
+def dashboard_totals() -> dict:
+    """Return the instance-wide totals, plus `rebuilt_at`."""
+    db = SessionLocal()
+    row = db.get(DashboardTotal, 1)
+    db.close()
+    totals = {field: getattr(row, field) if row else 0 for field in TOTAL_FIELDS}
+    totals["rebuilt_at"] = row.rebuilt_at if row else None
+    return totals
+
+def top_users_by_storage(limit: int = 10):
+    """Return (user_id, username, files, bytes, trashed_bytes, shares) rows of the users storing the most."""
+    db = SessionLocal()
+    rows = (
+        db.query(UserStorageStat.user_id, User.username, UserStorageStat.files, UserStorageStat.bytes,
+                 UserStorageStat.trashed_bytes, UserStorageStat.shares)
+        .outerjoin(User, User.id == UserStorageStat.user_id)
+        .order_by(UserStorageStat.bytes.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return rows
+
+def top_groups_by_storage(limit: int = 10):
+    """Return (group_id, name, members, files, bytes) rows of the groups whose members store the most."""
+    db = SessionLocal()
+    rows = (
+        db.query(GroupStorageStat.group_id, Group.name, GroupStorageStat.members, GroupStorageStat.files, GroupStorageStat.bytes)
+        .outerjoin(Group, Group.id == GroupStorageStat.group_id)
+        .order_by(GroupStorageStat.bytes.desc())
+        .limit(limit)
+        .all()
+    )
+    db.close()
+    return rows
+
+def upload_history(days: int = 30):
+    """Return (day, uploads, bytes) rows for the last `days` days that had uploads."""
+    db = SessionLocal()
+    since = (datetime.utcnow() - timedelta(days=days)).date()
+    rows = (
+        db.query(DailyUploadStat.day, DailyUploadStat.uploads, DailyUploadStat.bytes)
+        .filter(DailyUploadStat.day > since)
+        .order_by(DailyUploadStat.day)
+        .all()
+    )
+    db.close()
+    return rows
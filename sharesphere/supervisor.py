@@ -0,0 +1,284 @@
+# sharesphere/supervisor.py
+
+"""
+Multi-process deployment for `sharesphere start --workers N`.
+
+Runs N Streamlit processes on consecutive local ports behind a small
+asyncio reverse proxy. A cookie pins each browser to one worker, because a
+Streamlit session, its websocket and its file uploads must all reach the
+same process. Workers are health-checked, restarted when they exit, and on
+shutdown the proxy stops accepting connections and waits for in-flight
+uploads before stopping the workers.
+"""
+
+from http.cookies import SimpleCookie
+import asyncio
+import logging
+import signal
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+COOKIE_NAME = "sharesphere_worker"
+HEAD_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 5
+HEALTH_CHECK_TIMEOUT = 2
+MAX_RESTART_DELAY = 30
+STOP_TIMEOUT = 10
+PIPE_CHUNK_SIZE = 64 * 1024
+
+
+class Worker:
+    def __init__(self, index: int, port: int, command: list):
+        self.index = index
+        self.port = port
+        self.command = command
+        self.process = None
+        self.healthy = False
+        self.connections = 0
+        self.uploads = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self.restart_delay = 1.0
+        self.restart_at = None
+
+    def spawn(self):
+        self.process = subprocess.Popen(self.command)
+        self.started_at = time.monotonic()
+        self.healthy = False
+        self.restart_at = None
+        logger.info(f"Worker {self.index} started on port {self.port} (pid {self.process.pid}).")
+
+    def exited(self) -> bool:
+        return self.process is not None and self.process.poll() is not None
+
+
+def _parse_head(head: bytes):
+    lines = head.decode("latin-1").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        if ":" in line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def _header(headers, name: str, default: str = "") -> str:
+    name = name.lower()
+    return next((value for key, value in headers if key.lower() == name), default)
+
+
+def _build_head(first_line: str, headers) -> bytes:
+    lines = [first_line] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _simple_response(status: str, message: str) -> bytes:
+    body = message.encode()
+    return (
+        f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode() + body
+
+
+class Supervisor:
+    def __init__(self, app_path: str, workers: int, port: int = 8501, host: str = "0.0.0.0", drain_timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.drain_timeout = drain_timeout
+        self.workers = [
+            Worker(index, port + 1 + index, [
+                sys.executable, "-m", "streamlit", "run", str(app_path),
+                "--server.port", str(port + 1 + index),
+                "--server.address", "127.0.0.1",
+                "--server.headless", "true",
+            ])
+            for index in range(workers)
+        ]
+        self.draining = False
+        self._stop = None
+
+    # --- Routing ---
+
+    def _choose_worker(self, headers):
+        """Return (worker, needs_cookie) honouring the affinity cookie while its worker is healthy."""
+        cookie = SimpleCookie()
+        try:
+            cookie.load(_header(headers, "cookie"))
+        except Exception:
+            pass
+        if COOKIE_NAME in cookie and cookie[COOKIE_NAME].value.isdigit():
+            index = int(cookie[COOKIE_NAME].value)
+            if index < len(self.workers) and self.workers[index].healthy:
+                return self.workers[index], False
+        healthy = [worker for worker in self.workers if worker.healthy]
+        if not healthy:
+            return None, False
+        return min(healthy, key=lambda worker: worker.connections), True
+
+    async def _pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(PIPE_CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_client(self, client_reader, client_writer):
+        try:
+            head = await asyncio.wait_for(client_reader.readuntil(b"\r\n\r\n"), HEAD_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            client_writer.close()
+            return
+
+        request_line, headers = _parse_head(head)
+        parts = request_line.split(" ")
+        method, path = (parts[0], parts[1]) if len(parts) >= 2 else ("", "")
+        worker, needs_cookie = self._choose_worker(headers)
+        if worker is None or self.draining:
+            client_writer.write(_simple_response("503 Service Unavailable", "ShareSphere is starting or shutting down."))
+            await client_writer.drain()
+            client_writer.close()
+            return
+
+        is_upgrade = "upgrade" in _header(headers, "connection").lower()
+        is_upload = method in ("PUT", "POST") and "/_stcore/upload_file" in path
+        if not is_upgrade:
+            # One request per connection lets the proxy see every request head
+            headers = [(name, value) for name, value in headers if name.lower() not in ("connection", "keep-alive", "proxy-connection")]
+            headers.append(("Connection", "close"))
+        peer = client_writer.get_extra_info("peername")
+        if peer:
+            headers.append(("X-Forwarded-For", str(peer[0])))
+
+        try:
+            backend_reader, backend_writer = await asyncio.open_connection("127.0.0.1", worker.port)
+        except OSError:
+            worker.healthy = False
+            client_writer.write(_simple_response("502 Bad Gateway", "Worker unavailable, please retry."))
+            await client_writer.drain()
+            client_writer.close()
+            return
+
+        worker.connections += 1
+        upload_pending = is_upload
+        if upload_pending:
+            worker.uploads += 1
+        upstream = None
+        try:
+            backend_writer.write(_build_head(request_line, headers))
+            await backend_writer.drain()
+            upstream = asyncio.create_task(self._pipe(client_reader, backend_writer))
+
+            # The response head arrives once the worker has consumed the whole upload
+            response_head = await backend_reader.readuntil(b"\r\n\r\n")
+            if upload_pending:
+                worker.uploads -= 1
+                upload_pending = False
+            if needs_cookie:
+                cookie = f"Set-Cookie: {COOKIE_NAME}={worker.index}; Path=/; HttpOnly; SameSite=Lax\r\n\r\n"
+                response_head = response_head[:-2] + cookie.encode()
+            client_writer.write(response_head)
+            await client_writer.drain()
+            await self._pipe(backend_reader, client_writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            if upload_pending:
+                worker.uploads -= 1
+            worker.connections -= 1
+            if upstream:
+                upstream.cancel()
+            backend_writer.close()
+            client_writer.close()
+
+    # --- Supervision ---
+
+    async def _check_health(self, worker) -> bool:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", worker.port), HEALTH_CHECK_TIMEOUT)
+            writer.write(b"GET /_stcore/health HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+            status_line = await asyncio.wait_for(reader.readline(), HEALTH_CHECK_TIMEOUT)
+            writer.close()
+            return b" 200 " in status_line
+        except (OSError, asyncio.TimeoutError):
+            return False
+
+    async def _monitor(self):
+        while True:
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.exited():
+                    if worker.restart_at is None:
+                        worker.healthy = False
+                        # Back off when a worker keeps crashing right after starting
+                        if now - worker.started_at < MAX_RESTART_DELAY:
+                            worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+                        else:
+                            worker.restart_delay = 1.0
+                        worker.restart_at = now + worker.restart_delay
+                        logger.warning(
+                            f"Worker {worker.index} exited with code {worker.process.returncode}; "
+                            f"restarting in {worker.restart_delay:.0f}s."
+                        )
+                    elif now >= worker.restart_at:
+                        worker.restarts += 1
+                        worker.spawn()
+                    continue
+                healthy = await self._check_health(worker)
+                if healthy != worker.healthy:
+                    logger.info(f"Worker {worker.index} is {'healthy' if healthy else 'unhealthy'}.")
+                worker.healthy = healthy
+            await asyncio.sleep(1 if any(not worker.healthy for worker in self.workers) else HEALTH_CHECK_INTERVAL)
+
+    async def _shutdown(self):
+        self.draining = True
+        deadline = time.monotonic() + self.drain_timeout
+        while sum(worker.uploads for worker in self.workers) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        remaining = sum(worker.uploads for worker in self.workers)
+        if remaining:
+            logger.warning(f"Stopping workers with {remaining} upload(s) still in flight after {self.drain_timeout}s.")
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                try:
+                    await asyncio.to_thread(worker.process.wait, STOP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+        logger.info("All workers stopped.")
+
+    async def run(self):
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stop.set)
+            except NotImplementedError:  # Windows
+                signal.signal(sig, lambda *_: loop.call_soon_threadsafe(self._stop.set))
+
+        for worker in self.workers:
+            worker.spawn()
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        monitor = asyncio.create_task(self._monitor())
+        logger.info(f"Proxy listening on {self.host}:{self.port} for {len(self.workers)} worker(s).")
+
+        await self._stop.wait()
+        logger.info("Shutting down: no longer accepting connections, draining uploads.")
+        server.close()
+        monitor.cancel()
+        await self._shutdown()
+
+
+def run_supervisor(app_path: str, workers: int, port: int = 8501, host: str = "0.0.0.0", drain_timeout: float = 30):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(Supervisor(app_path, workers, port, host, drain_timeout).run())
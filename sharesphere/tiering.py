@@ -0,0 +1,400 @@
+# sharesphere/tiering.py
+
+"""
+Storage tiering: files nobody has downloaded or previewed for
+`tiering.archive_after_days` move from the upload folder into compressed
+pack files under `tiering.folder`, which can sit on cheaper storage.
+
+- Downloads and previews record the file's last access through a batched
+  writer (`touch_file`), so the hot path never waits on the database.
+- `archive_cold_files`, run periodically by `sharesphere worker`, appends
+  cold files to a pack, fsyncs it, and only then marks the rows archived
+  and removes their hot copies.
+- `ensure_hot` brings an archived file back on access: it decompresses
+  its bytes from the pack, verifies them and puts them back at
+  File.filepath.
+
+Hot copies are removed while the archiving transaction holds the database
+write lock, so a rehydrated copy can never be deleted by mistake. Each
+copy is first renamed to a ".archiving" sidecar, and a journal lists the
+sidecars; if the process dies before the commit, the next run puts them
+back. A pack file is deleted once none of its files remain archived.
+"""
+
+from .background import BatchWriter
+from .config import get_config
+from .database import SessionLocal
+from .models import ArchivedFile, File
+from sqlalchemy import and_, delete, func, or_, update
+from datetime import datetime, timedelta
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 200
+TOUCH_FLUSH_INTERVAL_SECONDS = 5.0
+TOUCH_MAX_BATCH = 1000
+READ_SIZE = 1024 * 1024
+PACK_SUFFIX = ".pack"
+SIDECAR_SUFFIX = ".archiving"
+JOURNAL_NAME = "archiving.journal"
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "archive_after_days": 90,
+    "folder": "archive",
+    "pack_size_mb": 1024,
+    "compression_level": 6,
+}
+
+def tiering_settings() -> dict:
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(get_config().get("tiering", {}) or {})
+    return settings
+
+def archive_folder() -> Path:
+    return Path(tiering_settings()["folder"])
+
+# === Last access ===
+
+def _write_touches(file_ids):
+    db = SessionLocal()
+    try:
+        db.execute(update(File).where(File.id.in_(set(file_ids))).values(last_accessed_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+_touch_writer = BatchWriter("last-access-writer", _write_touches, TOUCH_FLUSH_INTERVAL_SECONDS, TOUCH_MAX_BATCH)
+
+def touch_file(file_id: int):
+    """Record that a file was just read; written to the database in the next batch."""
+    if file_id is not None:
+        _touch_writer.put(file_id)
+
+def flush_touches():
+    _touch_writer.flush()
+
+# === Packs ===
+
+def _identity(stat) -> tuple:
+    """What changes when a file is replaced or rewritten in place."""
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class _PackWriter:
+    """Appends compressed files to pack files, starting a new pack past the size limit."""
+
+    def __init__(self, folder: Path, pack_size: int, level: int):
+        self.folder = folder
+        self.pack_size = pack_size
+        self.level = level
+        self.file = None
+        self.name = None
+        self.written = []
+        folder.mkdir(parents=True, exist_ok=True)
+
+    def _open(self):
+        stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        fd, path = tempfile.mkstemp(dir=self.folder, prefix=f"pack-{stamp}-", suffix=PACK_SUFFIX)
+        self.file = os.fdopen(fd, "wb")
+        self.name = os.path.basename(path)
+        self.written.append(self.name)
+
+    def add(self, path):
+        """
+        Compress one file into the current pack.
+
+        Returns:
+            tuple: (ArchivedFile values, identity of the file that was read)
+        """
+        if self.file is None or self.file.tell() >= self.pack_size:
+            self.close()
+            self._open()
+        offset = self.file.tell()
+        compressor = zlib.compressobj(self.level)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, "rb") as f:
+                identity = _identity(os.fstat(f.fileno()))
+                for block in iter(lambda: f.read(READ_SIZE), b""):
+                    digest.update(block)
+                    size += len(block)
+                    self.file.write(compressor.compress(block))
+            self.file.write(compressor.flush())
+        except BaseException:
+            self.file.truncate(offset)
+            self.file.seek(offset)
+            raise
+        entry = {"pack": self.name, "offset": offset, "length": self.file.tell() - offset,
+                 "size": size, "checksum": digest.hexdigest()}
+        return entry, identity
+
+    def sync(self):
+        """Flush the current pack to disk, keeping it open for the next batch."""
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+def _read_packed(entry, out) -> str:
+    """Decompress an archived file into the binary file `out` and return its SHA-256."""
+    decompressor = zlib.decompressobj()
+    digest = hashlib.sha256()
+    remaining = entry.length
+    with open(archive_folder() / entry.pack, "rb") as f:
+        f.seek(entry.offset)
+        while remaining:
+            block = f.read(min(READ_SIZE, remaining))
+            if not block:
+                raise IOError(f"Archive pack {entry.pack} is truncated.")
+            remaining -= len(block)
+            data = decompressor.decompress(block)
+            digest.update(data)
+            out.write(data)
+    data = decompressor.flush()
+    digest.update(data)
+    out.write(data)
+    return digest.hexdigest()
+
+def release_archived(db, file_ids: list) -> set:
+    """
+    Delete the archive entries of `file_ids` within the caller's transaction.
+
+    Returns:
+        set: Packs they were in; pass them to `remove_dead_packs` after committing.
+    """
+    if not file_ids:
+        return set()
+    packs = {row.pack for row in db.query(ArchivedFile.pack).filter(ArchivedFile.file_id.in_(file_ids)).distinct()}
+    if packs:
+        db.execute(delete(ArchivedFile).where(ArchivedFile.file_id.in_(file_ids)))
+    return packs
+
+def remove_dead_packs(packs):
+    """Delete the pack files among `packs` that no archived file refers to any more."""
+    if not packs:
+        return
+    db = SessionLocal()
+    live = {row.pack for row in db.query(ArchivedFile.pack).filter(ArchivedFile.pack.in_(list(packs))).distinct()}
+    db.close()
+    for pack in set(packs) - live:
+        try:
+            os.remove(archive_folder() / pack)
+            logger.info(f"Removed archive pack {pack}; none of its files are archived any more.")
+        except FileNotFoundError:
+            pass
+
+# === Archiving ===
+
+def _journal_path() -> Path:
+    return archive_folder() / JOURNAL_NAME
+
+def recover_interrupted_archiving():
+    """Put back hot copies left in ".archiving" sidecars by a run that stopped before committing."""
+    journal = _journal_path()
+    if not journal.exists():
+        return
+    entries = json.loads(journal.read_text())
+    db = SessionLocal()
+    archived = {
+        row.id for row in db.query(File.id).filter(File.id.in_([file_id for file_id, _ in entries]), File.archived_at.isnot(None))
+    }
+    db.close()
+    for file_id, path in entries:
+        sidecar = path + SIDECAR_SUFFIX
+        if not os.path.exists(sidecar):
+            continue
+        if file_id in archived:
+            os.remove(sidecar)
+        else:
+            os.replace(sidecar, path)
+            logger.warning(f"Restored the hot copy of file ID {file_id} after an interrupted archiving run.")
+    journal.unlink()
+
+def archive_cold_files(days: int = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move files that have not been read for `days` (default `tiering.archive_after_days`)
+    into archive packs.
+
+    Returns:
+        int: Number of files archived.
+    """
+    settings = tiering_settings()
+    if not settings["enabled"] and days is None:
+        return 0
+    days = settings["archive_after_days"] if days is None else days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    recover_interrupted_archiving()
+    pack = _PackWriter(archive_folder(), int(settings["pack_size_mb"]) * 1024 * 1024, int(settings["compression_level"]))
+    archived_total = 0
+    last_id = 0
+    try:
+        while True:
+            db = SessionLocal()
+            try:
+                rows = (
+                    db.query(File.id, File.filepath)
+                    .filter(_is_cold(cutoff), File.id > last_id)
+                    .order_by(File.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    return archived_total
+                last_id = rows[-1].id
+                # A path shared by several rows (legacy same-name uploads) stays hot for all of them
+                shared_paths = {
+                    path for (path,) in db.query(File.filepath)
+                    .filter(File.filepath.in_([row.filepath for row in rows]))
+                    .group_by(File.filepath)
+                    .having(func.count(File.id) > 1)
+                }
+                entries = {}
+                identities = {}
+                for row in rows:
+                    if row.filepath in shared_paths:
+                        continue
+                    try:
+                        entries[row.id], identities[row.id] = pack.add(row.filepath)
+                    except FileNotFoundError:
+                        logger.warning(f"Not archiving file ID {row.id}: '{row.filepath}' is missing.")
+                    except OSError as e:
+                        logger.error(f"Not archiving file ID {row.id}: could not read '{row.filepath}': {e}")
+                if not entries:
+                    continue
+                pack.sync()  # fsync before any hot copy goes away
+                archived_total += _commit_batch(db, rows, entries, identities, cutoff)
+            finally:
+                db.close()
+    finally:
+        pack.close()
+        remove_dead_packs(pack.written)
+
+def _is_cold(cutoff: datetime):
+    """Live, hot files neither uploaded nor read since `cutoff`."""
+    return and_(
+        File.archived_at.is_(None), File.deleted_at.is_(None), File.uploaded_at < cutoff,
+        or_(File.last_accessed_at.is_(None), File.last_accessed_at < cutoff),
+    )
+
+def _commit_batch(db, rows, entries: dict, identities: dict, cutoff: datetime) -> int:
+    now = datetime.utcnow()
+    paths = {row.id: row.filepath for row in rows}
+    # Skip rows read or re-uploaded while the batch was packed; this UPDATE also takes the write lock
+    claimed = [
+        file_id for file_id, in db.execute(
+            update(File).where(File.id.in_(list(entries)), _is_cold(cutoff)).values(archived_at=now).returning(File.id)
+        )
+    ]
+    if not claimed:
+        db.rollback()
+        return 0
+    journal = _journal_path()
+    journal.write_text(json.dumps([[file_id, paths[file_id]] for file_id in claimed]))
+    moved = []
+    try:
+        for file_id in claimed:
+            sidecar = paths[file_id] + SIDECAR_SUFFIX
+            os.replace(paths[file_id], sidecar)
+            if _identity(os.stat(sidecar)) != identities[file_id]:
+                # Replaced by a new version since it was packed: keep it hot
+                os.replace(sidecar, paths[file_id])
+                continue
+            moved.append(file_id)
+        stale = set(entries) - set(moved)
+        if stale:
+            db.execute(update(File).where(File.id.in_(list(stale))).values(archived_at=None))
+        if moved:
+            db.bulk_insert_mappings(ArchivedFile, [dict(entries[file_id], file_id=file_id, archived_at=now) for file_id in moved])
+        db.commit()
+    except BaseException:
+        db.rollback()
+        for file_id in moved:
+            os.replace(paths[file_id] + SIDECAR_SUFFIX, paths[file_id])
+        journal.unlink()
+        raise
+    for file_id in moved:
+        os.remove(paths[file_id] + SIDECAR_SUFFIX)
+    journal.unlink()
+    if moved:
+        logger.info(f"Archived {len(moved)} cold file(s).")
+    return len(moved)
+
+# === Rehydration ===
+
+def is_archived(file) -> bool:
+    return getattr(file, "archived_at", None) is not None
+
+def ensure_hot(file_id: int) -> bool:
+    """
+    Bring an archived file back to the upload folder; a no-op for hot files.
+
+    Returns:
+        bool: True if the file's content is at File.filepath afterwards.
+    """
+    db = SessionLocal()
+    row = (
+        db.query(File.id, File.filepath, File.archived_at, ArchivedFile.pack, ArchivedFile.offset,
+                 ArchivedFile.length, ArchivedFile.size, ArchivedFile.checksum)
+        .outerjoin(ArchivedFile, ArchivedFile.file_id == File.id)
+        .filter(File.id == file_id)
+        .first()
+    )
+    db.close()
+    if row is None:
+        return False
+    if row.archived_at is None:
+        return True
+    if row.pack is None:
+        logger.error(f"File ID {file_id} is marked archived but has no archive entry.")
+        return False
+
+    folder = os.path.dirname(row.filepath) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            checksum = _read_packed(row, out)
+        if checksum != row.checksum:
+            raise IOError(f"Archived content of file ID {file_id} failed its checksum.")
+        os.replace(tmp_path, row.filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    db = SessionLocal()
+    try:
+        restored = db.execute(
+            update(File)
+            .where(File.id == file_id, File.archived_at == row.archived_at)
+            .values(archived_at=None, last_accessed_at=datetime.utcnow())
+        )
+        if restored.rowcount:
+            db.execute(delete(ArchivedFile).where(ArchivedFile.file_id == file_id))
+        db.commit()
+    finally:
+        db.close()
+    if restored.rowcount:
+        logger.info(f"Restored file ID {file_id} from archive pack {row.pack}.")
+        remove_dead_packs({row.pack})
+    return True
+
+def archived_entry_ok(entry) -> bool:
+    """Return True if the pack of an ArchivedFile row exists and is long enough to hold it."""
+    try:
+        return os.path.getsize(archive_folder() / entry.pack) >= entry.offset + entry.length
+    except OSError:
+        return False
@@ -0,0 +1,338 @@
+# sharesphere/versioning.py
+
+"""
+Version history for files, stored as content-defined chunks.
+
+Every version of a file is split with FastCDC-style chunking (a gear rolling
+hash picks cut points from the content itself), and each chunk is stored
+once under `<upload folder>/.chunks/` keyed by its SHA-256. Inserting a few
+bytes only changes the chunks around the edit, so a new version of a large
+file costs little more than the chunks that actually changed. Any version is
+rebuilt by streaming its chunks in order.
+
+The current version is also kept as a plain file at File.filepath, so
+downloads and previews are unaffected. Chunking runs as a background job. A
+new version is written to a path of its own and File.filepath moves to it;
+if the outgoing version is not chunked yet, its file stays on disk as
+FileVersion.filepath until the job has stored it, so uploads never wait for
+chunking.
+
+A chunk blob found on disk is only relied on while holding SQLite's write
+lock: `store_version_chunks` checks its blobs again after claiming the
+version, and `remove_chunk_blobs` deletes blobs inside a write transaction,
+so a blob cannot be removed from under a version that has just started
+referencing it.
+"""
+
+from .config import get_config_service
+from .encryption import open_file, wrap_writer
+from .database import SessionLocal
+from .models import Chunk, File, FileVersion, VersionChunk
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+MIN_CHUNK_SIZE = 4 * 1024
+AVG_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+CHUNK_FOLDER = ".chunks"
+BATCH_SIZE = 500
+
+_MASK_64 = (1 << 64) - 1
+
+def _gear_table():
+    # Fixed pseudo-random values; they must never change or existing chunks stop deduplicating
+    return [int.from_bytes(hashlib.sha256(b"sharesphere-gear-%d" % i).digest()[:8], "big") for i in range(256)]
+
+def _high_bits(bits: int) -> int:
+    # The gear hash shifts left, so its high bits depend on the most bytes
+    return ((1 << bits) - 1) << (64 - bits)
+
+GEAR = _gear_table()
+_AVG_BITS = AVG_CHUNK_SIZE.bit_length() - 1
+# Normalized chunking: cutting is harder below the average size and easier above it
+MASK_SMALL = _high_bits(_AVG_BITS + 2)
+MASK_LARGE = _high_bits(_AVG_BITS - 2)
+
+def cut_point(data, length: int) -> int:
+    """Return the length of the first chunk of `data[:length]`."""
+    if length <= MIN_CHUNK_SIZE:
+        return length
+    end = min(length, MAX_CHUNK_SIZE)
+    normal = min(end, AVG_CHUNK_SIZE)
+    gear = GEAR
+    h = 0
+    position = MIN_CHUNK_SIZE
+    view = memoryview(data)
+    for byte in view[MIN_CHUNK_SIZE:normal]:
+        h = ((h << 1) + gear[byte]) & _MASK_64
+        position += 1
+        if not h & MASK_SMALL:
+            return position
+    for byte in view[normal:end]:
+        h = ((h << 1) + gear[byte]) & _MASK_64
+        position += 1
+        if not h & MASK_LARGE:
+            return position
+    return end
+
+def iter_chunks(f):
+    """Yield the content-defined chunks of the binary file object `f`."""
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK_SIZE:
+            block = f.read(READ_SIZE)
+            if block:
+                buffer += block
+            else:
+                eof = True
+        if not buffer:
+            return
+        length = cut_point(buffer, len(buffer))
+        yield bytes(buffer[:length])
+        del buffer[:length]
+
+def chunk_path(digest: str) -> Path:
+    folder = get_config_service().get().upload.folder
+    return Path(folder) / CHUNK_FOLDER / digest[:2] / digest
+
+def _write_chunk(digest: str, data: bytes):
+    path = chunk_path(digest)
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    with wrap_writer(os.fdopen(fd, "wb")) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def current_version(db, file) -> FileVersion:
+    """Return the FileVersion for the working copy of `file`, creating it for files uploaded before versioning."""
+    number = file.version or 1
+    version = db.query(FileVersion).filter(FileVersion.file_id == file.id, FileVersion.version == number).first()
+    if version is None:
+        db.execute(
+            sqlite_insert(FileVersion.__table__).on_conflict_do_nothing(),
+            {"file_id": file.id, "version": number, "size": file.size, "uploaded_by": file.owner_id,
+             "comment": file.comment, "created_at": file.uploaded_at or datetime.utcnow()},
+        )
+        db.commit()
+        version = db.query(FileVersion).filter(FileVersion.file_id == file.id, FileVersion.version == number).first()
+    return version
+
+def _chunk_source(db, version):
+    """Return the path holding a version's bytes: its own file once superseded, else the working copy."""
+    if version.filepath is not None:
+        return version.filepath
+    file = db.get(File, version.file_id)
+    if file is None:
+        return None
+    if (file.version or 1) != version.version:
+        raise RuntimeError(f"The bytes of version {version.version} of file ID {file.id} are gone.")
+    return file.filepath
+
+def _rewrite_missing_chunks(source: str, digests: set):
+    """Write the blobs of `digests` that are not on disk, re-reading them from `source`."""
+    missing = {digest for digest in digests if not chunk_path(digest).exists()}
+    if not missing:
+        return
+    logger.warning(f"{len(missing)} chunk(s) were removed while being stored; writing them again.")
+    with open_file(source) as f:
+        for data in iter_chunks(f):
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in missing:
+                _write_chunk(digest, data)
+                missing.discard(digest)
+
+def store_version_chunks(version_id: int) -> bool:
+    """
+    Chunk a version into the chunk store.
+
+    Safe to run concurrently and repeatedly: only the first caller to mark
+    the version as chunked records its chunk list and reference counts. A
+    superseded version's own file is removed once it is stored.
+
+    Returns:
+        bool: True if this call stored the version.
+    """
+    db = SessionLocal()
+    try:
+        version = db.get(FileVersion, version_id)
+        if version is None or version.chunked_at is not None:
+            return False
+        source = _chunk_source(db, version)
+        if source is None:
+            return False
+        file_id, number = version.file_id, version.version
+        # Ends the read transaction, so the claim below starts from the latest state
+        db.rollback()
+
+        digests = []
+        sizes = {}
+        whole = hashlib.sha256()
+        size = 0
+        # The open handle keeps reading these bytes even if the version is superseded meanwhile
+        with open_file(source) as f:
+            for data in iter_chunks(f):
+                digest = hashlib.sha256(data).hexdigest()
+                _write_chunk(digest, data)
+                digests.append(digest)
+                sizes[digest] = len(data)
+                whole.update(data)
+                size += len(data)
+
+        claimed = db.execute(
+            update(FileVersion)
+            .where(FileVersion.id == version_id, FileVersion.chunked_at.is_(None))
+            .values(chunked_at=datetime.utcnow(), checksum=whole.hexdigest(), size=size)
+        )
+        if claimed.rowcount != 1:
+            db.rollback()
+            return False
+        # The claim holds the write lock: the version cannot be superseded, nor its blobs removed, until commit
+        pending = db.query(FileVersion.filepath).filter(FileVersion.id == version_id).scalar()
+        if pending is not None:
+            db.execute(update(FileVersion).where(FileVersion.id == version_id).values(filepath=None))
+            # Rows from before same-name uploads got unique paths may still use the file
+            if db.query(File.id).filter(File.filepath == pending).first() is not None:
+                pending = None
+        if digests:
+            counts = Counter(digests)
+            stmt = sqlite_insert(Chunk.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["hash"],
+                set_={"refcount": Chunk.__table__.c.refcount + stmt.excluded.refcount},
+            )
+            db.execute(stmt, [{"hash": digest, "size": sizes[digest], "refcount": count} for digest, count in counts.items()])
+            db.execute(
+                sqlite_insert(VersionChunk.__table__),
+                [{"version_id": version_id, "seq": seq, "chunk_hash": digest} for seq, digest in enumerate(digests)],
+            )
+            _rewrite_missing_chunks(source, set(sizes))
+        db.commit()
+    finally:
+        db.close()
+    if pending is not None:
+        remove_version_files([pending])
+    logger.info(f"Stored version {number} of file ID {file_id}: {size} byte(s) in "
+                f"{len(digests)} chunk(s), {len(sizes)} distinct.")
+    return True
+
+def ensure_chunked(file_id: int):
+    """Store the current version of a file now, if the background job has not done so yet."""
+    db = SessionLocal()
+    try:
+        file = db.get(File, file_id)
+        if file is None:
+            return
+        version = current_version(db, file)
+        version_id, chunked = version.id, version.chunked_at is not None
+    finally:
+        db.close()
+    if not chunked:
+        store_version_chunks(version_id)
+
+def list_versions(file_id: int):
+    """Return the (id, version, size, comment, uploaded_by, created_at, chunked_at) rows of a file, newest first."""
+    db = SessionLocal()
+    rows = (
+        db.query(FileVersion.id, FileVersion.version, FileVersion.size, FileVersion.comment,
+                 FileVersion.uploaded_by, FileVersion.created_at, FileVersion.chunked_at)
+        .filter(FileVersion.file_id == file_id)
+        .order_by(FileVersion.version.desc())
+        .all()
+    )
+    db.close()
+    return rows
+
+def iter_version(version_id: int):
+    """Yield the bytes of a stored version, chunk by chunk."""
+    db = SessionLocal()
+    hashes = [
+        row.chunk_hash for row in
+        db.query(VersionChunk.chunk_hash).filter(VersionChunk.version_id == version_id).order_by(VersionChunk.seq)
+    ]
+    db.close()
+    for digest in hashes:
+        with open_file(chunk_path(digest)) as f:
+            yield f.read()
+
+def release_versions(db, file_ids: list) -> tuple:
+    """
+    Delete the versions of `file_ids` within the caller's transaction and
+    drop their chunk references.
+
+    Returns:
+        tuple: (hashes of chunks no longer referenced, files of versions
+        that were never chunked); pass them to `remove_chunk_blobs` and
+        `remove_version_files` after committing.
+    """
+    rows = db.query(FileVersion.id, FileVersion.filepath).filter(FileVersion.file_id.in_(file_ids)).all()
+    version_ids = [row.id for row in rows]
+    pending = [row.filepath for row in rows if row.filepath is not None]
+    if not version_ids:
+        return [], []
+    counts = Counter()
+    for start in range(0, len(version_ids), BATCH_SIZE):
+        batch = version_ids[start:start + BATCH_SIZE]
+        counts.update({
+            row.chunk_hash: row.uses for row in
+            db.query(VersionChunk.chunk_hash, func.count().label("uses"))
+            .filter(VersionChunk.version_id.in_(batch))
+            .group_by(VersionChunk.chunk_hash)
+        })
+        db.execute(delete(VersionChunk).where(VersionChunk.version_id.in_(batch)))
+        db.execute(delete(FileVersion).where(FileVersion.id.in_(batch)))
+    for digest, uses in counts.items():
+        db.execute(update(Chunk).where(Chunk.hash == digest).values(refcount=Chunk.refcount - uses))
+    dead = []
+    hashes = list(counts)
+    for start in range(0, len(hashes), BATCH_SIZE):
+        batch = hashes[start:start + BATCH_SIZE]
+        dead += [row.hash for row in db.query(Chunk.hash).filter(Chunk.hash.in_(batch), Chunk.refcount <= 0)]
+        db.execute(delete(Chunk).where(Chunk.hash.in_(batch), Chunk.refcount <= 0))
+    return dead, pending
+
+def remove_chunk_blobs(hashes: list):
+    """Remove the stored bytes of chunks whose rows are gone."""
+    if not hashes:
+        return
+    db = SessionLocal()
+    try:
+        for start in range(0, len(hashes), BATCH_SIZE):
+            batch = hashes[start:start + BATCH_SIZE]
+            # Takes the write lock (the rows are already gone), so no version can
+            # start using these chunks between the check below and the removal
+            db.execute(delete(Chunk).where(Chunk.hash.in_(batch), Chunk.refcount <= 0))
+            # A version chunked in the meantime may have brought a chunk back
+            revived = {row.hash for row in db.query(Chunk.hash).filter(Chunk.hash.in_(batch))}
+            for digest in batch:
+                if digest in revived:
+                    continue
+                try:
+                    os.remove(chunk_path(digest))
+                except FileNotFoundError:
+                    pass
+            db.commit()
+    finally:
+        db.close()
+
+def remove_version_files(paths: list):
+    """Remove the files of superseded versions whose rows are gone or no longer need them."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not remove the file of a superseded version '{path}': {e}")
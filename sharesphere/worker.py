@@ -0,0 +1,136 @@
+# sharesphere/worker.py
+
+"""
+Background worker service (`sharesphere worker`).
+
+The main process claims due jobs from the queue and hands them to a pool of
+worker processes, then records each outcome; retries and backoff are handled
+by sharesphere.jobs. It also runs the periodic maintenance tasks listed in
+MAINTENANCE_TASKS on threads of its own.
+"""
+
+from .activity import ROLLUP_INTERVAL_SECONDS, rollup_access_events
+from .admin import archive_group_requests
+from .background import PeriodicJob
+from .config import get_config
+from .database import init_db
+from .file_manager import purge_deleted_files, sweep_expired
+from .jobs import claim_jobs, complete_job, fail_job, heartbeat_jobs, requeue_stale_jobs, run_job
+from .stats import ensure_stats
+from .tiering import archive_cold_files
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 1.0
+STALE_CHECK_INTERVAL_SECONDS = 60
+# Well below jobs.stale_after, so a running job is never mistaken for an abandoned one
+HEARTBEAT_INTERVAL_SECONDS = 60
+PURGE_INTERVAL_SECONDS = 3600
+EXPIRY_SWEEP_INTERVAL_SECONDS = 300
+ARCHIVE_INTERVAL_SECONDS = 3600
+GROUP_REQUEST_ARCHIVE_INTERVAL_SECONDS = 86400
+
+# Periodic tasks the worker runs besides the job queue.
+MAINTENANCE_TASKS = [
+    PeriodicJob("access-rollup", rollup_access_events, ROLLUP_INTERVAL_SECONDS),
+    PeriodicJob("requeue-stale-jobs", requeue_stale_jobs, STALE_CHECK_INTERVAL_SECONDS),
+    PeriodicJob("trash-purge", purge_deleted_files, PURGE_INTERVAL_SECONDS),
+    PeriodicJob("expiry-sweep", sweep_expired, EXPIRY_SWEEP_INTERVAL_SECONDS),
+    PeriodicJob("archive-cold-files", archive_cold_files, ARCHIVE_INTERVAL_SECONDS),
+    PeriodicJob("archive-group-requests", archive_group_requests, GROUP_REQUEST_ARCHIVE_INTERVAL_SECONDS),
+]
+
+def setup_worker_logging():
+    """Log to worker.log in the configured logging folder; also used by the pool processes."""
+    config = get_config()
+    os.makedirs(config.logging.folder, exist_ok=True)
+    package_logger = logging.getLogger("sharesphere")
+    if not package_logger.handlers:
+        handler = logging.FileHandler(os.path.join(config.logging.folder, "worker.log"))
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(process)d %(name)s: %(message)s'))
+        package_logger.addHandler(handler)
+    package_logger.setLevel(getattr(logging, config.logging.level.upper(), logging.INFO))
+
+def _new_pool(processes: int):
+    # Spawned rather than forked, so children never inherit the parent's
+    # SQLite connections or threads.
+    return ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=setup_worker_logging,
+    )
+
+def run_worker(processes: int = 2, poll_interval: float = POLL_INTERVAL_SECONDS, stop_event: threading.Event = None):
+    """
+    Process jobs until SIGINT/SIGTERM (or `stop_event`) arrives.
+
+    Jobs already handed to the pool are allowed to finish before returning.
+    """
+    setup_worker_logging()
+    init_db()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda signum, frame: stop_event.set())
+
+    requeue_stale_jobs()
+    ensure_stats()
+    for task in MAINTENANCE_TASKS:
+        task.start()
+    logger.info(f"Worker {worker_id} started with {processes} process(es).")
+
+    pool = _new_pool(processes)
+    in_flight = {}
+    last_heartbeat = time.monotonic()
+    try:
+        while not stop_event.is_set() or in_flight:
+            if in_flight and time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL_SECONDS:
+                try:
+                    heartbeat_jobs(worker_id, [job_id for job_id, _, _, _ in in_flight.values()])
+                except Exception as e:
+                    logger.error(f"Could not refresh the locks of running jobs: {e}")
+                last_heartbeat = time.monotonic()
+            free = processes - len(in_flight)
+            if free > 0 and not stop_event.is_set():
+                for job_id, kind, payload, attempts, max_attempts in claim_jobs(worker_id, free):
+                    try:
+                        future = pool.submit(run_job, kind, payload)
+                    except Exception as e:
+                        fail_job(job_id, f"Could not start job: {e}", attempts, max_attempts)
+                        continue
+                    in_flight[future] = (job_id, kind, attempts, max_attempts)
+            if not in_flight:
+                stop_event.wait(poll_interval)
+                continue
+
+            done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job_id, kind, attempts, max_attempts = in_flight.pop(future)
+                try:
+                    future.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    fail_job(job_id, f"Worker process died: {e}", attempts, max_attempts)
+                except Exception as e:
+                    fail_job(job_id, f"{type(e).__name__}: {e}", attempts, max_attempts)
+                else:
+                    complete_job(job_id)
+                    logger.debug(f"Job {job_id} ({kind}) done.")
+            if broken:
+                logger.error("A worker process died; restarting the process pool.")
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _new_pool(processes)
+    finally:
+        pool.shutdown(wait=True)
+        logger.info(f"Worker {worker_id} stopped.")